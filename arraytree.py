@@ -0,0 +1,576 @@
+"""
+A compact tree that keeps everything in arrays rather than one Python object per node.
+
+An ete3 Tree costs hundreds of bytes per node and is slow to parse. Here the nodes are numbered, and we keep
+the parent of each node, the children (as offsets into one array), the names, the branch lengths, and the
+jplace edge numbers (the {n} annotations) in arrays indexed by node number.
+
+The tree and its nodes have the parts of the ete3 API that we use (traverse, get_children, get_leaves,
+name, dist, up, set_outgroup, write), so the rest of the code works with either. The nodes are light
+weight views onto the arrays that are made as you need them. Newick files written by this tree are the
+same as the ones ete3 writes with format=1. If you really need an ete3 tree, use to_ete().
+"""
+
+import re
+from array import array
+
+# these are the characters that ete3 replaces with _ when it writes a newick file
+_illegal_newick_re = re.compile(r'[:;(),\[\]\t\n\r=]')
+_token_re = re.compile(r"""\s*(?:([(),;])|('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|([^(),;'"]+))""", re.S)
+_edge_re = re.compile(r'\{(\d+)\}\s*$')
+_float_formatter = "%0.6g"
+
+
+class NewickParseError(ValueError):
+    """
+    We could not parse the newick string
+    """
+    pass
+
+
+class ArrayNode:
+    """
+    A view of one node in an ArrayTree.
+    """
+
+    __slots__ = ('tree', 'idx')
+
+    def __init__(self, tree, idx):
+        self.tree = tree
+        self.idx = idx
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayNode) and self.idx == other.idx and self.tree is other.tree
+
+    def __hash__(self):
+        return hash(self.idx)
+
+    def __repr__(self):
+        return "ArrayNode({}, {!r})".format(self.idx, self.name)
+
+    @property
+    def name(self):
+        return self.tree.names[self.idx]
+
+    @name.setter
+    def name(self, value):
+        self.tree.names[self.idx] = value
+
+    @property
+    def dist(self):
+        return self.tree.dist[self.idx]
+
+    @dist.setter
+    def dist(self, value):
+        self.tree.dist[self.idx] = value
+
+    @property
+    def edge_num(self):
+        e = self.tree.edge_num[self.idx]
+        return None if e < 0 else e
+
+    @property
+    def up(self):
+        p = self.tree.parent[self.idx]
+        return None if p < 0 else ArrayNode(self.tree, p)
+
+    @property
+    def children(self):
+        return [ArrayNode(self.tree, c) for c in self.tree.child_ids(self.idx)]
+
+    def get_children(self):
+        return self.children
+
+    def is_leaf(self):
+        return self.tree.offsets[self.idx] == self.tree.offsets[self.idx + 1]
+
+    def is_root(self):
+        return self.tree.parent[self.idx] < 0
+
+    def traverse(self, strategy="levelorder"):
+        """
+        Walk the subtree below this node (including this node)
+        :param strategy: preorder, postorder or levelorder
+        :return: a generator of the nodes
+        """
+
+        if strategy == "preorder":
+            ids = self.tree.preorder(self.idx)
+        elif strategy == "postorder":
+            ids = self.tree.postorder(self.idx)
+        elif strategy == "levelorder":
+            ids = self.tree.levelorder(self.idx)
+        else:
+            raise ValueError("Unknown traversal strategy {}".format(strategy))
+        for i in ids:
+            yield ArrayNode(self.tree, i)
+
+    def iter_descendants(self, strategy="levelorder"):
+        for n in self.traverse(strategy):
+            if n.idx != self.idx:
+                yield n
+
+    def iter_leaves(self):
+        for i in self.tree.preorder(self.idx):
+            if self.tree.offsets[i] == self.tree.offsets[i + 1]:
+                yield ArrayNode(self.tree, i)
+
+    def get_leaves(self):
+        return list(self.iter_leaves())
+
+    def get_leaf_names(self):
+        return [n.name for n in self.iter_leaves()]
+
+
+class ArrayTree:
+    """
+    A tree stored as arrays indexed by node number. The node numbers do not change when you reroot the tree.
+    """
+
+    def __init__(self, parent, offsets, children, names, dist, edge_num, root=0):
+        """
+        You probably want parse_newick or read_tree rather than this.
+        :param parent: array of the parent of each node (-1 for the root)
+        :param offsets: array of where the children of each node start in children. It has one more entry than nodes
+        :param children: array of the children of all the nodes
+        :param names: list of the node names
+        :param dist: array of the branch lengths
+        :param edge_num: array of the jplace edge numbers (-1 if the node doesn't have one)
+        :param root: the root node
+        """
+
+        self.parent = parent
+        self.offsets = offsets
+        self.children_ids = children
+        self.names = names
+        self.dist = dist
+        self.edge_num = edge_num
+        self.root = root
+        # the node at each jplace edge number
+        self.edge_nodes = {e: i for i, e in enumerate(edge_num) if e >= 0}
+
+    def __len__(self):
+        return len(self.names)
+
+    def node(self, idx):
+        return ArrayNode(self, idx)
+
+    def child_ids(self, idx):
+        return self.children_ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def preorder(self, start=None):
+        """
+        The node numbers in preorder
+        :param start: the node to start at. Default is the root
+        """
+
+        stack = [self.root if start is None else start]
+        offsets = self.offsets
+        children = self.children_ids
+        while stack:
+            i = stack.pop()
+            yield i
+            s, e = offsets[i], offsets[i + 1]
+            if s != e:
+                stack.extend(reversed(children[s:e]))
+
+    def postorder(self, start=None):
+        """
+        The node numbers in postorder
+        :param start: the node to start at. Default is the root
+        """
+
+        start = self.root if start is None else start
+        offsets = self.offsets
+        children = self.children_ids
+        stack = [(start, False)]
+        while stack:
+            i, visited = stack.pop()
+            s, e = offsets[i], offsets[i + 1]
+            if visited or s == e:
+                yield i
+                continue
+            stack.append((i, True))
+            stack.extend((c, False) for c in reversed(children[s:e]))
+
+    def levelorder(self, start=None):
+        """
+        The node numbers in level order
+        :param start: the node to start at. Default is the root
+        """
+
+        queue = [self.root if start is None else start]
+        for i in queue:
+            yield i
+            queue.extend(self.child_ids(i))
+
+    # the parts of the ete3 API that the root node provides
+
+    def _root_node(self):
+        return ArrayNode(self, self.root)
+
+    @property
+    def name(self):
+        return self.names[self.root]
+
+    @name.setter
+    def name(self, value):
+        self.names[self.root] = value
+
+    @property
+    def children(self):
+        return self._root_node().children
+
+    @property
+    def up(self):
+        return None
+
+    def get_children(self):
+        return self._root_node().children
+
+    def is_leaf(self):
+        return self._root_node().is_leaf()
+
+    def is_root(self):
+        return True
+
+    def traverse(self, strategy="levelorder"):
+        return self._root_node().traverse(strategy)
+
+    def iter_descendants(self, strategy="levelorder"):
+        return self._root_node().iter_descendants(strategy)
+
+    def iter_leaves(self):
+        return self._root_node().iter_leaves()
+
+    def get_leaves(self):
+        return self._root_node().get_leaves()
+
+    def get_leaf_names(self):
+        return self._root_node().get_leaf_names()
+
+    def _set_children(self, kids):
+        """
+        Rebuild the child arrays from a list of lists of children
+        :param kids: a list with the children of each node
+        """
+
+        offsets = array('i', [0])
+        children = array('i')
+        for k in kids:
+            children.extend(k)
+            offsets.append(len(children))
+        self.offsets = offsets
+        self.children_ids = children
+
+    def keep_nodes(self, keep):
+        """
+        Make a new tree from some of the nodes of this one. Each node in keep (other than the first, which becomes the
+        root) must have its parent in keep, and keep must be in preorder, which is what preorder() gives you.
+        :param keep: the node numbers to keep, in preorder
+        :return: the new ArrayTree
+        """
+
+        newids = {}
+        parent = array('i')
+        kids = []
+        for i in keep:
+            n = len(newids)
+            newids[i] = n
+            kids.append([])
+            if n == 0:
+                parent.append(-1)
+            else:
+                p = newids[self.parent[i]]
+                parent.append(p)
+                kids[p].append(n)
+        names = [self.names[i] for i in keep]
+        dist = array('d', (self.dist[i] for i in keep))
+        edge_num = array('i', (self.edge_num[i] for i in keep))
+
+        tree = ArrayTree(parent, array('i'), array('i'), names, dist, edge_num, 0)
+        tree._set_children(kids)
+        return tree
+
+    def collapse(self, is_leaf_fn):
+        """
+        Remove everything below the nodes that is_leaf_fn says are leaves, so that they become leaves. This is the
+        tree that write(is_leaf_fn=is_leaf_fn) writes, but we change this tree rather than making a new one. The
+        nodes are renumbered.
+        :param is_leaf_fn: a function that takes a node and returns True if it should become a leaf
+        """
+
+        keep = []
+        stack = [self.root]
+        while stack:
+            i = stack.pop()
+            keep.append(i)
+            if not is_leaf_fn(ArrayNode(self, i)):
+                stack.extend(reversed(self.child_ids(i)))
+        tree = self.keep_nodes(keep)
+        self.__dict__.update(tree.__dict__)
+
+    def set_outgroup(self, outgroup):
+        """
+        Reroot the tree so that outgroup is a child of the root. This is the same as ete3's set_outgroup,
+        including how the branch lengths are split, so the trees we write are the same.
+        :param outgroup: the node (or node number) to use as the outgroup
+        """
+
+        out = outgroup.idx if isinstance(outgroup, ArrayNode) else outgroup
+        root = self.root
+        if out == root:
+            raise ValueError("Cannot set the root as the outgroup")
+
+        kids = [list(self.child_ids(i)) for i in range(len(self.names))]
+        parent = list(self.parent)
+        dist = self.dist
+
+        parent_outgroup = parent[out]
+        n = out
+        while parent[n] != root:
+            n = parent[n]
+
+        kids[root].remove(n)
+        if len(kids[root]) != 1:
+            # make a new node to hold the other children of the root
+            connector = len(self.names)
+            self.names.append("")
+            dist.append(0.0)
+            self.edge_num.append(-1)
+            kids.append(kids[root])
+            parent.append(root)
+            for ch in kids[connector]:
+                parent[ch] = connector
+            kids[root] = []
+        else:
+            connector = kids[root][0]
+
+        if parent_outgroup != root:
+            # swap the parents and children on the path from the outgroup to the root
+            to_be_parent = parent_outgroup
+            to_be_child = parent[to_be_parent]
+            was_parent = -1
+            buffered_dist = dist[to_be_parent]
+            while to_be_child != root:
+                kids[to_be_parent].append(to_be_child)
+                kids[to_be_child].remove(to_be_parent)
+                buffered_dist, dist[to_be_child] = dist[to_be_child], buffered_dist
+                parent[to_be_parent] = was_parent
+                was_parent = to_be_parent
+                to_be_parent = to_be_child
+                to_be_child = parent[to_be_parent]
+
+            kids[to_be_parent].append(connector)
+            parent[connector] = to_be_parent
+            parent[to_be_parent] = was_parent
+            dist[connector] += buffered_dist
+            outgroup2 = parent_outgroup
+            kids[parent_outgroup].remove(out)
+            dist[outgroup2] = 0
+        else:
+            outgroup2 = connector
+
+        parent[out] = root
+        parent[outgroup2] = root
+        kids[root] = [out, outgroup2]
+        middist = (dist[outgroup2] + dist[out]) / 2
+        dist[out] = middist
+        dist[outgroup2] = middist
+
+        parent[root] = -1
+        self.parent = array('i', parent)
+        self._set_children(kids)
+
+    def write(self, outfile=None, format=1, is_leaf_fn=None):
+        """
+        Write the tree in newick format, the same way that ete3 does with format=1
+        :param outfile: the file to write to. If None we return the newick string
+        :param format: the newick format. Only format 1 (names and branch lengths) is supported
+        :param is_leaf_fn: a function that takes a node and returns True if we should treat it as a leaf
+        :return: the newick string if outfile is None
+        """
+
+        if format != 1:
+            raise ValueError("ArrayTree can only write newick format 1")
+
+        names = self.names
+        dist = self.dist
+        offsets = self.offsets
+        children = self.children_ids
+
+        def label(i):
+            return "{}:{}".format(newick_name(names[i]), _float_formatter % dist[i])
+
+        newick = []
+        stack = [(self.root, False)]
+        while stack:
+            i, visited = stack.pop()
+            if visited:
+                newick.append(")")
+                if i != self.root:
+                    newick.append(label(i))
+                continue
+            if i != self.root and newick and newick[-1] != "(":
+                newick.append(",")
+            s, e = offsets[i], offsets[i + 1]
+            if s == e or (is_leaf_fn and is_leaf_fn(ArrayNode(self, i))):
+                newick.append(label(i))
+            else:
+                newick.append("(")
+                stack.append((i, True))
+                stack.extend((c, False) for c in reversed(children[s:e]))
+        newick.append(";")
+        nw = "".join(newick)
+
+        if outfile is None:
+            return nw
+        with open(outfile, 'w') as out:
+            out.write(nw)
+
+    def to_ete(self):
+        """
+        Make an ete3 Tree with the same structure, names and branch lengths
+        :return: the ete3 Tree
+        """
+
+        from ete3 import Tree
+
+        tree = Tree()
+        tree.name = self.names[self.root]
+        tree.dist = self.dist[self.root]
+        nodes = {self.root: tree}
+        for i in self.preorder():
+            for c in self.child_ids(i):
+                nodes[c] = nodes[i].add_child(name=self.names[c], dist=self.dist[c])
+        return tree
+
+
+def newick_name(name):
+    """
+    The name as it is written in a newick file, with the characters that ete3 does not allow replaced with _
+    :param name: the node name
+    :return: the name in the newick file
+    """
+
+    return _illegal_newick_re.sub('_', name)
+
+
+def parse_newick(newick):
+    """
+    Parse a newick string (for example the tree in a jplace file) into an ArrayTree. The jplace
+    edge numbers may come after the branch lengths (name:0.1{5}) or before them (name{5}:0.1). Either way
+    we keep them in edge_num, and we name the nodes the same way that rename_tree_leaves.parse_jplacer_tree
+    does with ete3.
+    :param newick: the newick string
+    :return: the ArrayTree
+    """
+
+    parent = array('i')
+    names = []
+    dist = array('d')
+    edge_num = array('i')
+    kids = []
+    labels = []
+    edge_after_dist = False
+
+    def new_node(p):
+        parent.append(p)
+        names.append("")
+        dist.append(1.0)
+        edge_num.append(-1)
+        kids.append([])
+        labels.append([])
+        if p >= 0:
+            kids[p].append(len(names) - 1)
+        return len(names) - 1
+
+    current = new_node(-1)
+    last = current
+    pos = 0
+    ended = False
+    while pos < len(newick):
+        m = _token_re.match(newick, pos)
+        if not m or m.end() == pos:
+            if newick[pos:].strip():
+                raise NewickParseError("Could not parse the newick string at {}".format(newick[pos:pos+50]))
+            break
+        pos = m.end()
+        struct, quoted, text = m.groups()
+        if struct == '(':
+            current = new_node(current)
+            last = current
+        elif struct == ',':
+            if parent[current] < 0:
+                raise NewickParseError("Unexpected , at the top level of the newick string")
+            current = new_node(parent[current])
+            last = current
+        elif struct == ')':
+            if parent[current] < 0:
+                raise NewickParseError("Unbalanced ) in the newick string")
+            current = parent[current]
+            last = current
+        elif struct == ';':
+            ended = True
+            break
+        else:
+            labels[last].append((quoted, text))
+
+    if not ended and newick.strip():
+        raise NewickParseError("The newick string does not end with a ;")
+    if parent[current] >= 0:
+        raise NewickParseError("Unbalanced ( in the newick string")
+
+    for i, parts in enumerate(labels):
+        if not parts:
+            continue
+        name = ""
+        rest = ""
+        for quoted, text in parts:
+            if quoted is not None and not rest:
+                name += quoted[1:-1]
+            elif text is not None:
+                rest += text
+        if ':' in rest:
+            before, _, distance = rest.partition(':')
+            name += before.strip()
+            m = _edge_re.search(name)
+            if m:
+                edge_num[i] = int(m.group(1))
+            m = _edge_re.search(distance)
+            if m:
+                edge_num[i] = int(m.group(1))
+                distance = distance[:m.start()]
+                edge_after_dist = True
+            try:
+                dist[i] = float(distance)
+            except ValueError:
+                raise NewickParseError("Could not parse the branch length {} for {}".format(distance, name))
+        else:
+            name += rest.strip()
+            m = _edge_re.search(name)
+            if m:
+                edge_num[i] = int(m.group(1))
+        names[i] = name
+
+    root = 0
+    if not labels[root] or ':' not in "".join(t or "" for q, t in labels[root]):
+        dist[root] = 0.0
+    if edge_after_dist:
+        # the edge numbers come after the branch lengths, so the {n} at the root is not part of its name
+        names[root] = _edge_re.sub('', names[root]).strip()
+
+    tree = ArrayTree(parent, array('i'), array('i'), names, dist, edge_num, root)
+    tree._set_children(kids)
+    return tree
+
+
+def read_tree(treefile):
+    """
+    Read a newick file into an ArrayTree
+    :param treefile: the newick file
+    :return: the ArrayTree
+    """
+
+    with open(treefile, 'r') as f:
+        return parse_newick(f.read())
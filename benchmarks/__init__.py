@@ -0,0 +1,9 @@
+"""
+Benchmarks for pbj_placer.
+
+generate.py makes synthetic data sets (a taxonomy database, a tree, a jplace file, fastq files, and a classification
+file) of any size, taxonomy.py points the scripts at the synthetic taxonomy, and run.py times the slow steps of the
+pipeline on them and writes the results as JSON so we can compare one version with another.
+
+    python3 -m benchmarks.run -s small -s medium -o results.json
+"""
@@ -0,0 +1,261 @@
+"""
+Make synthetic data sets for the benchmarks. Everything is made from a random seed, so the same arguments always
+make the same data set.
+
+    python3 -m benchmarks.generate -o bench_data -l 10000 -r 100000 -f 8
+
+makes bench_data/taxonomy.sqlite, bench_data/placements.jplace, a directory of fastq files in bench_data/fastq, and
+bench_data/classification.tsv.
+"""
+
+import os
+import sys
+import gzip
+import json
+import random
+import sqlite3
+import argparse
+
+# the ranks below the superkingdoms in the synthetic taxonomy
+ranks = ['phylum', 'class', 'order', 'family', 'genus', 'species']
+superkingdoms = [(2, 'Bacteria'), (2157, 'Archaea'), (2759, 'Eukaryota')]
+jplace_fields = ["distal_length", "edge_num", "like_weight_ratio", "likelihood", "pendant_length"]
+sample_groups = ['shark', 'fish', 'ray']
+
+
+def make_taxonomy(dbfile, nspecies, seed=1):
+    """
+    Make a small taxonomy database with the same nodes and names tables as the NCBI taxonomy SQLite database.
+    There are three superkingdoms under cellular organisms, and about three times as many nodes at each rank as
+    at the rank above it, down to nspecies species.
+    :param dbfile: the database file to write
+    :param nspecies: the number of species
+    :param seed: the random seed
+    :return: a list of the species taxids, and a dict of taxid -> parent
+    """
+
+    rand = random.Random(seed)
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+    con = sqlite3.connect(dbfile)
+    con.execute("CREATE TABLE nodes (tax_id INTEGER PRIMARY KEY, parent INTEGER, rank TEXT)")
+    con.execute("CREATE TABLE names (tax_id INTEGER, name TEXT, unique_name TEXT, name_class TEXT)")
+
+    nodes = [(1, 1, 'no rank'), (131567, 1, 'no rank')]
+    names = [(1, 'root'), (131567, 'cellular organisms')]
+    for tid, name in superkingdoms:
+        nodes.append((tid, 131567, 'superkingdom'))
+        names.append((tid, name))
+
+    parents = {}
+    above = [tid for tid, name in superkingdoms]
+    nexttid = 100000
+    for k, rank in enumerate(ranks):
+        count = max(len(above), nspecies // 3 ** (len(ranks) - k - 1))
+        level = []
+        for i in range(count):
+            nexttid += 1
+            # every node at the rank above gets at least one child
+            parent = above[i] if i < len(above) else rand.choice(above)
+            nodes.append((nexttid, parent, rank))
+            names.append((nexttid, "{}{}".format(rank, nexttid)))
+            parents[nexttid] = parent
+            level.append(nexttid)
+        above = level
+
+    con.executemany("INSERT INTO nodes VALUES (?, ?, ?)", nodes)
+    con.executemany("INSERT INTO names VALUES (?, ?, '', 'scientific name')", names)
+    con.execute("CREATE INDEX names_tax_id ON names (tax_id)")
+    con.commit()
+    con.close()
+
+    return above, parents
+
+
+def make_tree(taxids, parents, seed=1, shuffle=0.01):
+    """
+    Make a random binary tree with a leaf for each taxid. The leaves are sorted by their taxonomy, so most clades in
+    the tree are also clades in the taxonomy, and then a few of them are swapped so that some are not. Every edge has a
+    jplace edge number.
+    :param taxids: the taxids of the leaves
+    :param parents: the dict of taxid -> parent from make_taxonomy
+    :param seed: the random seed
+    :param shuffle: the fraction of leaves to swap with another leaf
+    :return: the newick string, and the number of edges
+    """
+
+    rand = random.Random(seed)
+
+    def lineage(t):
+        path = []
+        while t in parents:
+            t = parents[t]
+            path.append(t)
+        return path[::-1]
+
+    leaves = sorted(taxids, key=lineage)
+    for i in range(int(len(leaves) * shuffle)):
+        a, b = rand.randrange(len(leaves)), rand.randrange(len(leaves))
+        leaves[a], leaves[b] = leaves[b], leaves[a]
+
+    edge = [0]
+
+    def build(start, end):
+        if end - start == 1:
+            t = leaves[start]
+            s = "Leaf_{} [{}]".format(start, t)
+        else:
+            # split somewhere in the middle half, so the tree is not too deep
+            quarter = (end - start) // 4
+            mid = start + (end - start) // 2 + rand.randint(-quarter, quarter)
+            s = "({},{})".format(build(start, mid), build(mid, end))
+        s += ":{:.4f}{{{}}}".format(rand.random(), edge[0])
+        edge[0] += 1
+        return s
+
+    newick = build(0, len(leaves))
+    # the root doesn't have a branch length
+    newick = newick[:newick.rindex(':')] + "{{{}}};".format(edge[0] - 1)
+    return newick, edge[0]
+
+
+def read_names(nreads):
+    """
+    The names of the synthetic reads
+    :param nreads: the number of reads
+    :return: a list of the names
+    """
+
+    return ["read{}".format(i) for i in range(nreads)]
+
+
+def make_jplace(jplacef, newick, nedges, nreads, nm=0.5, maxedges=3, seed=1):
+    """
+    Write a jplace file that places nreads reads on the tree. Each record places one to maxedges reads on one to
+    maxedges edges. Records with several reads use nm (names and multiplicities), and the rest use n.
+    :param jplacef: the jplace file to write
+    :param newick: the tree from make_tree
+    :param nedges: the number of edges in the tree
+    :param nreads: the number of reads to place
+    :param nm: the fraction of records that use nm
+    :param maxedges: the most edges (and reads) in a record
+    :param seed: the random seed
+    :return: the number of placement records
+    """
+
+    rand = random.Random(seed)
+    names = read_names(nreads)
+    records = 0
+    with open(jplacef, 'w') as out:
+        out.write('{{"tree": {}, "fields": {}, "version": 3, "metadata": {{"invocation": "benchmarks.generate"}},\n'.format(
+            json.dumps(newick), json.dumps(jplace_fields)))
+        out.write(' "placements": [\n')
+        i = 0
+        while i < nreads:
+            edges = rand.sample(range(nedges - 1), rand.randint(1, maxedges))
+            lwr = [rand.random() for e in edges]
+            total = sum(lwr)
+            p = [[rand.random() / 10, e, w / total, -1000 * rand.random(), rand.random() / 10]
+                 for e, w in zip(edges, lwr)]
+            if rand.random() < nm:
+                k = rand.randint(1, maxedges)
+                record = {'p': p, 'nm': [[n, rand.randint(1, 5)] for n in names[i:i + k]]}
+                i += k
+            else:
+                record = {'p': p, 'n': [names[i]]}
+                i += 1
+            if records:
+                out.write(',\n')
+            out.write(json.dumps(record))
+            records += 1
+        out.write('\n ]\n}\n')
+    return records
+
+
+def make_fastq(directory, nreads, nfiles, unplaced=0.5, gz=False):
+    """
+    Write the reads to fastq files. Read i is in file i % nfiles, and there are also some reads that are not placed
+    on the tree.
+    :param directory: the directory to write the fastq files to
+    :param nreads: the number of reads that are placed on the tree
+    :param nfiles: the number of fastq files
+    :param unplaced: the number of reads that are not placed, as a fraction of nreads
+    :param gz: gzip the fastq files
+    :return: the list of fastq files
+    """
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    opener = gzip.open if gz else open
+    fqfiles = [os.path.join(directory, "sample{}.fastq{}".format(k, ".gz" if gz else "")) for k in range(nfiles)]
+    names = read_names(nreads) + ["unplaced{}".format(i) for i in range(int(nreads * unplaced))]
+    seq = "ACGT" * 25
+    qual = "I" * len(seq)
+    for k, f in enumerate(fqfiles):
+        with opener(f, 'wt') as out:
+            out.writelines("@{}\n{}\n+\n{}\n".format(n, seq, qual) for n in names[k::nfiles])
+    return fqfiles
+
+
+def make_classification(classifile, fqfiles):
+    """
+    Write the fastq classification file, with a group and a sample for each fastq file
+    :param classifile: the file to write
+    :param fqfiles: the fastq files
+    """
+
+    with open(classifile, 'w') as out:
+        for k, f in enumerate(fqfiles):
+            out.write("{}\t{}\t{}\n".format(os.path.basename(f), sample_groups[k % len(sample_groups)],
+                                            "sample{}".format(k)))
+
+
+def make_dataset(directory, nleaves, nreads, nfiles, nm=0.5, seed=1, verbose=False):
+    """
+    Make a whole data set
+    :param directory: the directory to write everything to
+    :param nleaves: the number of leaves in the tree (and species in the taxonomy)
+    :param nreads: the number of reads placed on the tree
+    :param nfiles: the number of fastq files
+    :param nm: the fraction of placement records that use nm
+    :param seed: the random seed
+    :param verbose: more output
+    :return: a dict of what we made -> path
+    """
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    paths = {
+        'taxonomy': os.path.join(directory, "taxonomy.sqlite"),
+        'jplace': os.path.join(directory, "placements.jplace"),
+        'fastq': os.path.join(directory, "fastq"),
+        'classification': os.path.join(directory, "classification.tsv"),
+    }
+
+    species, parents = make_taxonomy(paths['taxonomy'], nleaves, seed)
+    # there are at least nleaves species
+    newick, nedges = make_tree(species[:nleaves], parents, seed)
+    records = make_jplace(paths['jplace'], newick, nedges, nreads, nm, seed=seed)
+    fqfiles = make_fastq(paths['fastq'], nreads, nfiles)
+    make_classification(paths['classification'], fqfiles)
+    paths['fastq_files'] = fqfiles
+
+    if verbose:
+        sys.stderr.write("Made a tree with {} leaves, {} placement records for {} reads, and {} fastq files in {}\n".format(
+            nleaves, records, nreads, nfiles, directory))
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make a synthetic data set for the benchmarks')
+    parser.add_argument('-o', help='output directory', required=True)
+    parser.add_argument('-l', help='number of leaves in the tree (default 1000)', type=int, default=1000)
+    parser.add_argument('-r', help='number of reads placed on the tree (default 10000)', type=int, default=10000)
+    parser.add_argument('-f', help='number of fastq files (default 4)', type=int, default=4)
+    parser.add_argument('-m', help='fraction of placement records that use nm rather than n (default 0.5)', type=float,
+                        default=0.5)
+    parser.add_argument('-s', help='random seed (default 1)', type=int, default=1)
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    make_dataset(args.o, args.l, args.r, args.f, args.m, args.s, args.v)
@@ -0,0 +1,307 @@
+"""
+Time the slow steps of the pipeline on synthetic data sets of several sizes, and write the results as JSON.
+
+    python3 -m benchmarks.run -s small -s medium -o results.json
+    python3 -m benchmarks.run -s small -o new.json -c results.json
+
+Each benchmark is run -r times and we report the fastest and the median time. It is then run once more with
+tracemalloc to find the peak memory that Python allocated (use -m to skip that, as it is slow). With -c we also
+print how the times compare with an earlier results file.
+
+The data sets are made by benchmarks.generate in a temporary directory, unless you use -d to keep them (and to reuse
+them the next time).
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+from benchmarks.generate import make_dataset
+from benchmarks.taxonomy import synthetic_taxonomy
+from profiling import profiler
+
+# the size of each data set
+scales = {
+    'small': {'leaves': 1000, 'reads': 10000, 'files': 4},
+    'medium': {'leaves': 10000, 'reads': 100000, 'files': 8},
+    'large': {'leaves': 100000, 'reads': 1000000, 'files': 16},
+}
+
+
+class Benchmark:
+    """
+    One step of the pipeline to time. setup makes whatever the step needs (and is not timed), and run is the step.
+    """
+
+    def __init__(self, name, run, setup=None):
+        """
+        :param name: the name of the benchmark
+        :param run: a function of the data set and the result of setup
+        :param setup: a function of the data set, called before every run
+        """
+
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+
+def prepared(ds, what):
+    """
+    The things the later steps need, which we only make once for each data set
+    :param ds: the data set from make_dataset
+    :param what: one of data, tree, mapping, or labels
+    :return: the jplace data, the renamed tree, the PlacementMapping, or the labels from create_multibar.label_columns
+    """
+
+    from rename_tree_leaves import load_jplacer
+    from count_matrix import placement_mapping
+    import pbj_placer
+    import fastq2ids
+    import create_multibar
+
+    if what not in ds:
+        if what == 'data':
+            ds['data'] = load_jplacer(ds['jplace'])
+        elif what == 'tree':
+            ds['tree'] = pbj_placer.build_tree(prepared(ds, 'data'))
+        elif what == 'mapping':
+            ds['mapping'] = placement_mapping(pbj_placer.placement_rows(prepared(ds, 'data'), prepared(ds, 'tree')))
+        elif what == 'labels':
+            rows = fastq2ids.classify_leaves(prepared(ds, 'mapping').read_codes.values, ds['fastq_files'],
+                                             ds['classification'], threads=1)
+            ds['labels'] = create_multibar.label_columns(rows, [4])[4]
+    return ds[what]
+
+
+def _load_jplacer(ds, state):
+    from rename_tree_leaves import load_jplacer, parse_jplacer_tree
+    return parse_jplacer_tree(load_jplacer(ds['jplace']))
+
+
+def _parse_tree(ds):
+    from rename_tree_leaves import parse_jplacer_tree
+    return parse_jplacer_tree(prepared(ds, 'data'))
+
+
+def _rename_nodes_ncbi(ds, tree):
+    from rename_tree_leaves import rename_nodes_ncbi
+    return rename_nodes_ncbi(tree)
+
+
+def _get_placements(ds, data):
+    from rename_tree_leaves import get_placements
+    n = 0
+    for edge, ids in get_placements(data):
+        n += len(ids)
+    return n
+
+
+def _fq_ids(ds, state):
+    import fastq2ids
+    return fastq2ids.fq_ids(ds['fastq_files'], threads=ds['threads'])
+
+
+def _labels_and_mapping(ds):
+    return prepared(ds, 'labels'), prepared(ds, 'mapping')
+
+
+def _remap(ds, state):
+    import create_multibar
+    (data, counts), mapping = state
+    return create_multibar.remap(data, mapping).select_labels(counts)
+
+
+def _remapped(ds):
+    if 'remapped' not in ds:
+        ds['remapped'] = _remap(ds, _labels_and_mapping(ds))
+    return prepared(ds, 'tree'), ds['remapped']
+
+
+def _multibar_counts(ds, state):
+    import create_multibar
+    tree, matrix = state
+    return create_multibar.multibar_counts(tree, matrix, 'r_class', False)
+
+
+benchmarks = [
+    Benchmark('load_jplacer', _load_jplacer),
+    Benchmark('rename_nodes_ncbi', _rename_nodes_ncbi, _parse_tree),
+    Benchmark('get_placements', _get_placements, lambda ds: prepared(ds, 'data')),
+    Benchmark('fq_ids', _fq_ids),
+    Benchmark('remap', _remap, _labels_and_mapping),
+    Benchmark('multibar_counts', _multibar_counts, _remapped),
+]
+
+
+def measure(bench, ds, repeat=3, memory=True):
+    """
+    Time one benchmark
+    :param bench: the Benchmark
+    :param ds: the data set
+    :param repeat: how many times to run it
+    :param memory: also run it with tracemalloc to find the peak memory
+    :return: a dict of the results
+    """
+
+    times = []
+    counters = {}
+    for i in range(repeat):
+        state = bench.setup(ds) if bench.setup else None
+        gc.collect()
+        if i == 0:
+            # count the work the first time through, so the counters are for one run
+            profiler.reset()
+            profiler.enabled = True
+        start = time.perf_counter()
+        bench.run(ds, state)
+        times.append(time.perf_counter() - start)
+        if i == 0:
+            profiler.enabled = False
+            counters = profiler.counters
+
+    result = {'benchmark': bench.name, 'seconds': min(times), 'median': statistics.median(times), 'repeat': repeat,
+              'counters': counters}
+    if memory:
+        state = bench.setup(ds) if bench.setup else None
+        gc.collect()
+        tracemalloc.start()
+        bench.run(ds, state)
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def run_scale(scale, directory, names=None, repeat=3, memory=True, threads=1, verbose=False):
+    """
+    Make (or reuse) the data set for one scale, and run the benchmarks on it
+    :param scale: the name of the scale in scales
+    :param directory: the directory for the data set
+    :param names: the names of the benchmarks to run. Default is all of them
+    :param repeat: how many times to run each benchmark
+    :param memory: also measure the peak memory
+    :param threads: the number of processes for fq_ids
+    :param verbose: more output
+    :return: a list of the results
+    """
+
+    size = scales[scale]
+    params = os.path.join(directory, "params.json")
+    if os.path.exists(params):
+        with open(params, 'r') as f:
+            reuse = json.load(f) == size
+    else:
+        reuse = False
+    if reuse:
+        ds = {
+            'taxonomy': os.path.join(directory, "taxonomy.sqlite"),
+            'jplace': os.path.join(directory, "placements.jplace"),
+            'classification': os.path.join(directory, "classification.tsv"),
+            'fastq_files': sorted(os.path.join(directory, "fastq", f) for f in os.listdir(os.path.join(directory, "fastq"))),
+        }
+        if verbose:
+            sys.stderr.write("Using the {} data set in {}\n".format(scale, directory))
+    else:
+        if verbose:
+            sys.stderr.write("Making the {} data set in {}\n".format(scale, directory))
+        ds = make_dataset(directory, size['leaves'], size['reads'], size['files'], verbose=verbose)
+        with open(params, 'w') as out:
+            json.dump(size, out)
+    ds['threads'] = threads
+
+    results = []
+    with synthetic_taxonomy(ds['taxonomy']):
+        for bench in benchmarks:
+            if names and bench.name not in names:
+                continue
+            r = measure(bench, ds, repeat, memory)
+            r['scale'] = scale
+            r.update(size)
+            if verbose:
+                sys.stderr.write("{} {}: {:.3f} seconds{}\n".format(
+                    scale, bench.name, r['seconds'],
+                    ", {:.1f} MB".format(r['peak_bytes'] / 2**20) if 'peak_bytes' in r else ""))
+            results.append(r)
+    return results
+
+
+def environment():
+    """
+    Where the benchmarks were run, so we know which results we can compare
+    :return: a dict of the python and numpy versions, the platform, the git commit, and the date
+    """
+
+    import numpy
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        pass
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def compare(results, oldfile, out=sys.stdout):
+    """
+    Print how the times compare with an earlier results file
+    :param results: the results from run_scale
+    :param oldfile: the earlier JSON file from this script
+    :param out: where to print the comparison
+    """
+
+    with open(oldfile, 'r') as f:
+        old = {(r['benchmark'], r['scale']): r for r in json.load(f)['results']}
+    out.write("benchmark\tscale\told seconds\tnew seconds\tnew / old\n")
+    for r in results:
+        o = old.get((r['benchmark'], r['scale']))
+        if o is None:
+            continue
+        ratio = r['seconds'] / o['seconds'] if o['seconds'] else float('inf')
+        out.write("{}\t{}\t{:.4f}\t{:.4f}\t{:.2f}\n".format(r['benchmark'], r['scale'], o['seconds'], r['seconds'], ratio))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark pbj_placer on synthetic data')
+    parser.add_argument('-s', help='the size of the data set: {}. You can use more than one -s. Default is small'.format(
+        ", ".join(scales)), choices=list(scales), action='append')
+    parser.add_argument('-b', help='only run this benchmark: {}. You can use more than one -b'.format(
+        ", ".join(b.name for b in benchmarks)), choices=[b.name for b in benchmarks], action='append')
+    parser.add_argument('-o', help='JSON file to write the results to')
+    parser.add_argument('-c', help='compare the times with this earlier results file')
+    parser.add_argument('-d', help='keep the data sets in this directory (and reuse them if they are already there)')
+    parser.add_argument('-r', help='number of times to run each benchmark (default 3)', type=int, default=3)
+    parser.add_argument('-m', help="don't measure the peak memory", action='store_true')
+    parser.add_argument('-t', help='number of processes to read the fastq files with (default 1)', type=int, default=1)
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.s or ['small']:
+            directory = os.path.join(args.d or tmp, scale)
+            results.extend(run_scale(scale, directory, args.b, args.r, not args.m, args.t, args.v))
+
+    report = {'environment': environment(), 'results': results}
+    if args.o:
+        with open(args.o, 'w') as out:
+            json.dump(report, out, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+
+    if args.c:
+        compare(results, args.c)
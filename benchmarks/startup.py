@@ -0,0 +1,123 @@
+"""
+Check that the modules can be imported without side effects, and that each pbj_placer.py subcommand starts quickly.
+
+    python3 -m benchmarks.startup
+    python3 -m benchmarks.startup -b 0.5 -o startup.json
+
+Each module is imported in a new python process where the taxonomy database can't be opened, so a module that opens
+it (or queries it) when it is imported fails. Then each subcommand is run with -h -r times, and we report the
+fastest time. If any import fails, or any subcommand takes longer than the budget, we exit with status 1, so this
+can be run as a check before a release.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the subcommands to time. run is the pipeline, the others are the separate scripts
+commands = ['run', 'rename', 'labels', 'multibar', 'colorstrip', 'trim', 'children']
+
+# in the new process, replace the taxonomy module with one that fails if it is used, then import the module
+_import_code = """
+import sys, json, time, types
+taxon = types.ModuleType('taxon')
+def _opened(*args, **kwargs):
+    raise RuntimeError('the taxonomy database was used while importing')
+taxon.get_taxonomy_db = taxon.get_taxonomy = _opened
+sys.modules['taxon'] = taxon
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'numpy': 'numpy' in sys.modules}}))
+"""
+
+
+def modules():
+    """
+    The modules at the top of the repository
+    :return: a sorted list of the module names
+    """
+
+    return sorted(f[:-3] for f in os.listdir(repo) if f.endswith('.py'))
+
+
+def check_import(module):
+    """
+    Import a module in a new process where the taxonomy database can't be used
+    :param module: the module name
+    :return: a dict of the module, whether it imported, how long it took, whether it imported numpy, and the error
+    """
+
+    proc = subprocess.run([sys.executable, '-c', _import_code.format(repo=repo, module=module)],
+                          capture_output=True, text=True, cwd=repo)
+    result = {'module': module, 'ok': proc.returncode == 0}
+    if proc.returncode == 0:
+        result.update(json.loads(proc.stdout.strip().split("\n")[-1]))
+    else:
+        result['error'] = proc.stderr.strip().split("\n")[-1]
+    return result
+
+
+def startup_time(command, repeat=5):
+    """
+    Time how long a subcommand takes to start, by running it with -h
+    :param command: the subcommand of pbj_placer.py
+    :param repeat: how many times to run it
+    :return: the fastest time in seconds, or None if it failed
+    """
+
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.join(repo, 'pbj_placer.py'), command, '-h'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=repo)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return None
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the imports and the startup time of pbj_placer.py')
+    parser.add_argument('-b', help='the startup time budget for each subcommand, in seconds (default 0.5)',
+                        type=float, default=0.5)
+    parser.add_argument('-r', help='number of times to run each subcommand (default 5)', type=int, default=5)
+    parser.add_argument('-o', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    failed = False
+    imports = [check_import(m) for m in modules()]
+    for r in imports:
+        if r['ok']:
+            sys.stdout.write("import {}: {:.3f} seconds{}\n".format(r['module'], r['seconds'],
+                                                                   " (imports numpy)" if r['numpy'] else ""))
+        else:
+            sys.stdout.write("import {}: FAILED {}\n".format(r['module'], r['error']))
+            failed = True
+
+    # how long python takes to start at all, as the subcommands can't be quicker than that
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    baseline = time.perf_counter() - start
+
+    startup = []
+    for command in commands:
+        seconds = startup_time(command, args.r)
+        over = seconds is None or seconds > args.b
+        failed = failed or over
+        startup.append({'command': command, 'seconds': seconds, 'budget': args.b, 'over': over})
+        sys.stdout.write("pbj_placer.py {} -h: {}{}\n".format(
+            command, "FAILED" if seconds is None else "{:.3f} seconds".format(seconds),
+            " (over the budget of {} seconds)".format(args.b) if over else ""))
+    sys.stdout.write("python itself starts in {:.3f} seconds\n".format(baseline))
+
+    if args.o:
+        with open(args.o, 'w') as out:
+            json.dump({'python': baseline, 'imports': imports, 'startup': startup}, out, indent=1)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,73 @@
+"""
+Use the synthetic taxonomy database from generate.py instead of the NCBI taxonomy.
+
+taxon.get_taxonomy_db() always opens the real taxonomy database, so for the benchmarks we replace the functions the
+scripts imported from taxon with ones that read the synthetic database. The lineage cache is turned off, so every run
+does all the taxonomy lookups.
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+
+# the attributes of the nodes and names that lineage_cache uses from taxon.get_taxonomy
+TaxonNode = namedtuple('TaxonNode', ['taxid', 'parent', 'rank'])
+TaxonName = namedtuple('TaxonName', ['scientific_name'])
+
+
+def connect(dbfile):
+    """
+    Open the taxonomy database
+    :param dbfile: the database from generate.make_taxonomy
+    :return: a cursor, like taxon.get_taxonomy_db()
+    """
+
+    return sqlite3.connect(dbfile).cursor()
+
+
+def get_taxonomy(taxid, c):
+    """
+    Look up a taxid, like taxon.get_taxonomy()
+    :param taxid: the taxonomy id
+    :param c: the cursor from connect
+    :return: the TaxonNode and TaxonName, or None and None if the taxid is not in the database
+    """
+
+    row = c.execute("SELECT tax_id, parent, rank FROM nodes WHERE tax_id = ?", [int(taxid)]).fetchone()
+    if not row:
+        return None, None
+    name = c.execute("SELECT name FROM names WHERE tax_id = ? AND name_class = 'scientific name'",
+                     [int(taxid)]).fetchone()
+    return TaxonNode(*row), TaxonName(name[0] if name else None)
+
+
+@contextmanager
+def synthetic_taxonomy(dbfile):
+    """
+    Make the scripts use the synthetic taxonomy database while we are in this context
+    :param dbfile: the database from generate.make_taxonomy
+    """
+
+    import lineage_cache
+    import rename_tree_leaves
+    import fastq2ids
+
+    saved = (rename_tree_leaves.get_taxonomy_db, lineage_cache.get_taxonomy, fastq2ids.c, fastq2ids.lineages,
+             os.environ.get('PBJ_PLACER_CACHE'))
+    c = connect(dbfile)
+    rename_tree_leaves.get_taxonomy_db = lambda: connect(dbfile)
+    lineage_cache.get_taxonomy = get_taxonomy
+    fastq2ids.c = c
+    fastq2ids.lineages = lineage_cache.LineageCache(c, cachefile="")
+    os.environ['PBJ_PLACER_CACHE'] = ""
+    try:
+        yield
+    finally:
+        (rename_tree_leaves.get_taxonomy_db, lineage_cache.get_taxonomy, fastq2ids.c, fastq2ids.lineages,
+         cachefile) = saved
+        if cachefile is None:
+            del os.environ['PBJ_PLACER_CACHE']
+        else:
+            os.environ['PBJ_PLACER_CACHE'] = cachefile
+        c.connection.close()
@@ -0,0 +1,204 @@
+"""
+Write the placements and the leaf labels as columns of integer codes, rather than as tsv files.
+
+The placements file from rename_tree_leaves.py and the labels file from fastq2ids.py repeat the same long node names,
+fastq file names, and classifications on every line, and create_multibar.py and create_colorstrip.py have to split
+every line again. Instead we can write a directory with a NumPy array of integer codes for each column, and a table
+of the strings for each code:
+
+    sharks.placements/
+        format.json     what is in the directory
+        nodes.npy       the node code of each placement
+        reads.npy       the read code of each placement
+        weights.npy     the weight of each placement (only if the placements are weighted)
+        nodes.txt       the node names, one per line, in code order
+        reads.txt       the read ids, one per line, in code order
+
+    sharks.leaves.labels/
+        format.json
+        col0.npy        the code of the value in column 0 of each row (-1 if the row doesn't have that column)
+        col0.txt        the values in column 0, one per line, in code order
+        col1.npy ...
+
+The arrays are memory mapped when we read them, so we only read the parts we use. Use rename_tree_leaves.py -b and
+fastq2ids.py -b to write these, and give the directory to create_multibar.py or create_colorstrip.py instead of the file.
+"""
+
+import os
+import sys
+import json
+from array import array
+import numpy as np
+from count_matrix import Codes, PlacementMapping, placement_mapping
+
+format_version = 1
+
+
+def is_columnar(path):
+    """
+    Is this a directory written by this module rather than a tsv file
+    :param path: the file or directory
+    :return: True if it is a directory with a format.json
+    """
+
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "format.json"))
+
+
+def _write_format(directory, what, **info):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    info.update({'format': what, 'version': format_version})
+    with open(os.path.join(directory, "format.json"), 'w') as out:
+        json.dump(info, out)
+
+
+def _read_format(directory, what):
+    with open(os.path.join(directory, "format.json"), 'r') as f:
+        info = json.load(f)
+    if info.get('format') != what:
+        raise ValueError("{} has {}, not {}".format(directory, info.get('format'), what))
+    if info.get('version', 0) > format_version:
+        raise ValueError("{} was written by a newer version of pbj_placer".format(directory))
+    return info
+
+
+def write_strings(stringf, values):
+    """
+    Write a table of strings, one per line. None of them can have a newline in them.
+    :param stringf: the file to write
+    :param values: the strings
+    """
+
+    with open(stringf, 'w') as out:
+        out.writelines(v + "\n" for v in values)
+
+
+def read_strings(stringf):
+    """
+    Read a table of strings from write_strings
+    :param stringf: the file to read
+    :return: a list of the strings
+    """
+
+    with open(stringf, 'r') as f:
+        # the last line ends with a newline, so there is an extra empty string at the end
+        return f.read().split("\n")[:-1]
+
+
+def write_placement_columns(directory, placements, verbose=False):
+    """
+    Write the placements as columns
+    :param directory: the directory to write
+    :param placements: an iterable of [node name, read id] or [node name, read id, weight], like the lines of the
+        placements file
+    :param verbose: more output
+    :return: the PlacementMapping we wrote
+    """
+
+    mapping = placements if isinstance(placements, PlacementMapping) else placement_mapping(placements)
+    _write_format(directory, 'placements', weighted=mapping.weighted, placements=len(mapping))
+    np.save(os.path.join(directory, "nodes.npy"), mapping.nodes.astype(np.int32))
+    np.save(os.path.join(directory, "reads.npy"), mapping.reads.astype(np.int32))
+    if mapping.weighted:
+        np.save(os.path.join(directory, "weights.npy"), mapping.weights)
+    write_strings(os.path.join(directory, "nodes.txt"), mapping.node_codes.values)
+    write_strings(os.path.join(directory, "reads.txt"), mapping.read_codes.values)
+
+    if verbose:
+        sys.stderr.write("Wrote {} placements of {} reads on {} nodes to {}\n".format(
+            len(mapping), len(mapping.read_codes), len(mapping.node_codes), directory))
+    return mapping
+
+
+def read_placement_columns(directory, verbose=False):
+    """
+    Read the placements from write_placement_columns. The arrays are memory mapped.
+    :param directory: the directory
+    :param verbose: more output
+    :return: a PlacementMapping
+    """
+
+    info = _read_format(directory, 'placements')
+    nodes = np.load(os.path.join(directory, "nodes.npy"), mmap_mode='r')
+    reads = np.load(os.path.join(directory, "reads.npy"), mmap_mode='r')
+    if info['weighted']:
+        weights = np.load(os.path.join(directory, "weights.npy"), mmap_mode='r')
+    else:
+        weights = np.ones(len(nodes), dtype=np.float64)
+    node_codes = Codes.from_unique(read_strings(os.path.join(directory, "nodes.txt")))
+    read_codes = Codes.from_unique(read_strings(os.path.join(directory, "reads.txt")))
+
+    if verbose:
+        sys.stderr.write("After read_mapping: mapping has {} reads and {} nodes\n".format(len(read_codes), len(node_codes)))
+
+    return PlacementMapping(node_codes, read_codes, nodes, reads, weights, info['weighted'])
+
+
+def write_label_columns(directory, rows, verbose=False):
+    """
+    Write the rows of a labels file (e.g. from fastq2ids.classify_leaves) as columns. Empty values are stored as
+    missing, just as they are skipped when we read the tsv file.
+    :param directory: the directory to write
+    :param rows: the rows of the labels file, split into columns
+    :param verbose: more output
+    :return: the number of rows
+    """
+
+    codes = []
+    columns = []
+    n = 0
+    for p in rows:
+        while len(columns) < len(p):
+            codes.append(Codes())
+            columns.append(array('i', [-1]) * n)
+        for j, col in enumerate(columns):
+            if j < len(p) and p[j]:
+                col.append(codes[j].code(p[j]))
+            else:
+                col.append(-1)
+        n += 1
+
+    _write_format(directory, 'labels', columns=len(columns), rows=n)
+    for j, col in enumerate(columns):
+        np.save(os.path.join(directory, "col{}.npy".format(j)), np.frombuffer(col, dtype=np.int32))
+        write_strings(os.path.join(directory, "col{}.txt".format(j)), codes[j].values)
+
+    if verbose:
+        sys.stderr.write("Wrote {} rows of {} columns to {}\n".format(n, len(columns), directory))
+    return n
+
+
+def read_label_columns(directory, cols, verbose=False):
+    """
+    Read some of the columns from write_label_columns, with the same result as create_multibar.label_columns
+    :param directory: the directory
+    :param cols: the columns to use
+    :param verbose: more output
+    :return: a dict of column -> (a dict of the leaves and their labels, a dict of the labels and their counts)
+    """
+
+    info = _read_format(directory, 'labels')
+    leaves = read_strings(os.path.join(directory, "col0.txt"))
+    leafcodes = np.load(os.path.join(directory, "col0.npy"), mmap_mode='r')
+
+    labels = {}
+    for col in cols:
+        if col >= info['columns']:
+            data, counts = {}, {}
+        else:
+            values = read_strings(os.path.join(directory, "col{}.txt".format(col)))
+            codes = np.load(os.path.join(directory, "col{}.npy".format(col)), mmap_mode='r')
+            keep = np.flatnonzero((codes >= 0) & (leafcodes >= 0))
+            lc = np.asarray(leafcodes[keep], dtype=np.int64)
+            vc = np.asarray(codes[keep], dtype=np.int64)
+            # a later row for the same leaf wins, like it does in a dict
+            data = dict(zip([leaves[i] for i in lc.tolist()], [values[i] for i in vc.tolist()]))
+            # the number of different leaves with each label
+            pairs = np.unique(lc * max(len(values), 1) + vc)
+            n = np.bincount(pairs % max(len(values), 1), minlength=len(values))
+            counts = {v: c for v, c in zip(values, n.tolist()) if c}
+        if verbose:
+            sys.stderr.write("After read_labels: column {} has {} keys and counts has {} keys\n".format(
+                col, len(data), len(counts)))
+        labels[col] = (data, counts)
+    return labels
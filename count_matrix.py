@@ -0,0 +1,274 @@
+"""
+Count the reads placed on each node of the tree, by label, in a NumPy matrix.
+
+The mapping file from rename_tree_leaves.py and the labels file from fastq2ids.py can each have millions of
+lines, and adding them up one read at a time into nested dicts is slow. Instead we give every node name, read id,
+and label an integer code, and add up the placements with np.bincount into a nodes x labels matrix. The
+multibar and colorstrip writers all work from that matrix.
+"""
+
+import os
+import sys
+from array import array
+import numpy as np
+
+
+class Codes:
+    """
+    Give every distinct string an integer code, in the order we first see them.
+    """
+
+    def __init__(self, values=None):
+        """
+        :param values: the strings to start with (they get codes 0, 1, 2, ...)
+        """
+
+        self.index = {}
+        self.values = []
+        if values is not None:
+            for v in values:
+                self.code(v)
+
+    @classmethod
+    def from_unique(cls, values):
+        """
+        Make the Codes from a list of strings that are all different (e.g. the values of another Codes), which is
+        quicker than adding them one at a time
+        :param values: the list of strings
+        :return: the Codes
+        """
+
+        codes = cls()
+        codes.values = values
+        codes.index = {v: i for i, v in enumerate(values)}
+        return codes
+
+    def code(self, value):
+        """
+        Get the code for value, adding it if we have not seen it before
+        :param value: the string
+        :return: the code
+        """
+
+        c = self.index.get(value)
+        if c is None:
+            c = len(self.values)
+            self.index[value] = c
+            self.values.append(value)
+        return c
+
+    def get(self, value, default=-1):
+        return self.index.get(value, default)
+
+    def __contains__(self, value):
+        return value in self.index
+
+    def __len__(self):
+        return len(self.values)
+
+
+class PlacementMapping:
+    """
+    The mapping file from rename_tree_leaves.py as integer codes. Placement i puts read reads[i]
+    on the node nodes[i] with weight weights[i].
+    """
+
+    def __init__(self, node_codes, read_codes, nodes, reads, weights, weighted=False):
+        """
+        :param node_codes: the Codes of the node names
+        :param read_codes: the Codes of the read ids
+        :param nodes: NumPy array of node codes
+        :param reads: NumPy array of read codes
+        :param weights: NumPy array of weights
+        :param weighted: whether the weights came from the mapping file, otherwise they are all 1
+        """
+
+        self.node_codes = node_codes
+        self.read_codes = read_codes
+        self.nodes = nodes
+        self.reads = reads
+        self.weights = weights
+        self.weighted = weighted
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class CountMatrix:
+    """
+    The counts for rows (usually names of nodes in the tree) x labels.
+    """
+
+    def __init__(self, rows, labels, values):
+        """
+        :param rows: the list of row names
+        :param labels: the list of labels
+        :param values: the 2D NumPy array of counts
+        """
+
+        self.rows = rows
+        self.labels = labels
+        self.values = values
+
+    def __len__(self):
+        return len(self.rows)
+
+    def select_labels(self, labels):
+        """
+        Get a matrix with just these labels, in this order. Labels we have not seen are all 0
+        :param labels: the labels to keep
+        :return: a new CountMatrix
+        """
+
+        labels = list(labels)
+        if labels == self.labels:
+            return self
+        codes = Codes(self.labels)
+        values = np.zeros((len(self.rows), len(labels)), dtype=self.values.dtype)
+        for j, k in enumerate(labels):
+            c = codes.get(k)
+            if c >= 0:
+                values[:, j] = self.values[:, c]
+        return CountMatrix(self.rows, labels, values)
+
+    def split_labels(self):
+        """
+        Split a matrix from stack_labels back into one matrix per key. Rows that are all 0 for a key are dropped.
+        :return: a dict of key -> CountMatrix
+        """
+
+        columns = {}
+        for j, (key, label) in enumerate(self.labels):
+            columns.setdefault(key, []).append(j)
+        split = {}
+        for key, cols in columns.items():
+            values = self.values[:, cols]
+            keep = np.flatnonzero(values.any(axis=1))
+            split[key] = CountMatrix([self.rows[i] for i in keep.tolist()], [self.labels[j][1] for j in cols], values[keep])
+        return split
+
+    def column(self, label):
+        """
+        The non zero counts for one label
+        :param label: the label
+        :return: a list of tuples of (row name, count)
+        """
+
+        col = self.values[:, self.labels.index(label)]
+        return [(self.rows[i], v) for i, v in zip(np.flatnonzero(col > 0).tolist(), col[col > 0].tolist())]
+
+
+def read_placement_mapping(mapf, verbose=False):
+    """
+    Read the mapping file from rename_tree_leaves.py. If the file has a third column (from -w) that is the weight
+    of each placement, otherwise every placement has weight 1. A read is only placed on a node once.
+    :param mapf: the mapping file, or a directory from columnar.write_placement_columns
+    :param verbose: more output
+    :return: a PlacementMapping
+    """
+
+    if os.path.isdir(mapf):
+        from columnar import read_placement_columns
+        return read_placement_columns(mapf, verbose)
+
+    with open(mapf, 'r') as f:
+        # don't strip the leading tab from nodes without a name
+        return placement_mapping((l.rstrip("\n").split("\t") for l in f), verbose)
+
+
+def placement_mapping(placements, verbose=False):
+    """
+    Give the placements integer codes. A read is only placed on a node once.
+    :param placements: an iterable of [node name, read id] or [node name, read id, weight]
+    :param verbose: more output
+    :return: a PlacementMapping
+    """
+
+    node_codes = Codes()
+    read_codes = Codes()
+    nodes = array('q')
+    reads = array('q')
+    weights = array('d')
+    weighted = False
+    for p in placements:
+        if len(p) < 2:
+            continue
+        nodes.append(node_codes.code(p[0]))
+        reads.append(read_codes.code(p[1]))
+        if len(p) > 2:
+            weights.append(float(p[2]))
+            weighted = True
+        else:
+            weights.append(1)
+
+    nodes = np.frombuffer(nodes, dtype=np.int64)
+    reads = np.frombuffer(reads, dtype=np.int64)
+    weights = np.frombuffer(weights, dtype=np.float64)
+
+    # keep the first placement of each read on each node
+    _, keep = np.unique(reads * max(len(node_codes), 1) + nodes, return_index=True)
+    if len(keep) < len(nodes):
+        keep.sort()
+        nodes, reads, weights = nodes[keep], reads[keep], weights[keep]
+
+    if verbose:
+        sys.stderr.write("After read_mapping: mapping has {} reads and {} nodes\n".format(len(read_codes), len(node_codes)))
+
+    return PlacementMapping(node_codes, read_codes, nodes, reads, weights, weighted)
+
+
+def count_matrix(mapping, data, labels=None, verbose=False):
+    """
+    Add up the placements on each node for each label
+    :param mapping: the PlacementMapping
+    :param data: the dict of read id -> label
+    :param labels: the labels to count, in order. Default is every label of the mapped reads, in the order we see them
+    :param verbose: more output
+    :return: a CountMatrix of node name x label
+    """
+
+    label_codes = Codes(labels)
+    # the label code for every read, -1 if we are not counting that read
+    read_labels = np.full(len(mapping.read_codes), -1, dtype=np.int64)
+    for i, r in enumerate(mapping.read_codes.values):
+        lab = data.get(r)
+        if lab is None:
+            continue
+        read_labels[i] = label_codes.code(lab) if labels is None else label_codes.get(lab)
+
+    placed = read_labels[mapping.reads]
+    counted = placed >= 0
+    if verbose and not counted.all():
+        sys.stderr.write("{} placements are for reads without a label\n".format(len(counted) - int(counted.sum())))
+
+    nlabels = len(label_codes)
+    nnodes = len(mapping.node_codes)
+    cells = mapping.nodes[counted].astype(np.int64) * nlabels + placed[counted]
+    values = np.bincount(cells, weights=mapping.weights[counted], minlength=nnodes * nlabels)
+    if not mapping.weighted:
+        values = values.astype(np.int64)
+    values = values.reshape(nnodes, nlabels)
+
+    if verbose:
+        sys.stderr.write("Counted {} placements on {} nodes for {} labels\n".format(int(counted.sum()), nnodes, nlabels))
+
+    return CountMatrix(mapping.node_codes.values, label_codes.values, values)
+
+
+def stack_labels(matrices):
+    """
+    Put several matrices with the same rows side by side, so we can add them all up at once
+    :param matrices: a dict of key -> CountMatrix
+    :return: a CountMatrix whose labels are tuples of (key, label)
+    """
+
+    rows = None
+    labels = []
+    for key, m in matrices.items():
+        if rows is None:
+            rows = m.rows
+        elif m.rows != rows:
+            raise ValueError("Can not stack count matrices that have different rows")
+        labels.extend((key, l) for l in m.labels)
+    values = np.hstack([m.values for m in matrices.values()])
+    return CountMatrix(rows, labels, values)
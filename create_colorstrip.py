@@ -5,69 +5,59 @@ Create a color strip file from a tsv file that has the sequence ids.
 import os
 import sys
 import argparse
+import numpy as np
+from count_matrix import read_placement_mapping, count_matrix
+import columnar
+from leaf_labels import read_label_rows
+from profiling import profiler, add_profile_arguments, start_profile, write_profile
 
 def read_labels(lf, col, verbose=False):
     """
     Read the labels file and return a dict with tree labels and values
-    :param lf: labels file
+    :param lf: labels file, or a directory from fastq2ids.py -b
     :param col: the column to use
     :param verbose: extra output
     :return: a dict
     """
 
+    if columnar.is_columnar(lf):
+        return columnar.read_label_columns(lf, [col], verbose)[col][0]
+
     ret = {}
-    with open(lf, 'r') as f:
-        for l in f:
-            p = l.strip().split("\t")
-            if len(p) < col:
-                continue
-            if not p[col]:
-                continue
-            ret[p[0]] = p[col]
+    for p in read_label_rows(lf, verbose):
+        if len(p) <= col:
+            continue
+        if not p[col]:
+            continue
+        ret[p[0]] = p[col]
     return ret
 
 def read_mapping(mapf, verbose=False):
     """
     Read the mapping from metagenomes to nodes in the tree
-    :param mapf: the mapping file
+    :param mapf: the mapping file, or a directory from rename_tree_leaves.py -b
     :param verbose: more output
-    :return:
+    :return: the PlacementMapping with the metagenome read ids and nodes in the tree as integer codes
     """
 
-    mapping = {}
-    with open(mapf, 'r') as f:
-        for l in f:
-            p = l.strip().split("\t")
-            if p[1] not in mapping:
-                mapping[p[1]] = set()
-            mapping[p[1]].add(p[0])
-    return mapping
+    return read_placement_mapping(mapf, verbose)
 
 def remap(data, mapping, verbose=False):
     """
     Map from the mapping file to the data file. In this step we figure out where on the tree
     we should place the color strip
     :param data: the data dictionary where the metagenome read id is the key and the label is the value
-    :param mapping: the mapping from metagenome read id to node in the tree
+    :param mapping: the PlacementMapping from read_mapping
     :param verbose:
-    :return:
+    :return: a CountMatrix of the nodes in the tree x labels
     """
 
-    ndata = {}
-
-    for r in mapping:
-        for t in mapping[r]:
-            if t in ndata and ndata[t] != data[r]:
-                sys.stderr.write("WARNING: We originally had {} for {} and now we have {}\n".format(
-                    ndata[t], t, data[r]
-                ))
-            ndata[t] = data[r]
-    return ndata
+    return count_matrix(mapping, data, verbose=verbose)
 
 def write_output(data, colors, label, lshape, outputfile, verbose):
     """
-    Write the colorstrip file
-    :param data: the data dict of leaves and valus
+    Write the colorstrip file. Each node is colored by the label with the most reads on that node.
+    :param data: the CountMatrix of nodes and labels from remap
     :param colors: the array of colors
     :param label: the label for the color strip
     :param lshape: the label shape
@@ -76,7 +66,16 @@ def write_output(data, colors, label, lshape, outputfile, verbose):
     :return:
     """
 
-    vals = list(set(data.values()))
+    counted = data.values > 0
+    nlabels = counted.sum(axis=1)
+    best = data.values.argmax(axis=1)
+    for i in np.flatnonzero(nlabels > 1).tolist():
+        sys.stderr.write("WARNING: {} has reads from {}. Using {}\n".format(
+            data.rows[i], ", ".join(data.labels[j] for j in np.flatnonzero(counted[i]).tolist()), data.labels[best[i]]
+        ))
+
+    nodes = np.flatnonzero(nlabels > 0).tolist()
+    vals = [data.labels[j] for j in sorted(set(best[nodes].tolist()))]
     if len(vals) > len(colors):
         sys.stderr.write("WARNING: NOT ENOUGH COLORS! We have {} values and {} colors\n".format(len(vals), len(colors)))
         sys.exit(-1)
@@ -95,8 +94,9 @@ def write_output(data, colors, label, lshape, outputfile, verbose):
         out.write("STRIP_WIDTH,25\n")
         out.write("COLOR_BRANCHES,1\n")
         out.write("DATA\n")
-        for d in data:
-            out.write("{},{},{}\n".format(d, valcols[data[d]], data[d]))
+        for i in nodes:
+            v = data.labels[best[i]]
+            out.write("{},{},{}\n".format(data.rows[i], valcols[v], v))
 
 
 
@@ -110,13 +110,21 @@ if __name__ == '__main__':
     parser.add_argument('-s', help='Legend shape (a number). Default = 1', default="1", type=str)
     parser.add_argument('-c', help='Colors to use. These will be prepended to our default list', action='append')
     parser.add_argument('-v', help='verbose output', action="store_true")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile(args)
 
     colors = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#ffff33', '#a65628', '#f781bf', '#999999']
     if args.c:
         colors = args.c + colors
 
-    data = read_labels(args.f, args.n, args.v)
-    mapping = read_mapping(args.m, args.v)
-    mapdata = remap(data, mapping, args.v)
-    write_output(mapdata, colors, args.l, args.s, args.o, args.v)
\ No newline at end of file
+    with profiler.stage('read_labels'):
+        data = read_labels(args.f, args.n, args.v)
+    with profiler.stage('read_mapping'):
+        mapping = read_mapping(args.m, args.v)
+    with profiler.stage('remap'):
+        mapdata = remap(data, mapping, args.v)
+    with profiler.stage('write'):
+        write_output(mapdata, colors, args.l, args.s, args.o, args.v)
+
+    write_profile(args)
\ No newline at end of file
@@ -9,13 +9,14 @@ For each label level we have, we'll create a single file.
 import os
 import sys
 import argparse
-from ete3 import Tree
+import numpy as np
+from arraytree import ArrayTree, read_tree
+from count_matrix import Codes, CountMatrix, read_placement_mapping, count_matrix, stack_labels
+import columnar
+from leaf_labels import read_label_rows
+from profiling import profiler, add_profile_arguments, start_profile, write_profile
 
 
-# TODO:
-# There appears to be great redundancy in the file sharks_stingray.leaves.labels
-# so need to figure out where that comes from as the counts in read_labels were wrong
-
 def read_labels(lf, col, verbose=False):
     """
     Read the labels file and return a dict with tree labels and values
@@ -25,133 +26,227 @@ def read_labels(lf, col, verbose=False):
     :return: a dict of the leaves and their labels and a dict of the labels and their counts
     """
 
-    ret = {}
-    mreads = {}
-    with open(lf, 'r') as f:
-        for l in f:
-            p = l.strip().split("\t")
+    return read_label_columns(lf, [col], verbose)[col]
+
+def read_label_columns(lf, cols, verbose=False):
+    """
+    Read several columns of the labels file in one pass
+    :param lf: labels file, or a directory from fastq2ids.py -b
+    :param cols: the columns to use
+    :param verbose: extra output
+    :return: a dict of column -> (a dict of the leaves and their labels, a dict of the labels and their counts)
+    """
+
+    if columnar.is_columnar(lf):
+        return columnar.read_label_columns(lf, cols, verbose)
+
+    return label_columns(read_label_rows(lf, verbose), cols, verbose)
+
+def label_columns(rows, cols, verbose=False):
+    """
+    Get the labels from several columns of the rows of a labels file (e.g. from fastq2ids.classify_leaves)
+    :param rows: the rows of the labels file, split into columns
+    :param cols: the columns to use
+    :param verbose: extra output
+    :return: a dict of column -> (a dict of the leaves and their labels, a dict of the labels and their counts)
+    """
+
+    ret = {col: {} for col in cols}
+    mreads = {col: {} for col in cols}
+    for p in rows:
+        for col in cols:
             if len(p) <= col:
                 continue
             if not p[col]:
                 continue
 
-            ret[p[0]] = p[col]
-            if p[col] not in mreads:
-                mreads[p[col]] = set()
-            mreads[p[col]].add(p[0])
+            ret[col][p[0]] = p[col]
+            if p[col] not in mreads[col]:
+                mreads[col][p[col]] = set()
+            mreads[col][p[col]].add(p[0])
 
-    counts = {x:len(mreads[x]) for x in mreads}
+    labels = {}
+    for col in cols:
+        counts = {x:len(mreads[col][x]) for x in mreads[col]}
+        if verbose:
+            sys.stderr.write("After read_labels: column {} has {} keys and counts has {} keys\n".format(col, len(ret[col].keys()), len(counts.keys())))
+        labels[col] = (ret[col], counts)
 
-    if verbose:
-        sys.stderr.write("After read_labels: data has {} keys and counts has {} keys\n".format(len(ret.keys()), len(counts.keys())))
-
-    return ret, counts
+    return labels
 
 def read_mapping(mapf, verbose=False):
     """
-    Read the mapping from metagenomes to nodes in the tree
-    :param mapf: the mapping file
+    Read the mapping from metagenomes to nodes in the tree. If the mapping file has a third column
+    (from rename_tree_leaves.py -w) that is the weight of the placement, otherwise every placement has weight 1
+    :param mapf: the mapping file, or a directory from rename_tree_leaves.py -b
     :param verbose: more output
-    :return:
+    :return: the PlacementMapping with the metagenome read ids, nodes in the tree, and weights as integer codes
     """
 
-    mapping = {}
-    with open(mapf, 'r') as f:
-        for l in f:
-            p = l.strip().split("\t")
-            if p[1] not in mapping:
-                mapping[p[1]] = set()
-            mapping[p[1]].add(p[0])
-
-    s=set()
-    for m in mapping:
-        s.update(mapping[m])
-    if verbose:
-        sys.stderr.write("After read_mapping: mapping has {} keys and {} values\n".format(len(mapping.keys()), len(s)))
-
-    return mapping
+    return read_placement_mapping(mapf, verbose)
 
 def remap(data, mapping, verbose=False):
     """
     Map from the mapping file to the data file. In this step we figure out where on the tree
     we should place the color strip
     :param data: the data dictionary where the metagenome read id is the key and the label is the value
-    :param mapping: the mapping from metagenome read id to node in the tree
+    :param mapping: the PlacementMapping from read_mapping
     :param verbose:
-    :return:
+    :return: a CountMatrix of the nodes in the tree x labels
     """
 
-    ndata = {}
+    return count_matrix(mapping, data, verbose=verbose)
 
-    if verbose:
-        sys.stderr.write("There are {} keys in mapping\n".format(len(mapping.keys())))
-    s = set()
-    for k in mapping:
-        s.update(mapping[k])
+def subtree_counts(tree, data, verbose=False):
+    """
+    Count everything below every node in the tree. We go up the tree one level at a time, and every
+    node at that level adds its own counts and the counts below it to its parent, so each level is a couple of
+    array operations.
+    :param tree: The ArrayTree
+    :param data: The CountMatrix from remap
+    :param verbose: more output
+    :return: a NumPy array of node number x label of the counts of all the descendants of that node (not the node itself)
+    """
 
+    rows = Codes(data.rows)
+    own = np.zeros((len(tree), len(data.labels)), dtype=data.values.dtype)
+    for i, name in enumerate(tree.names):
+        r = rows.get(name)
+        if r >= 0:
+            own[i] = data.values[r]
+
+    # the nodes in level order, and where each level starts
+    order = list(tree.levelorder())
+    parent = np.array(tree.parent, dtype=np.int64)
+    depth = [0] * len(tree)
+    starts = [0]
+    for k, i in enumerate(order[1:], 1):
+        depth[i] = depth[parent[i]] + 1
+        if depth[i] != depth[order[k - 1]]:
+            starts.append(k)
+    starts.append(len(order))
+    order = np.array(order, dtype=np.int64)
+
+    below = np.zeros_like(own)
+    # skip the root level, as the root does not have a parent
+    for s, e in reversed(list(zip(starts[1:-1], starts[2:]))):
+        ids = order[s:e]
+        np.add.at(below, parent[ids], below[ids] + own[ids])
+    profiler.count('nodes visited', len(order))
 
     if verbose:
-        sys.stderr.write("There are {} vals in mapping\n".format(len(s)))
-    for mgid in mapping:
-        for posn_in_tree in mapping[mgid]:
-            if posn_in_tree not in ndata:
-                ndata[posn_in_tree] = {}
-            ndata[posn_in_tree][data[mgid]] = ndata[posn_in_tree].get(data[mgid], 0) + 1
+        sys.stderr.write("After subtree_counts: {} nodes have mapped descendants\n".format(int(below.any(axis=1).sum())))
+
+    return below
+
+
+def multibar_rank_counts(treefile, data, ranks, proportions, verbose=False, labels=None):
+    """
+    Calculate the multibar counts for several taxonomic levels at once. The tree is read
+    and traversed once for all the labels and all the levels.
+    :param treefile: The tree file in newick format (or an ArrayTree)
+    :param data: The CountMatrix from remap
+    :param ranks: A list of taxonomic levels (e.g. r_class, r_genus)
+    :param proportions: whether to use counts or proportions
+    :param verbose: more output
+    :param labels: the labels to count. Default is every label in data
+    :return: a dict of taxonomic level -> the CountMatrix from multibar_counts
+    """
+
     if verbose:
-        sys.stderr.write("There are  {} Keys in ndata\n".format(len(ndata.keys())))
+        sys.stderr.write("Reading tree\n")
+
+    if isinstance(treefile, ArrayTree):
+        tree = treefile
+    else:
+        tree = read_tree(treefile)
+
+    if labels is not None:
+        data = data.select_labels(labels)
+
+    below = subtree_counts(tree, data, verbose)
+    hasbelow = below.any(axis=1)
+    # the nodes with something below them, in preorder
+    nodes = [i for i in tree.preorder() if hasbelow[i]]
+
+    val = {}
+    for taxa in ranks:
+        names = Codes()
+        ids = []
+        rows = []
+        for i in nodes:
+            if taxa in tree.names[i]:
+                ids.append(i)
+                rows.append(names.code(tree.names[i]))
+        values = np.zeros((len(names), len(data.labels)), dtype=below.dtype)
+        np.add.at(values, np.array(rows, dtype=np.int64), below[np.array(ids, dtype=np.int64)])
+        if verbose:
+            sys.stderr.write("We found a total of {} metagenomes at {}\n".format(values.sum(), taxa))
+        if proportions:
+            # how many times did we see each thing:
+            sums = values.sum(axis=0)
+            values = values / np.where(sums > 0, sums, 1)
+        val[taxa] = CountMatrix(names.values, data.labels, values)
+
+    return val
 
-    return ndata
 
-def multibar_counts(treefile, data, taxa, proportions, verbose=False):
+def multibar_counts(treefile, data, taxa, proportions, verbose=False, labels=None):
     """
     Calculate the counts that will be added to the multibar and return a mutlidimensional
     dict of shark type, tree name, and count.
-    :param treefile: The tree file in newick format
-    :param data: The mapped data we need to read
+    :param treefile: The tree file in newick format (or an ArrayTree)
+    :param data: The CountMatrix from remap
     :param taxa: The taxonomic level we desire
     :param proportions: whether to use counts or proportions
     :param verbose: more output
-    :return: a dict of dicts.
+    :param labels: the labels to count. Default is every label in data
+    :return: a CountMatrix of the nodes at this level x labels
     """
 
-    total = {} ## the total number of times we see a node
-    val = {} ## how many times we see the children of this node
+    return multibar_rank_counts(treefile, data, [taxa], proportions, verbose, labels)[taxa]
 
-    if verbose:
-        sys.stderr.write("Reading tree\n")
 
-    tree = Tree(treefile, quoted_node_names=True, format=1)
-
-    for k in counts:
-        val[k] = {}
-        for n in tree.traverse("preorder"):
-            if taxa in n.name:
-                for l in n.iter_descendants():
-                    if l.name in data and k in data[l.name]:
-                        val[k][n.name] = val[k].get(n.name, 0) + data[l.name][k]
-                        total[n.name] = total.get(n.name, 0) + data[l.name][k]
-                        if verbose:
-                            sys.stderr.write("Value for {} and {} is now {}\n".format(k, n.name, val[k][n.name]))
-                    elif l.name in data and verbose:
-                        sys.stderr.write("Skipped {} as it is a {} and we're a {}\n".format(l.name, data[l.name], k))
-
-    if proportions:
-        # how many times did we see each thing:
-        for k in val:
-            sums = sum(val[k].values())
-            for n in val[k]:
-                val[k][n] /= sums
-    if verbose:
-        sys.stderr.write("We found a total of {} metagenomes\n".format(sum(total.values())))
+def label_matrices(mapping, labels, verbose=False):
+    """
+    Count the placements for several columns of the labels file
+    :param mapping: The PlacementMapping from read_mapping
+    :param labels: The dict of column -> (data, counts) from read_label_columns
+    :param verbose: more output
+    :return: a dict of column -> the CountMatrix from remap
+    """
 
+    matrices = {}
+    for col, (data, counts) in labels.items():
+        matrices[col] = remap(data, mapping, verbose).select_labels(counts)
+    return matrices
 
-    return val
+
+def multibar_batch(treefile, matrices, ranks, proportions, verbose=False):
+    """
+    Calculate the multibar counts for several columns of the labels file and several taxonomic levels at once.
+    The counts for all the columns are put side by side in one matrix so we only go through the tree once.
+    :param treefile: The tree file in newick format (or an ArrayTree)
+    :param matrices: The dict of column -> CountMatrix from label_matrices
+    :param ranks: A list of taxonomic levels (e.g. r_class, r_genus)
+    :param proportions: whether to use counts or proportions
+    :param verbose: more output
+    :return: a dict of (column, taxonomic level) -> the CountMatrix from multibar_counts
+    """
+
+    val = multibar_rank_counts(treefile, stack_labels(matrices), ranks, proportions, verbose)
+
+    batch = {}
+    for taxa in ranks:
+        for col, m in val[taxa].split_labels().items():
+            batch[(col, taxa)] = m
+    return batch
 
 
 def write_directory(counts, outputdir, colors, proportions, usemaxval=False, verbose=False):
     """
     Write a directory with one multibar file per type
-    :param counts: the dict of dicts. The first key is the shark type, the second the genus/species
+    :param counts: the CountMatrix from multibar_counts. The rows are the genus/species and the labels the shark type
     :param outputdir: the directory to create
     :param colors: the array of colors to choose from
     :param proportions: whether we are using proportions or not
@@ -160,7 +255,7 @@ def write_directory(counts, outputdir, colors, proportions, usemaxval=False, ver
     """
 
     # assign colors the keys
-    allkeys = list(counts.keys())
+    allkeys = list(counts.labels)
     if len(allkeys) > len(colors):
         sys.stderr.write("ERROR: Not enough colors. We have {}  keys and {} colors\n".format(len(allkeys), len(colors)))
         sys.exit(-1)
@@ -169,10 +264,8 @@ def write_directory(counts, outputdir, colors, proportions, usemaxval=False, ver
     # what is our maxvalue
     maxval = 50
     if usemaxval:
-        for k in counts:
-            m = max(counts[k].values())
-            if m > maxval:
-                maxval = m
+        if counts.values.size and counts.values.max() > maxval:
+            maxval = counts.values.max().item()
 
 
     if not os.path.exists(outputdir):
@@ -186,7 +279,7 @@ def write_directory(counts, outputdir, colors, proportions, usemaxval=False, ver
     if verbose:
         sys.stderr.write(f"Creating output files in {outputdir}\n")
 
-    for k in counts:
+    for k in allkeys:
         fnme = k.replace(' ', '_')
         outputf = os.path.join(outputdir, fnme + ".multibar.txt")
 
@@ -208,32 +301,27 @@ def write_directory(counts, outputdir, colors, proportions, usemaxval=False, ver
             out.write("ALIGN_FIELDS,1\n")
             out.write("COLOR,{}\n".format(keycolors[k]))
             out.write("DATA\n")
-            for n in counts[k]:
-                if counts[k][n] > 0:
-                    out.write("{},{}\n".format(n, counts[k][n]))
+            for n, v in counts.column(k):
+                out.write("{},{}\n".format(n, v))
 
 
 def write_tsv(counts, taxa, outputfile, verbose=False):
     """
     Write the counts as a tsv file for some stats.
-    :param counts: The counts dict that has keys as sharks and then keys as taxa and values as counts
+    :param counts: The CountMatrix that has taxa as rows and sharks as labels
     :param taxa: the taxonomic level we're choosing
     :param outputfile: the file to write
     :param verbose: more output
     :return: nothing
     """
 
-    allkeys = counts.keys()
-    allvals = set()
-    for k in allkeys:
-        allvals.update(set(counts[k].keys()))
-
     with open(outputfile, 'w') as out:
-        out.write("{}\t{}\n".format(taxa, "\t".join(allkeys)))
-        for v in allvals:
+        out.write("{}\t{}\n".format(taxa, "\t".join(counts.labels)))
+        for v, row in zip(counts.rows, counts.values.tolist()):
             out.write(v)
-            for k in allkeys:
-                out.write("\t{}".format(counts[k].get(v, 0)))
+            for c in row:
+                # write 0 rather than 0.0 for the proportions we did not see
+                out.write("\t{}".format(c or 0))
             out.write("\n")
 
 
@@ -243,36 +331,64 @@ if __name__ == '__main__':
     parser.add_argument('-m', help='Mapping file from rename_tree_leaves.py', required=True)
     parser.add_argument('-t', help='Newick tree file', required=True)
     parser.add_argument('-d', help='Output directory where to write the files', required=True)
-    parser.add_argument('-n', help='Column in the labeled leaves file to use. 0 indexed', required=True, type=int)
-    parser.add_argument('-x', help='taxa to use for the labels', required=True)
+    parser.add_argument('-n', help='Column in the labeled leaves file to use. 0 indexed. ' +
+                                   'You can use more than one -n to make the files for several columns at once', required=True, type=int, action='append')
+    parser.add_argument('-x', help='taxa to use for the labels. ' +
+                                   'You can use more than one -x to make the files for several taxa at once', required=True, action='append')
     parser.add_argument('-p', help='Display proportion of counts not counts', action='store_true')
     parser.add_argument('-c', help='Colors to use. These will be prepended to our default list', action='append')
     parser.add_argument('--maxval', help='Scale based on the maximum value, otherwise all bars are width=50', action='store_true')
     parser.add_argument('-o', help='tsv file to write with all the data')
     parser.add_argument('-v', help='verbose output', action="store_true")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile(args)
 
     colors = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#ffff33', '#a65628', '#f781bf', '#999999']
     if args.c:
         colors = args.c + colors
 
-    data, counts = read_labels(args.f, args.n, args.v)
-    mapping = read_mapping(args.m, args.v)
-    mapdata = remap(data, mapping, args.v)
-
     allowed_taxa = ['r_superkingdom', 'r_phylum', 'r_class', 'r_order', 'r_family', 'r_genus', 'r_species', 'r_subspecies']
 
-    taxa = args.x
-    if not taxa.startswith('r_'):
-        taxa = "r_{}".format(taxa)
-
-    if taxa not in allowed_taxa:
-        sys.stderr.write("Sorry: {} is not an allowed taxa. Your choices are\n{}\n".format(taxa, " ".join(allowed_taxa)))
-        sys.exit(-1)
+    cols = list(dict.fromkeys(args.n))
+    ranks = {}
+    for x in dict.fromkeys(args.x):
+        taxa = x
+        if not taxa.startswith('r_'):
+            taxa = "r_{}".format(taxa)
 
-    mbcounts = multibar_counts(args.t, mapdata, taxa, args.p, args.v)
-
-    write_directory(mbcounts, args.d, colors, args.p, args.maxval, args.v)
-
-    if args.o:
-        write_tsv(mbcounts, args.x, args.o, args.v)
\ No newline at end of file
+        if taxa not in allowed_taxa:
+            sys.stderr.write("Sorry: {} is not an allowed taxa. Your choices are\n{}\n".format(taxa, " ".join(allowed_taxa)))
+            sys.exit(-1)
+        ranks[taxa] = x
+
+    with profiler.stage('read_labels'):
+        labels = read_label_columns(args.f, cols, args.v)
+    with profiler.stage('read_mapping'):
+        mapping = read_mapping(args.m, args.v)
+    with profiler.stage('remap'):
+        matrices = label_matrices(mapping, labels, args.v)
+    with profiler.stage('multibar_counts'):
+        mbcounts = multibar_batch(args.t, matrices, list(ranks), args.p, args.v)
+
+    # with more than one column or taxa, we write one directory (and tsv file) for each of them
+    batch = len(mbcounts) > 1
+    if batch and not os.path.exists(args.d):
+        os.makedirs(args.d)
+
+    with profiler.stage('write'):
+        for (col, taxa), counts in mbcounts.items():
+            rank = taxa.replace('r_', '', 1)
+            outputdir = args.d
+            if batch:
+                outputdir = os.path.join(args.d, "col{}.{}".format(col, rank))
+            write_directory(counts, outputdir, colors, args.p, args.maxval, args.v)
+
+            if args.o:
+                outputfile = args.o
+                if batch:
+                    root, ext = os.path.splitext(args.o)
+                    outputfile = "{}.col{}.{}{}".format(root, col, rank, ext)
+                write_tsv(counts, ranks[taxa], outputfile, args.v)
+
+    write_profile(args)
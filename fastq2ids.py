@@ -7,43 +7,153 @@ we make a file that has [id, domain, type, source]
 import os
 import sys
 import argparse
-import re
-from roblib import stream_fastq
-from taxon import get_taxonomy_db, get_taxonomy
+import gzip
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from taxon import get_taxonomy_db
+from lineage_cache import LineageCache
+from fastq_index import FastqIndex
+from newick_ids import clean_newick_id, leaf_taxid, canonical_keys, leaf_lookup
+from leaf_labels import write_labels
+from profiling import profiler, Progress, add_profile_arguments, start_profile, write_profile
+
+
+# the taxonomy database and the lineages are only opened the first time we need them (see taxonomy_lineages), so
+# importing this module does not touch the database
+c = None
+lineages = None
+
+def taxonomy_lineages():
+    """
+    Open the taxonomy database and the lineage cache, if we have not already
+    :return: the LineageCache
+    """
+
+    global c, lineages
+    if lineages is None:
+        if c is None:
+            c = get_taxonomy_db()
+        lineages = LineageCache(c)
+    return lineages
+
+# the ids we are looking for in the fastq files. This is a global so that each
+# process in the pool gets a copy once, rather than once per file
+wanted_ids = None
+
+def _set_wanted_ids(wanted):
+    global wanted_ids
+    wanted_ids = wanted
+
 
+def leaf_keys(leaves):
+    """
+    All the ways that a leaf may appear in the fastq files. These are the same versions of the
+    leaf name that determine_phylogeny looks for.
+    :param leaves: the tree leaves
+    :return: a set of ids
+    """
 
-c = get_taxonomy_db()
+    keys = set()
+    for l in leaves:
+        keys.update(canonical_keys(l.strip()))
+    return keys
 
-def clean_newick_id(name):
+
+def fq_headers(f):
     """
-    Return a version of name suitable for placement in a newick file
-    :param name: The name to clean up
-    :return: a name with no colons, spaces, etc
+    Get all the ids from a fastq file. We only read the header lines and skip over the sequences
+    and quality scores. Gzipped files are read transparently. If wanted_ids is set we only keep
+    those ids.
+    :param f: the fastq file
+    :return: the file name and a list of the ids (and their cleaned up versions if they are different)
     """
-    name = name.replace(' ', '_')
-    name = name.replace(':', '_')
-    name = name.replace('[', '_')
-    name = name.replace(']', '_')
 
-    return name
+    opener = gzip.open if f.endswith('.gz') else open
+    wanted = wanted_ids
+    ids = []
+    with opener(f, 'rt') as fin:
+        for header in itertools.islice(fin, 0, None, 4):
+            fullid = header.strip().replace('@', '', 1)
+            if not fullid:
+                continue
+            # note we store several versions of the id as phylosift does some munging on them
+            cleanid = clean_newick_id(fullid)
+            if wanted is None or fullid in wanted:
+                ids.append(fullid)
+            if cleanid != fullid and (wanted is None or cleanid in wanted):
+                ids.append(cleanid)
+    return f.split(os.path.sep)[-1], ids
+
 
-def fq_ids(fnames, verbose=False):
+def read_fastq_headers(fnames, threads=None, wanted=None, verbose=False):
     """
-    Get a list of fastq ids for each of the files in fnames
+    Read the ids from all the fastq files, in parallel
     :param fnames: a list of files
-    :return: a dict of ids
+    :param threads: the number of processes to use. Default is one per cpu
+    :param wanted: only keep these ids. Default is to keep every id
+    :param verbose: more output
+    :return: a generator of the path, file name, and list of ids for each file, in the same order as fnames
+    """
+
+    if threads is None:
+        threads = os.cpu_count() or 1
+    threads = min(threads, len(fnames))
+
+    if threads > 1:
+        with ProcessPoolExecutor(max_workers=threads, initializer=_set_wanted_ids, initargs=(wanted,)) as executor:
+            for f, (fname, ids) in zip(fnames, executor.map(fq_headers, fnames)):
+                profiler.count('reads indexed', len(ids))
+                if verbose:
+                    sys.stderr.write("Read {} ids from {}\n".format(len(ids), fname))
+                yield f, fname, ids
+    else:
+        _set_wanted_ids(wanted)
+        try:
+            for f in fnames:
+                fname, ids = fq_headers(f)
+                profiler.count('reads indexed', len(ids))
+                if verbose:
+                    sys.stderr.write("Read {} ids from {}\n".format(len(ids), fname))
+                yield f, fname, ids
+        finally:
+            _set_wanted_ids(None)
+
+
+def fq_ids(fnames, verbose=False, threads=None, wanted=None, indexfile=None):
+    """
+    Get a list of fastq ids for each of the files in fnames. The files are read in parallel.
+
+    If indexfile is given we keep the ids in a FastqIndex on disk, and only read the files that
+    are not in the index or have changed since they were indexed. The ids are then looked up in
+    the index rather than being loaded into memory.
+
+    :param fnames: a list of files
+    :param verbose: more output
+    :param threads: the number of processes to use. Default is one per cpu
+    :param wanted: only keep these ids (e.g. from leaf_keys). Default is to keep every id. This is
+        ignored if we are using an index, as the index has to have every id for the next time.
+    :param indexfile: the index file to use
+    :return: a dict of ids (or something that behaves like one)
     """
 
     if verbose:
         sys.stderr.write("Reading fastq files\n")
 
+    if indexfile:
+        index = FastqIndex(indexfile)
+        stale = index.stale(fnames)
+        if verbose:
+            sys.stderr.write("{} of {} fastq files need to be indexed\n".format(len(stale), len(fnames)))
+        for f, fname, ids in read_fastq_headers(stale, threads, None, verbose):
+            index.add(f, fname, ids)
+        return index.ids(fnames)
+
     fqids = {}
-    for f in fnames:
-        for seqid, fullid, seq, qual in stream_fastq(f):
-            # note we store several versions of the id as phylosift does some munging on them
-            fqids[fullid] = f.split(os.path.sep)[-1]
-            fullid = clean_newick_id(fullid)
-            fqids[fullid] = f.split(os.path.sep)[-1]
+    for f, fname, ids in read_fastq_headers(fnames, threads, wanted, verbose):
+        if fqids:
+            # an id that is in more than one file belongs to the first of them, as it does in the index
+            ids = [i for i in ids if i not in fqids]
+        fqids.update(dict.fromkeys(ids, fname))
 
     return fqids
 
@@ -76,40 +186,57 @@ def fq_classification(fqclass, verbose=False):
     return strclassi
 
 
-def determine_phylogeny(fn, fqids, verbose=False):
+def leaf_taxids(leaves):
+    """
+    Get all the taxids from the leaf names so we can look them up at once
+    :param leaves: the tree leaves
+    :return: a set of taxids
+    """
+
+    taxids = set()
+    for l in leaves:
+        tid = leaf_taxid(l)
+        if tid is not None:
+            taxids.add(tid)
+    return taxids
+
+def determine_phylogeny(fn, fqids, verbose=False, table=None, lookup=None):
     """
     Determine if we know the phylogeny of this thing
     :param fn: the feature name
     :param fqids: the dict of ids->fastq files
+    :param table: the lineages from LineageCache.resolve. Otherwise we look up each taxid as we need it
+    :param lookup: the dict of leaf -> id in the fastq files from leaf_lookup. Otherwise we try each version of the leaf name
     :return: the type (currently Bacteria, Archaea, Eukaryota, Metagenome, or unknown), the id in the fastq file, and if a metagenome the type of metagenome
     """
 
-
-    if fn in fqids:
-        return "Metagenome", fn, fqids[fn]
-    m = re.sub('\.\d+\.\d+$', '', fn)
-    if m in fqids:
-        return "Metagenome", m, fqids[m]
-    m = re.sub('\.[\d\.]+$', '', fn)
-    if m in fqids:
-        return "Metagenome", m, fqids[m]
-    m = re.search('\[(\d+)\]', fn)
-    if not m:
+    if lookup is not None:
+        id_in_fq = lookup.get(fn)
+    else:
+        id_in_fq = None
+        for k in canonical_keys(fn):
+            if k in fqids:
+                id_in_fq = k
+                break
+    if id_in_fq is not None:
+        return "Metagenome", id_in_fq, fqids[id_in_fq]
+
+    tid = leaf_taxid(fn)
+    if tid is None:
         if verbose:
             sys.stderr.write("There is no taxid in {} and it is not in the fastq file\n".format(fn))
         return "Unknown", fn, None
 
-    tid = m.groups()[0]
-    t,n = get_taxonomy(tid, c)
-    if not t:
+    if table is not None and tid in table:
+        lineage = table[tid]
+    else:
+        lineage = taxonomy_lineages().lineage(tid)
+    if not lineage:
         if verbose:
             sys.stderr.write("Can't find tax for {} in the db\n".format(tid))
         return "Unknown", fn, None
 
-    while t.parent > 1 and t.parent != 131567:
-        # 131567 is cellular organisms
-        t,n = get_taxonomy(t.parent, c)
-    return n.scientific_name, fn, None
+    return lineage.superkingdom, fn, None
 
 def read_leaves(leaff, twocol, verbose=False):
     """
@@ -125,8 +252,10 @@ def read_leaves(leaff, twocol, verbose=False):
     with open(leaff, 'r') as f:
         for l in f:
             if twocol:
-                p = l.strip().split('\t')
-                leaves.add(p[1])
+                # the first column may be empty, so we only strip the end of the line
+                p = l.rstrip('\r\n').split('\t')
+                if len(p) > 1:
+                    leaves.add(p[1])
             else:
                 leaves.add(l.strip())
     if verbose:
@@ -135,39 +264,86 @@ def read_leaves(leaff, twocol, verbose=False):
     return leaves
 
 
-def write_output(leaves, fqfiles, classifile, readdeff, verbose=False):
+def classify_leaves(leaves, fqfiles, classifile, verbose=False, threads=None, treeonly=False, indexfile=None, fqids=None):
     """
-    Write an output file that categorizes each leaf
+    Categorize each leaf. This is a generator so the rows can be written to a file or used directly.
     :param leaves: the tree leaves
     :param fqfiles: the list of fastq files
     :param classifile: the classification file
-    :param readdeff: read definition file to write
-    :return:
+    :param threads: the number of processes to read the fastq files with
+    :param treeonly: only keep the reads from the fastq files that are leaves in the tree
+    :param indexfile: keep the fastq ids in this index file, and only read the fastq files that have changed
+    :param fqids: the dict of ids -> fastq files from fq_ids, if we already have it
+    :return: a generator of the row for each leaf: the leaf, the id in the fastq file, the type, and if it is from a
+        metagenome the fastq file and the classifications
     """
 
     cl = fq_classification(classifile, verbose)
-    fqids = fq_ids(fqfiles, verbose)
+    if fqids is None:
+        with profiler.stage('fq_ids'):
+            wanted = None
+            if treeonly:
+                wanted = leaf_keys(leaves)
+            fqids = fq_ids(fqfiles, verbose, threads, wanted, indexfile)
     # get the list of everything
     domains = set()
     stypes = set()
     if verbose:
         sys.stderr.write("Determining phylogeny for all leaves\n")
+    leaves = [l.strip() for l in leaves]
+    lineages = taxonomy_lineages()
+    table = lineages.resolve(leaf_taxids(leaves))
+    lookup = leaf_lookup(leaves, fqids)
+
+    # we only say how many leaves we could not classify, rather than writing a line for every one
+    progress = Progress("Classified leaves", verbose)
+    unknown = 0
+    for l in leaves:
+        dom, id_in_fq, nm = determine_phylogeny(l, fqids, False, table, lookup)
+        progress.update()
+        if dom == "Unknown":
+            unknown += 1
+        if nm:
+            # this also means that l is in fqids, so we can get the classification
+            thisfq = fqids[id_in_fq]
+            clstr=""
+            if thisfq not in cl:
+                sys.stderr.write(f"ERROR: {thisfq} not found in the fastq classification file\n")
+            else:
+                clstr = cl[thisfq]
+            yield [l, id_in_fq, dom, nm] + clstr.split("\t")
+        else:
+            yield [l, l, dom]
+
+    progress.done(" ({} are not in the fastq files and have no taxonomy)".format(unknown))
+    lineages.flush()
+    if verbose:
+        lineages.report()
+
+
+def write_output(leaves, fqfiles, classifile, readdeff, verbose=False, threads=None, treeonly=False, indexfile=None,
+                 columns=False):
+    """
+    Write an output file that categorizes each leaf
+    :param leaves: the tree leaves
+    :param fqfiles: the list of fastq files
+    :param classifile: the classification file
+    :param readdeff: read definition file to write
+    :param threads: the number of processes to read the fastq files with
+    :param treeonly: only keep the reads from the fastq files that are leaves in the tree
+    :param indexfile: keep the fastq ids in this index file, and only read the fastq files that have changed
+    :param columns: write a directory of NumPy arrays rather than a tsv file (see columnar.py)
+    :return:
+    """
+
+    if columns:
+        from columnar import write_label_columns
+        write_label_columns(readdeff, classify_leaves(leaves, fqfiles, classifile, verbose, threads, treeonly, indexfile),
+                            verbose)
+        return
 
     with open(readdeff, 'w') as readout:
-        for l in leaves:
-            l = l.strip()
-            dom, id_in_fq, nm = determine_phylogeny(l, fqids, verbose)
-            if nm:
-                # this also means that l is in fqids, so we can get the classification
-                thisfq = fqids[id_in_fq]
-                clstr=""
-                if thisfq not in cl:
-                    sys.stderr.write(f"ERROR: {thisfq} not found in the fastq classification file\n")
-                else:
-                    clstr = cl[thisfq]
-                readout.write("{}\t{}\t{}\t{}\t{}\n".format(l, id_in_fq, dom, nm, clstr))
-            else:
-                readout.write("{}\t{}\t{}\n".format(l, l, dom))
+        write_labels(classify_leaves(leaves, fqfiles, classifile, verbose, threads, treeonly, indexfile), readout)
 
 
 
@@ -179,20 +355,31 @@ if __name__ == '__main__':
     parser.add_argument('-d', help='directory of fastq files')
     parser.add_argument('-f', help='fastq file(s) [one or more can be specified]', action='append')
     parser.add_argument('-o', help='output file to write to', required=True)
+    parser.add_argument('-t', help='number of processes to read the fastq files with. Default is one per cpu', type=int)
+    parser.add_argument('-r', help='only keep the reads from the fastq files that are in the leaves list. This uses a lot less memory', action='store_true')
+    parser.add_argument('-i', help='index file of the fastq ids. Only new or changed fastq files are read, and the ids are not loaded into memory')
+    parser.add_argument('-b', help='write the output as a directory of NumPy arrays rather than a tsv file ' +
+                                   '(see columnar.py). This is much smaller and quicker to read', action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile(args)
 
     fqfiles = []
     if args.f:
         fqfiles = args.f
     if args.d:
         for q in os.listdir(args.d):
-            if q.endswith('fastq'):
+            if q.endswith('fastq') or q.endswith('fastq.gz'):
                 fqfiles.append(os.path.join(args.d, q))
     if len(fqfiles) == 0:
         sys.stderr.write("You must supply some fastq files with either -d (directory) or -f (files)\n")
         sys.exit(-1)
 
-    leaves = read_leaves(args.l, args.p)
+    with profiler.stage('read_leaves'):
+        leaves = read_leaves(args.l, args.p)
+
+    with profiler.stage('classify_leaves'):
+        write_output(leaves, fqfiles, args.c, args.o, args.v, args.t, args.r, args.i, args.b)
 
-    write_output(leaves, fqfiles, args.c, args.o, args.v)
+    write_profile(args)
@@ -0,0 +1,133 @@
+"""
+A persistent index of read ids to the fastq file they came from.
+
+Scanning every fastq file for every run of fastq2ids.py is slow, especially when only one new sample has
+been added to the directory. The index is a SQLite database that records the size and modification
+time of every file it has read, so we only rescan files that are new or have changed. The ids are looked up
+directly in the database (which is memory mapped), so we never need to load the whole index into a dict.
+
+A read id can be in more than one file (e.g. the R1 and R2 files of a pair), so we keep every file that each id is
+in, and a read belongs to the first of the files we ask for that has it, the same as in fastq2ids.fq_ids.
+"""
+
+import os
+import sqlite3
+
+# change this whenever the layout of the index changes. Older indexes are thrown away and the files are read again
+index_version = 2
+
+
+class FastqIndex:
+    """
+    An on disk index of read id -> fastq file.
+    """
+
+    def __init__(self, indexfile):
+        """
+        Open (or create) the index
+        :param indexfile: the SQLite file to keep the index in
+        """
+
+        self.indexfile = indexfile
+        self.conn = sqlite3.connect(indexfile)
+        self.conn.execute("PRAGMA mmap_size = 1073741824")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != index_version:
+            self.conn.execute("DROP TABLE IF EXISTS reads")
+            self.conn.execute("DROP TABLE IF EXISTS files")
+            self.conn.execute("PRAGMA user_version = {}".format(index_version))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, " +
+                          "name TEXT, size INTEGER, mtime INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS reads (readid TEXT, file INTEGER, PRIMARY KEY (readid, file)) " +
+                          "WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS reads_file ON reads (file)")
+        self.conn.commit()
+
+    def stale(self, fnames):
+        """
+        Find the files that are not in the index, or have changed since we indexed them
+        :param fnames: the list of fastq files
+        :return: a list of the files that need to be (re)read
+        """
+
+        stale = []
+        for f in fnames:
+            st = os.stat(f)
+            row = self.conn.execute("SELECT size, mtime FROM files WHERE path = ?", [os.path.abspath(f)]).fetchone()
+            if not row or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+                stale.append(f)
+        return stale
+
+    def add(self, f, fname, ids):
+        """
+        Add (or replace) the ids from a fastq file. An id can also be in other files.
+        :param f: the path to the fastq file
+        :param fname: the name of the fastq file that we report
+        :param ids: the ids in the file
+        """
+
+        path = os.path.abspath(f)
+        st = os.stat(f)
+        row = self.conn.execute("SELECT id FROM files WHERE path = ?", [path]).fetchone()
+        if row:
+            fileid = row[0]
+            self.conn.execute("DELETE FROM reads WHERE file = ?", [fileid])
+            self.conn.execute("UPDATE files SET name = ?, size = ?, mtime = ? WHERE id = ?",
+                              [fname, st.st_size, st.st_mtime_ns, fileid])
+        else:
+            cur = self.conn.execute("INSERT INTO files (path, name, size, mtime) VALUES (?, ?, ?, ?)",
+                                    [path, fname, st.st_size, st.st_mtime_ns])
+            fileid = cur.lastrowid
+        self.conn.executemany("INSERT OR IGNORE INTO reads VALUES (?, ?)", ((i, fileid) for i in ids))
+        self.conn.commit()
+
+    def ids(self, fnames):
+        """
+        Get the ids for some of the files in the index
+        :param fnames: the fastq files we want the ids from
+        :return: a IndexedIds that looks like the dict of id -> fastq file from fq_ids. If an id is in more
+            than one of the files, it belongs to the first of them in fnames
+        """
+
+        files = {}
+        for f in fnames:
+            row = self.conn.execute("SELECT id, name FROM files WHERE path = ?", [os.path.abspath(f)]).fetchone()
+            if row:
+                files[row[0]] = row[1]
+        return IndexedIds(self.conn, files)
+
+    def close(self):
+        self.conn.close()
+
+
+class IndexedIds:
+    """
+    The ids from some of the fastq files in a FastqIndex. This behaves like a (read only) dict
+    of id -> fastq file name, but each id is looked up in the index on disk.
+    """
+
+    def __init__(self, conn, files):
+        """
+        :param conn: the connection to the index
+        :param files: a dict of the file ids in the index and their names, in the order we want them
+        """
+
+        self.conn = conn
+        self.files = files
+        self.order = {fileid: k for k, fileid in enumerate(files)}
+
+    def get(self, readid, default=None):
+        # the files that have this id, and of those we want the first one we asked for
+        found = [r[0] for r in self.conn.execute("SELECT file FROM reads WHERE readid = ?", [readid])
+                 if r[0] in self.order]
+        if not found:
+            return default
+        return self.files[min(found, key=self.order.get)]
+
+    def __contains__(self, readid):
+        return self.get(readid) is not None
+
+    def __getitem__(self, readid):
+        fname = self.get(readid)
+        if fname is None:
+            raise KeyError(readid)
+        return fname
@@ -0,0 +1,246 @@
+"""
+Read jplace files a piece at a time.
+
+The placements in a jplace file from pplacer or PhyloSift can run to tens of millions of entries, and
+json.load needs several times the size of the file in memory to read them. Here we walk through the
+top level of the JSON object ourselves, decode the small things (the tree, fields, version, and metadata)
+as they come, and decode the placements one record at a time so we never hold more than one of them.
+"""
+
+import re
+import json
+from newick_ids import clean_newick_id
+
+# how much of the file to read at a time
+chunksize = 1 << 20
+
+# the ways we can use the like_weight_ratio of the placements (see placement_matrix.py). They are here, rather than
+# there, so the scripts can offer them as choices without importing numpy
+placement_modes = ['all', 'best', 'weighted', 'threshold']
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_structural = re.compile(r'["\[\]{}]')
+_string_body = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+
+
+class JplaceError(ValueError):
+    """
+    The jplace file is not the JSON we expected
+    """
+    pass
+
+
+class _Reader:
+    """
+    A buffer over a file that we can decode JSON values from one at a time.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """
+        Throw away what we have used and read some more of the file
+        :return: False if we are at the end of the file
+        """
+
+        if self.eof:
+            return False
+        data = self.f.read(max(chunksize, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+        return bool(data)
+
+    def peek(self):
+        """
+        Skip any white space and return the next character, or an empty string at the end of the file
+        """
+
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, ch):
+        """
+        Consume the next character, which must be ch
+        """
+
+        if self.peek() != ch:
+            raise JplaceError("Expected '{}' but found '{}' in the jplace file".format(ch, self.buf[self.pos:self.pos+20]))
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode the next JSON value
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self.fill():
+                    continue
+                raise JplaceError("Could not parse the jplace file: {}".format(e))
+            # a number at the end of the buffer may carry on in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self):
+        """
+        Step over the next JSON value without decoding it
+        """
+
+        if self.peek() not in '[{':
+            self.value()
+            return
+
+        depth = 0
+        while True:
+            m = _structural.search(self.buf, self.pos)
+            if not m:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise JplaceError("The jplace file ended in the middle of a value")
+                continue
+            self.pos = m.end()
+            ch = m.group()
+            if ch == '"':
+                s = _string_body.match(self.buf, self.pos)
+                while not s:
+                    if not self.fill():
+                        raise JplaceError("The jplace file ended in the middle of a string")
+                    s = _string_body.match(self.buf, self.pos)
+                self.pos = s.end()
+            elif ch in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+
+def iter_jplace(jpf, placements=True):
+    """
+    Step through a jplace file and yield each part as we come to it. Every top level key is yielded as
+    (key, value), except the placements which are yielded one at a time as ('placement', record).
+    :param jpf: the jplace file
+    :param placements: whether to decode the placements, otherwise we just step over them
+    :return: a generator of (key, value) tuples in the order they are in the file
+    """
+
+    with open(jpf, 'r') as f:
+        r = _Reader(f)
+        r.expect('{')
+        if r.peek() == '}':
+            return
+        while True:
+            key = r.value()
+            r.expect(':')
+            if key != 'placements':
+                yield key, r.value()
+            elif not placements:
+                r.skip()
+            else:
+                r.expect('[')
+                if r.peek() != ']':
+                    while True:
+                        yield 'placement', r.value()
+                        if r.peek() != ',':
+                            break
+                        r.pos += 1
+                r.expect(']')
+            if r.peek() != ',':
+                break
+            r.pos += 1
+        r.expect('}')
+
+
+def read_jplace_header(jpf):
+    """
+    Read everything in the jplace file except the placements
+    :param jpf: the jplace file
+    :return: a dict of the top level keys (tree, fields, version, metadata)
+    """
+
+    return dict(iter_jplace(jpf, placements=False))
+
+
+def read_jplace_tree(jpf):
+    """
+    Read just the tree from the jplace file. We stop as soon as we have it, so if the tree comes before the
+    placements (as pplacer writes it) we don't read the rest of the file.
+    :param jpf: the jplace file
+    :return: the tree, or None if there isn't one
+    """
+
+    parts = iter_jplace(jpf, placements=False)
+    try:
+        for key, value in parts:
+            if key == 'tree':
+                return value
+    finally:
+        parts.close()
+    return None
+
+
+class JplacePlacements:
+    """
+    The placements in a jplace file. Every time you iterate over this we read the placements
+    from the file again, one record at a time.
+    """
+
+    def __init__(self, jpf):
+        self.jpf = jpf
+
+    def __iter__(self):
+        for key, value in iter_jplace(self.jpf):
+            if key == 'placement':
+                yield value
+
+
+def load_jplace(jpf):
+    """
+    Load the jplace file without reading the placements into memory. This looks like the
+    data structure from json.load, but the placements are read from the file as you iterate over them.
+    :param jpf: the jplace file
+    :return: a dict with the tree, fields, etc. and the placements
+    """
+
+    data = read_jplace_header(jpf)
+    if 'tree' not in data or 'fields' not in data:
+        raise JplaceError("{} does not have a tree and the placement fields".format(jpf))
+    data['placements'] = JplacePlacements(jpf)
+    return data
+
+
+def placement_names(pl):
+    """
+    Get the names of the reads in one placement record. pplacer writes the names either as n (a list of names,
+    or just one name) where every read has a multiplicity of 1, or as nm (a list of [name, multiplicity])
+    :param pl: the placement record from the jplace file
+    :return: a list of tuples of (cleaned name, multiplicity)
+    """
+
+    names = []
+    if 'n' in pl:
+        n = pl['n']
+        if isinstance(n, str):
+            n = [n]
+        for i in n:
+            names.append((clean_newick_id(i), 1))
+    if 'nm' in pl:
+        for i in pl['nm']:
+            names.append((clean_newick_id(i[0]), i[1]))
+    return names
@@ -0,0 +1,88 @@
+"""
+Read and write the leaf labels file from fastq2ids.py.
+
+Each row of the labels file is a leaf, the id of the read in the fastq file, the type of the leaf (e.g. Metagenome or
+the superkingdom), and for the metagenome reads the fastq file the read is in and the classification of that fastq
+file from the fastq classification file. The fastq file and its classification are the same for every read from that
+file, so we used to repeat them on every row. Now we write them once, in a sample table at the top of the file, and
+each read only has the number of its sample:
+
+    #pbj_placer labels	2
+    #sample	0	sharks1.fastq	Shark	Carcharhinidae
+    read1		Metagenome	0
+    read2		Metagenome	0
+    Leaf 1234 [1234]		Bacteria
+
+The id in the fastq file is left empty when it is the same as the leaf, as it nearly always is. The sample of a read
+is always written before the read. read_label_rows puts the rows back together, so column 4 is still the first
+column of the classification (e.g. create_multibar.py -n 4), and it also reads the older files that have everything
+on every row.
+"""
+
+import sys
+
+labels_version = 2
+header = "#pbj_placer labels"
+sample_tag = "#sample"
+
+
+def write_labels(rows, out):
+    """
+    Write the rows from fastq2ids.classify_leaves with the fastq files and their classifications in a sample table
+    :param rows: the rows of the labels file, split into columns
+    :param out: the open file to write to
+    :return: the number of rows we wrote
+    """
+
+    out.write("{}\t{}\n".format(header, labels_version))
+    samples = {}
+    n = 0
+    for row in rows:
+        leaf, readid = row[0], row[1]
+        if readid == leaf:
+            readid = ""
+        if len(row) > 3:
+            sample = tuple(row[3:])
+            if sample not in samples:
+                samples[sample] = str(len(samples))
+                out.write("\t".join([sample_tag, samples[sample]] + row[3:]) + "\n")
+            out.write("\t".join([leaf, readid, row[2], samples[sample]]) + "\n")
+        else:
+            out.write("\t".join([leaf, readid] + row[2:]) + "\n")
+        n += 1
+    return n
+
+
+def read_label_rows(lf, verbose=False):
+    """
+    Read the labels file and put each row back together from the sample table
+    :param lf: the labels file
+    :param verbose: more output
+    :return: a generator of the rows, split into columns, as they were from fastq2ids.classify_leaves
+    """
+
+    samples = {}
+    normalised = False
+    with open(lf, 'r') as f:
+        for l in f:
+            p = l.strip().split("\t")
+            if p[0] == header:
+                if int(p[1]) > labels_version:
+                    raise ValueError("{} was written by a newer version of pbj_placer".format(lf))
+                normalised = True
+                continue
+            if not normalised:
+                yield p
+                continue
+            if p[0] == sample_tag:
+                samples[p[1]] = p[2:]
+                continue
+            if len(p) > 1 and not p[1]:
+                p[1] = p[0]
+            if len(p) > 3:
+                if p[3] not in samples:
+                    raise ValueError("{}: sample {} of {} is not in the sample table".format(lf, p[3], p[0]))
+                p = p[:3] + samples[p[3]]
+            yield p
+    if verbose and normalised:
+        sys.stderr.write("Read {} samples from the labels file {}\n".format(len(samples), lf))
@@ -0,0 +1,354 @@
+"""
+A cache of taxonomic lineages so that we only walk the NCBI taxonomy database once per taxid.
+
+Both rename_tree_leaves.py and fastq2ids.py need the lineage of every taxid in the tree, and
+those taxids are the same from run to run. We keep the lineages in memory (as a LRU cache) and
+in a small SQLite database on disk that all the scripts share. The disk cache is thrown away
+whenever the taxonomy database it was built from changes.
+"""
+
+import os
+import sys
+import json
+import sqlite3
+from collections import OrderedDict, namedtuple
+from taxon import get_taxonomy
+from profiling import profiler
+
+# ranks is a tuple of (rank, scientific name) pairs from the taxid towards the root. It stops
+# before the node whose parent is the root, which is the same place that rename_nodes_ncbi stops.
+# superkingdom is the name of the node just below the root or cellular organisms (131567), which
+# is what determine_phylogeny reports.
+Lineage = namedtuple('Lineage', ['ranks', 'superkingdom'])
+
+# how many ids to put in each WHERE tax_id IN (...) query
+chunksize = 500
+
+default_cache_file = os.path.join(os.path.expanduser("~"), ".cache", "pbj_placer", "lineages.sqlite")
+
+
+def taxonomy_db_file(c):
+    """
+    Find the file that the taxonomy database connection was opened from
+    :param c: the taxonomy database connection (or cursor)
+    :return: the path to the database file, or None if we can't tell
+    """
+
+    try:
+        for seq, name, path in c.execute("PRAGMA database_list").fetchall():
+            if name == 'main' and path:
+                return path
+    except (sqlite3.Error, AttributeError):
+        pass
+    return None
+
+
+class LineageCache:
+    """
+    Look up, and remember, the lineage of taxonomy ids.
+    """
+
+    def __init__(self, c, cachefile=None, maxsize=100000, verbose=False):
+        """
+        Create the cache
+        :param c: the taxonomy database connection from get_taxonomy_db()
+        :param cachefile: the on disk cache. Defaults to $PBJ_PLACER_CACHE or ~/.cache/pbj_placer/lineages.sqlite
+        :param maxsize: the number of lineages to keep in memory
+        :param verbose: more output
+        """
+
+        self.c = c
+        self.maxsize = maxsize
+        self.verbose = verbose
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.disk = None
+
+        if cachefile is None:
+            cachefile = os.environ.get('PBJ_PLACER_CACHE', default_cache_file)
+        if cachefile:
+            try:
+                self.disk = self._open_disk(cachefile)
+            except (sqlite3.Error, OSError) as e:
+                sys.stderr.write("WARNING: Not using the lineage cache {}: {}\n".format(cachefile, e))
+                self.disk = None
+
+    def _open_disk(self, cachefile):
+        """
+        Open the on disk cache and empty it if the taxonomy database has changed since it was written
+        :param cachefile: the cache file
+        :return: the sqlite connection
+        """
+
+        cachedir = os.path.dirname(cachefile)
+        if cachedir and not os.path.exists(cachedir):
+            os.makedirs(cachedir, exist_ok=True)
+
+        disk = sqlite3.connect(cachefile)
+        disk.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        disk.execute("CREATE TABLE IF NOT EXISTS lineage (taxid INTEGER PRIMARY KEY, lineage TEXT)")
+
+        stamp = ""
+        dbfile = taxonomy_db_file(self.c)
+        if dbfile and os.path.exists(dbfile):
+            st = os.stat(dbfile)
+            stamp = "{}\t{}\t{}".format(os.path.abspath(dbfile), st.st_size, st.st_mtime_ns)
+
+        row = disk.execute("SELECT value FROM meta WHERE key = 'taxonomy'").fetchone()
+        if not row or row[0] != stamp:
+            if self.verbose and row:
+                sys.stderr.write("The taxonomy database has changed, so we are emptying the lineage cache\n")
+            disk.execute("DELETE FROM lineage")
+            disk.execute("INSERT OR REPLACE INTO meta VALUES ('taxonomy', ?)", [stamp])
+            disk.commit()
+
+        return disk
+
+    def _remember(self, taxid, lineage, ondisk=False):
+        """
+        Add a lineage to the in memory cache, and queue it to be written to disk
+        :param taxid: the taxonomy id
+        :param lineage: the Lineage or None if we can't find the taxid
+        :param ondisk: whether the lineage is already on disk
+        """
+
+        self.memory[taxid] = lineage
+        self.memory.move_to_end(taxid)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+        if not ondisk and self.disk is not None:
+            self.pending[taxid] = lineage
+            if len(self.pending) >= 10000:
+                self.flush()
+
+    def _from_disk(self, taxid):
+        """
+        Get a lineage from the disk cache
+        :param taxid: the taxonomy id
+        :return: whether we found it, and the Lineage (which may be None)
+        """
+
+        if taxid in self.pending:
+            return True, self.pending[taxid]
+        if self.disk is None:
+            return False, None
+        row = self.disk.execute("SELECT lineage FROM lineage WHERE taxid = ?", [taxid]).fetchone()
+        if not row:
+            return False, None
+        if row[0] is None:
+            return True, None
+        ranks, superkingdom = json.loads(row[0])
+        return True, Lineage(tuple(tuple(r) for r in ranks), superkingdom)
+
+    def _cached(self, taxid):
+        """
+        Look in memory and then on disk for a lineage
+        :param taxid: the taxonomy id
+        :return: whether we found it, and the Lineage (which may be None)
+        """
+
+        if taxid in self.memory:
+            self.memory_hits += 1
+            self.memory.move_to_end(taxid)
+            return True, self.memory[taxid]
+        found, lineage = self._from_disk(taxid)
+        if found:
+            self.disk_hits += 1
+            self._remember(taxid, lineage, ondisk=True)
+        return found, lineage
+
+    def lineage(self, taxid):
+        """
+        Get the lineage for a taxonomy id. We walk up the taxonomy until we reach a node we already know
+        about, and then remember the lineage of every node on the way.
+        :param taxid: the taxonomy id
+        :return: the Lineage, or None if the taxid is not in the database
+        """
+
+        taxid = int(taxid)
+        found, lineage = self._cached(taxid)
+        if found:
+            return lineage
+        self.misses += 1
+
+        walked = []
+        lineage = None
+        t, n = get_taxonomy(taxid, self.c)
+        profiler.count('taxonomy queries')
+        while t:
+            if t.parent == 1 or t.taxid == 1:
+                lineage = Lineage((), n.scientific_name)
+                self._remember(t.taxid, lineage)
+                break
+            walked.append((t, n))
+            found, lineage = self._cached(t.parent)
+            if found:
+                break
+            t, n = get_taxonomy(t.parent, self.c)
+            profiler.count('taxonomy queries')
+
+        if not walked and lineage is None:
+            self._remember(taxid, None)
+            return None
+
+        # now work back down to the taxid we were asked for
+        ranks, superkingdom = (), None
+        if lineage:
+            ranks, superkingdom = lineage
+        for t, n in reversed(walked):
+            ranks = ((t.rank, n.scientific_name),) + ranks
+            if t.parent <= 1 or t.parent == 131567:
+                # 131567 is cellular organisms
+                superkingdom = n.scientific_name
+            lineage = Lineage(ranks, superkingdom)
+            self._remember(t.taxid, lineage)
+        if taxid not in self.memory:
+            # a merged taxid will come back with a different id
+            self._remember(taxid, lineage)
+
+        return lineage
+
+    def _bulk(self, sql, ids):
+        """
+        Run a query with a WHERE tax_id IN (...) clause over a lot of ids, a chunk at a time
+        :param sql: the query with a {} where the placeholders should go
+        :param ids: the ids to look up
+        :return: a generator of the rows
+        """
+
+        ids = list(ids)
+        for i in range(0, len(ids), chunksize):
+            chunk = ids[i:i+chunksize]
+            self.queries += 1
+            profiler.count('taxonomy queries')
+            for row in self.c.execute(sql.format(",".join("?" * len(chunk))), chunk).fetchall():
+                yield row
+
+    def resolve(self, taxids):
+        """
+        Get the lineages for a lot of taxids at once. Rather than walking up the taxonomy one
+        node at a time, we ask for all the parents at each level of the taxonomy in one query,
+        so the number of queries depends on the depth of the taxonomy rather than the number of taxids.
+        :param taxids: an iterable of taxonomy ids
+        :return: a dict of taxid -> Lineage (or None if the taxid is not in the database)
+        """
+
+        table = {}
+        nodes = {}
+        frontier = set()
+        for tid in taxids:
+            tid = int(tid)
+            if tid in table or tid in frontier:
+                continue
+            found, lineage = self._cached(tid)
+            if found:
+                table[tid] = lineage
+            else:
+                self.misses += 1
+                frontier.add(tid)
+        wanted = set(frontier)
+
+        # we use select * and the column positions, just like get_taxonomy does
+        try:
+            while frontier:
+                parents = set()
+                for row in self._bulk("SELECT * FROM nodes WHERE tax_id IN ({})", frontier):
+                    tid, parent, rank = int(row[0]), int(row[1]), row[2]
+                    nodes[tid] = (parent, rank)
+                    if parent == 1 or tid == 1 or parent in nodes or parent in parents:
+                        continue
+                    if parent in self.memory or parent in self.pending:
+                        continue
+                    parents.add(parent)
+                frontier = parents
+            names = {}
+            for row in self._bulk("SELECT * FROM names WHERE tax_id IN ({})", nodes.keys()):
+                if row[3] == 'scientific name':
+                    names[int(row[0])] = row[1]
+        except sqlite3.Error as e:
+            # not the layout we expected, so fall back to walking the taxonomy
+            if self.verbose:
+                sys.stderr.write("Could not query the taxonomy in bulk ({}). Walking it instead\n".format(e))
+            for tid in wanted:
+                table[tid] = self.lineage(tid)
+            return table
+
+        def build(tid):
+            # walk up to something we know and then back down, like lineage() does
+            walked = []
+            lineage = None
+            while True:
+                if tid in self.memory:
+                    lineage = self.memory[tid]
+                    break
+                if tid not in nodes or tid not in names:
+                    # probably a merged taxid
+                    lineage = self.lineage(tid)
+                    break
+                parent, rank = nodes[tid]
+                if parent == 1 or tid == 1:
+                    lineage = Lineage((), names[tid])
+                    self._remember(tid, lineage)
+                    break
+                walked.append((tid, parent, rank))
+                tid = parent
+
+            ranks, superkingdom = (), None
+            if lineage:
+                ranks, superkingdom = lineage
+            for tid, parent, rank in reversed(walked):
+                ranks = ((rank, names[tid]),) + ranks
+                if parent <= 1 or parent == 131567:
+                    # 131567 is cellular organisms
+                    superkingdom = names[tid]
+                lineage = Lineage(ranks, superkingdom)
+                self._remember(tid, lineage)
+            return lineage
+
+        if len(wanted) > self.maxsize:
+            self.maxsize = len(wanted)
+        for tid in wanted:
+            table[tid] = build(tid)
+
+        return table
+
+    def flush(self):
+        """
+        Write the new lineages to the disk cache
+        """
+
+        if self.disk is None or not self.pending:
+            return
+        rows = []
+        for taxid, lineage in self.pending.items():
+            if lineage is None:
+                rows.append((taxid, None))
+            else:
+                rows.append((taxid, json.dumps([lineage.ranks, lineage.superkingdom])))
+        self.disk.executemany("INSERT OR REPLACE INTO lineage VALUES (?, ?)", rows)
+        self.disk.commit()
+        self.pending = {}
+
+    def report(self):
+        """
+        Write the cache hits and misses to stderr
+        """
+
+        sys.stderr.write("Lineage cache: {} memory hits, {} disk hits, {} misses, {} bulk queries\n".format(
+            self.memory_hits, self.disk_hits, self.misses, self.queries))
+
+    def close(self):
+        """
+        Write everything to disk and close the disk cache
+        """
+
+        self.flush()
+        if self.verbose:
+            self.report()
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
@@ -0,0 +1,75 @@
+"""
+Normalise the ids of reads and leaves so they can be matched between the jplace tree, the placements,
+and the fastq files.
+
+This is shared by rename_tree_leaves.py and fastq2ids.py. All the patterns are compiled once, and
+cleaning an id is a single str.translate.
+"""
+
+import re
+from functools import lru_cache
+
+# characters that are not allowed in a newick name, and what we replace them with
+_newick_table = str.maketrans(' :[]', '____')
+
+_taxid_re = re.compile(r'\[(\d+)\]')
+# phylosift adds numbers to the end of the read ids
+_two_numbers_re = re.compile(r'\.\d+\.\d+$')
+_numbers_re = re.compile(r'\.[\d\.]+$')
+
+
+def clean_newick_id(name):
+    """
+    Return a version of name suitable for placement in a newick file
+    :param name: The name to clean up
+    :return: a name with no colons, spaces, etc
+    """
+
+    return name.translate(_newick_table)
+
+
+def leaf_taxid(name):
+    """
+    Get the NCBI taxonomy id from a leaf name like 'Escherichia coli [562]'
+    :param name: the leaf name
+    :return: the taxid as an int, or None if there isn't one
+    """
+
+    m = _taxid_re.search(name)
+    if not m:
+        return None
+    return int(m.group(1))
+
+
+@lru_cache(maxsize=1 << 20)
+def canonical_keys(name):
+    """
+    All the ways a leaf may appear in the fastq files, in the order we should try them: the name itself,
+    then without two trailing numbers (.1.2), then without any trailing numbers.
+    :param name: the leaf name
+    :return: a tuple of the distinct versions of the name
+    """
+
+    keys = [name]
+    for pattern in (_two_numbers_re, _numbers_re):
+        k = pattern.sub('', name)
+        if k not in keys:
+            keys.append(k)
+    return tuple(keys)
+
+
+def leaf_lookup(leaves, fqids):
+    """
+    Find the id in the fastq files for every leaf. After this, resolving a leaf is one dict lookup.
+    :param leaves: the leaf names
+    :param fqids: the dict of ids -> fastq files
+    :return: a dict of leaf -> id in the fastq files, for the leaves that are in the fastq files
+    """
+
+    lookup = {}
+    for l in leaves:
+        for k in canonical_keys(l):
+            if k in fqids:
+                lookup[l] = k
+                break
+    return lookup
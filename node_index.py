@@ -0,0 +1,183 @@
+"""
+A persistent index of the nodes in a tree, so we can explore a big tree without parsing it every time.
+
+print_tree_children.py used to parse the whole newick file and then look at every node for every question. The index
+is a SQLite database that is saved next to the tree (tree.nwk.idx) and is rebuilt whenever the tree changes. It has
+the parent, name, and branch length of every node, numbered in preorder, and where the subtree below each node ends, so
+the children, ancestors, and subtree of a node are all a query or two. The names are indexed, and so are the words in
+the names (e.g. the r_phylum and b_10 parts that rename_tree_leaves.py adds), so finding a node by its exact name or
+one of its words doesn't look at every node.
+"""
+
+import os
+import re
+import sys
+import sqlite3
+from arraytree import read_tree
+
+# change this whenever the layout of the index changes
+index_version = 1
+
+
+class NodeIndex:
+    """
+    An on disk index of the nodes of a tree.
+    """
+
+    def __init__(self, indexfile):
+        """
+        Open (or create) the index
+        :param indexfile: the SQLite file to keep the index in
+        """
+
+        self.indexfile = indexfile
+        self.conn = sqlite3.connect(indexfile)
+        self.conn.execute("PRAGMA mmap_size = 1073741824")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # id is the preorder number of the node, and last is the preorder number of the last node in its subtree
+        self.conn.execute("CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, parent INTEGER, last INTEGER, " +
+                          "name TEXT, dist REAL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (token TEXT, node INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS nodes_name ON nodes (name)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (parent)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tokens_token ON tokens (token)")
+        self.conn.create_function("regexp", 2, lambda pattern, name: re.search(pattern, name) is not None)
+        self.conn.commit()
+
+    @staticmethod
+    def _stamp(treefile):
+        st = os.stat(treefile)
+        return "{}\t{}\t{}\t{}".format(index_version, os.path.abspath(treefile), st.st_size, st.st_mtime_ns)
+
+    def stale(self, treefile):
+        """
+        Is the index missing, or from a different version of the tree
+        :param treefile: the newick file
+        :return: True if we need to build the index
+        """
+
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'tree'").fetchone()
+        return not row or row[0] != self._stamp(treefile)
+
+    def build(self, tree, treefile=None):
+        """
+        Replace the index with the nodes of a tree
+        :param tree: the ArrayTree
+        :param treefile: the newick file the tree came from, so we know when it changes
+        """
+
+        order = list(tree.preorder())
+        pre = {i: k for k, i in enumerate(order)}
+        last = [0] * len(order)
+        for i in reversed(order):
+            kids = tree.child_ids(i)
+            last[pre[i]] = last[pre[kids[-1]]] if len(kids) else pre[i]
+
+        self.conn.execute("DELETE FROM nodes")
+        self.conn.execute("DELETE FROM tokens")
+        self.conn.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?)",
+                              ((k, pre.get(tree.parent[i], -1), last[k], tree.names[i], tree.dist[i])
+                               for k, i in enumerate(order)))
+        self.conn.executemany("INSERT INTO tokens VALUES (?, ?)",
+                              ((t, k) for k, i in enumerate(order) for t in set(tree.names[i].split())))
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('tree', ?)",
+                          [self._stamp(treefile) if treefile else ""])
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def find(self, name=None, regexp=None, token=None):
+        """
+        Find the nodes by their exact name, a regular expression (like re.search), or a word in their name
+        (e.g. r_phylum or b_10). Use one of them.
+        :param name: the exact name
+        :param regexp: the regular expression
+        :param token: the word
+        :return: a list of the node ids, in preorder
+        """
+
+        if name is not None:
+            rows = self.conn.execute("SELECT id FROM nodes WHERE name = ? ORDER BY id", [name])
+        elif regexp is not None:
+            # check the pattern here, as an error inside the query doesn't say what was wrong with it
+            re.compile(regexp)
+            rows = self.conn.execute("SELECT id FROM nodes WHERE name REGEXP ? ORDER BY id", [regexp])
+        elif token is not None:
+            rows = self.conn.execute("SELECT node FROM tokens WHERE token = ? ORDER BY node", [token])
+        else:
+            raise ValueError("You must give a name, regexp, or token to find")
+        return [r[0] for r in rows]
+
+    def name(self, node):
+        return self.conn.execute("SELECT name FROM nodes WHERE id = ?", [node]).fetchone()[0]
+
+    def children(self, node):
+        """
+        The children of a node
+        :param node: the node id
+        :return: a list of the names of the children
+        """
+
+        return [r[0] for r in self.conn.execute("SELECT name FROM nodes WHERE parent = ? ORDER BY id", [node])]
+
+    def ancestors(self, node):
+        """
+        The ancestors of a node, from its parent up to the root
+        :param node: the node id
+        :return: a list of the names of the ancestors
+        """
+
+        names = []
+        row = self.conn.execute("SELECT parent FROM nodes WHERE id = ?", [node]).fetchone()
+        while row and row[0] >= 0:
+            row = self.conn.execute("SELECT parent, name FROM nodes WHERE id = ?", [row[0]]).fetchone()
+            names.append(row[1])
+        return names
+
+    def subtree(self, node, leaves=False):
+        """
+        Everything below a node, in preorder
+        :param node: the node id
+        :param leaves: only the leaves
+        :return: a list of the names of the nodes below this one
+        """
+
+        first, last = node + 1, self.conn.execute("SELECT last FROM nodes WHERE id = ?", [node]).fetchone()[0]
+        if leaves:
+            # a node is a leaf if its subtree is just itself
+            sql = "SELECT name FROM nodes WHERE id BETWEEN ? AND ? AND last = id ORDER BY id"
+        else:
+            sql = "SELECT name FROM nodes WHERE id BETWEEN ? AND ? ORDER BY id"
+        return [r[0] for r in self.conn.execute(sql, [first, last])]
+
+    def close(self):
+        self.conn.close()
+
+
+def tree_index(treefile, indexfile=None, verbose=False):
+    """
+    Open the index for a tree, and build it if it is missing or the tree has changed
+    :param treefile: the newick file
+    :param indexfile: the index file. Default is the tree file with .idx added
+    :param verbose: more output
+    :return: the NodeIndex
+    """
+
+    if indexfile is None:
+        indexfile = treefile + ".idx"
+    try:
+        index = NodeIndex(indexfile)
+        stale = index.stale(treefile)
+    except (sqlite3.Error, OSError) as e:
+        # e.g. we can't write next to the tree, so keep the index in memory for this run
+        sys.stderr.write("WARNING: Not saving the node index {}: {}\n".format(indexfile, e))
+        index = NodeIndex(":memory:")
+        stale = True
+    if stale:
+        if verbose:
+            sys.stderr.write("Indexing the nodes of {} in {}\n".format(treefile, indexfile))
+        index.build(read_tree(treefile), treefile)
+    elif verbose:
+        sys.stderr.write("Using the node index {}\n".format(indexfile))
+    return index
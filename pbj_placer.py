@@ -0,0 +1,311 @@
+"""
+Run the whole pbj_placer pipeline in one go.
+
+The separate scripts (rename_tree_leaves.py -> fastq2ids.py -> create_multibar.py / create_colorstrip.py) each
+write a file that the next one has to read and parse again. Here we build the tree, the placements, the leaf
+labels, and the counts once, pass them from one step to the next, and only write the files for ITOL. Use -k
+to also write the intermediate files if you want to check them, or run the scripts separately.
+
+    python3 pbj_placer.py run -j sharks.jplace -c fastq_classification.tsv -q fastq -n 4 -x class -o itol
+
+The separate scripts are subcommands too, with the same options as the script, e.g.
+
+    python3 pbj_placer.py rename -j sharks.jplace -o sharks.nwk -m sharks.placements
+
+Only the modules a subcommand needs are imported when it runs (the pipeline needs numpy and the taxonomy database,
+but e.g. pbj_placer.py children does not), so the short subcommands start quickly.
+"""
+
+import os
+import sys
+import runpy
+import argparse
+from jplace import placement_modes
+from profiling import profiler, add_profile_arguments, start_profile, write_profile
+
+# the subcommands that run one of the other scripts: the script and what it does
+scripts = {
+    'rename': ('rename_tree_leaves.py', 'rename the tree and write the placements (step one)'),
+    'labels': ('fastq2ids.py', 'classify the leaves of the tree from the fastq files (step two)'),
+    'multibar': ('create_multibar.py', 'count the placements and write the multibars (step three)'),
+    'colorstrip': ('create_colorstrip.py', 'write a color strip of the leaf labels'),
+    'trim': ('trim_tree.py', 'trim the tree at one or more taxonomic levels'),
+    'children': ('print_tree_children.py', 'find nodes in the tree and print their children'),
+}
+
+allowed_taxa = ['r_superkingdom', 'r_phylum', 'r_class', 'r_order', 'r_family', 'r_genus', 'r_species', 'r_subspecies']
+default_colors = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#ffff33', '#a65628', '#f781bf', '#999999']
+
+
+def build_tree(data, verbose=False):
+    """
+    Rename and reroot the tree from the jplace file. The nodes are named as they are read back from tree.nwk,
+    so the placements and counts we make from this tree are the same as create_multibar.py makes from tree.nwk.
+    :param data: the jplace data from load_jplacer
+    :param verbose: more output
+    :return: the renamed tree
+    """
+
+    from rename_tree_leaves import parse_jplacer_tree, rename_nodes_ncbi, reroot_tree
+    from arraytree import newick_name
+    tree = parse_jplacer_tree(data)
+    tree = rename_nodes_ncbi(tree, verbose)
+    tree = reroot_tree(tree, verbose)
+    tree.names = [newick_name(n).strip() for n in tree.names]
+    return tree
+
+
+def placement_rows(data, tree, mode='all', threshold=0.5, multiplicity=False):
+    """
+    The placements as rows of the mapping file from rename_tree_leaves.py
+    :param data: the jplace data
+    :param tree: the renamed tree
+    :param mode: one of placement_modes
+    :param threshold: the like_weight_ratio threshold for threshold mode
+    :param multiplicity: multiply the weights by the multiplicity of the reads
+    :return: a generator of [node name, read id] or [node name, read id, weight]
+    """
+
+    from rename_tree_leaves import mapping_rows, edge_names
+    return mapping_rows(data, edge_names(tree), mode, threshold, multiplicity)
+
+
+def run(jpf, fqfiles, classifile, outputdir, cols, ranks, proportions=False, colors=None, usemaxval=False,
+        legend=None, lshape="1", mode='all', threshold=0.5, multiplicity=False, threads=None, treeonly=False,
+        indexfile=None, intermediates=False, cachedir=None, cachesize=None, verbose=False):
+    """
+    Go from a jplace file to the files for ITOL. Everything is written to outputdir:
+
+        tree.nwk                    the renamed and rerooted tree
+        col{n}.{rank}/              the multibar files for each column of the classification and taxonomic level
+        col{n}.{rank}.tsv           the counts for each column and taxonomic level
+        col{n}.colorstrip.txt       the color strip for each column (if there is a legend)
+
+    and with intermediates, the placements and leaf labels that rename_tree_leaves.py and fastq2ids.py would have written.
+
+    The renamed tree, the placements, the fastq ids, the leaf labels, and the counts are kept in a StageCache, so
+    if you only change a later parameter (e.g. the colors or the taxonomic levels) the earlier steps are not repeated.
+
+    :param jpf: the jplace file
+    :param fqfiles: the list of fastq files
+    :param classifile: the fastq classification file
+    :param outputdir: the directory to write everything to
+    :param cols: the columns of the leaf labels to use (as in create_multibar.py -n)
+    :param ranks: the taxonomic levels (as in create_multibar.py -x)
+    :param proportions: display proportions rather than counts
+    :param colors: the colors to use
+    :param usemaxval: scale the multibars to the maximum value
+    :param legend: the legend for the color strips. If this is not set we don't make color strips
+    :param lshape: the shape of the legend in the color strips
+    :param mode: how to use the like_weight_ratio of the placements (see placement_matrix.py)
+    :param threshold: the like_weight_ratio threshold for threshold mode
+    :param multiplicity: multiply the weights by the multiplicity of the reads
+    :param threads: the number of processes to read the fastq files with
+    :param treeonly: only keep the reads from the fastq files that are leaves in the tree
+    :param indexfile: the fastq index file
+    :param intermediates: also write the intermediate files
+    :param cachedir: the stage cache directory (see StageCache). An empty string turns the cache off
+    :param cachesize: the largest the stage cache can be, in bytes
+    :param verbose: more output
+    :return:
+    """
+
+    # these are only imported here, so the other subcommands don't have to import numpy or open the taxonomy database
+    from rename_tree_leaves import load_jplacer, write_tree, write_placements
+    from leaf_labels import write_labels
+    from count_matrix import placement_mapping
+    from stage_cache import StageCache
+    from lineage_cache import taxonomy_db_file
+    from taxon import get_taxonomy_db
+    import fastq2ids
+    import create_multibar
+    import create_colorstrip
+
+    if colors is None:
+        colors = default_colors
+    if not os.path.exists(outputdir):
+        os.makedirs(outputdir)
+
+    cache = StageCache(cachedir, cachesize, verbose)
+    taxdb = taxonomy_db_file(get_taxonomy_db())
+
+    # step one: the tree and the placements
+    with profiler.stage('load_jplacer'):
+        data = load_jplacer(jpf)
+    tree_key = cache.key('tree', [jpf, taxdb])
+    with profiler.stage('tree'):
+        tree = cache.cached(tree_key, lambda: build_tree(data, verbose))
+        write_tree(tree, os.path.join(outputdir, "tree.nwk"))
+
+    pl_key = cache.key('placements', [], {'tree': tree_key, 'mode': mode, 'threshold': threshold,
+                                          'multiplicity': multiplicity})
+    with profiler.stage('placements'):
+        mapping = cache.cached(pl_key, lambda: placement_mapping(placement_rows(data, tree, mode, threshold,
+                                                                                multiplicity), verbose))
+        if intermediates:
+            write_placements(data, tree, os.path.join(outputdir, "placements.tsv"), mode, threshold, multiplicity,
+                             verbose)
+
+    # step two: classify the reads that are placed on the tree
+    def read_fastq():
+        with profiler.stage('fq_ids'):
+            if indexfile:
+                # the index is already a cache of the fastq files
+                return fastq2ids.fq_ids(fqfiles, verbose, threads, None, indexfile)
+            wanted = None
+            if treeonly:
+                wanted = fastq2ids.leaf_keys(mapping.read_codes.values)
+            fq_key = cache.key('fq_ids', fqfiles, {'wanted': pl_key if treeonly else None})
+            return cache.cached(fq_key, lambda: fastq2ids.fq_ids(fqfiles, verbose, threads, wanted))
+
+    labels_key = cache.key('labels', list(fqfiles) + [classifile, taxdb],
+                           {'placements': pl_key, 'treeonly': treeonly, 'index': indexfile})
+
+    def leaf_rows():
+        return cache.cached(labels_key, lambda: list(fastq2ids.classify_leaves(
+            mapping.read_codes.values, fqfiles, classifile, verbose, threads, treeonly, indexfile, read_fastq())))
+
+    # without -k we only need the labels if the counts are not in the cache
+    rows = None
+    if intermediates:
+        rows = leaf_rows()
+        with open(os.path.join(outputdir, "leaves.labels"), 'w') as out:
+            write_labels(rows, out)
+
+    # step three: the multibars and color strips
+    def count():
+        labels = create_multibar.label_columns(leaf_rows() if rows is None else rows, cols, verbose)
+        return create_multibar.label_matrices(mapping, labels, verbose)
+
+    remap_key = cache.key('remap', [], {'labels': labels_key, 'placements': pl_key, 'cols': cols})
+    # the labels are made inside this stage when they are not in the cache, and fq_ids is its own stage
+    with profiler.stage('remap'):
+        matrices = cache.cached(remap_key, count)
+
+    with profiler.stage('multibar_counts'):
+        mbcounts = create_multibar.multibar_batch(tree, matrices, ranks, proportions, verbose)
+    with profiler.stage('write'):
+        for (col, taxa), counts in mbcounts.items():
+            rank = taxa.replace('r_', '', 1)
+            create_multibar.write_directory(counts, os.path.join(outputdir, "col{}.{}".format(col, rank)), colors,
+                                            proportions, usemaxval, verbose)
+            create_multibar.write_tsv(counts, taxa, os.path.join(outputdir, "col{}.{}.tsv".format(col, rank)),
+                                      verbose)
+
+        if legend:
+            for col, mapdata in matrices.items():
+                create_colorstrip.write_output(mapdata, colors, legend, lshape,
+                                               os.path.join(outputdir, "col{}.colorstrip.txt".format(col)), verbose)
+    profiler.count('stage cache hits', cache.hits)
+    profiler.count('stage cache misses', cache.misses)
+
+    if verbose:
+        cache.report()
+
+
+def fastq_files(files, directory):
+    """
+    Get the list of fastq files
+    :param files: the fastq files
+    :param directory: a directory of fastq files
+    :return: the list of fastq files
+    """
+
+    fqfiles = []
+    if files:
+        fqfiles = list(files)
+    if directory:
+        for q in os.listdir(directory):
+            if q.endswith('fastq') or q.endswith('fastq.gz'):
+                fqfiles.append(os.path.join(directory, q))
+    return fqfiles
+
+
+def run_script(command, argv):
+    """
+    Run one of the other scripts as a subcommand, as if it was run on its own
+    :param command: the subcommand (one of scripts)
+    :param argv: the arguments for the script
+    """
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), scripts[command][0])
+    sys.argv = [script] + list(argv)
+    runpy.run_path(script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pbj_placer: reformat jplace files for ITOL')
+    subparsers = parser.add_subparsers(dest='command')
+
+    rp = subparsers.add_parser('run', help='run the whole pipeline from the jplace file to the files for ITOL')
+    rp.add_argument('-j', help='jplacer file', required=True)
+    rp.add_argument('-c', help='fastq classification file', required=True)
+    rp.add_argument('-q', help='directory of fastq files')
+    rp.add_argument('-f', help='fastq file(s) [one or more can be specified]', action='append')
+    rp.add_argument('-o', help='output directory to write the files to', required=True)
+    rp.add_argument('-n', help='column in the leaf labels to use. 0 indexed. Use more than one -n for several columns',
+                    required=True, type=int, action='append')
+    rp.add_argument('-x', help='taxa to use for the labels. Use more than one -x for several taxa', required=True,
+                    action='append')
+    rp.add_argument('-p', help='Display proportion of counts not counts', action='store_true')
+    rp.add_argument('--color', help='Colors to use. These will be prepended to our default list', action='append')
+    rp.add_argument('--maxval', help='Scale based on the maximum value, otherwise all bars are width=50',
+                    action='store_true')
+    rp.add_argument('-l', help='also write a color strip for each column, with this legend')
+    rp.add_argument('-s', help='Legend shape for the color strip (a number). Default = 1', default="1", type=str)
+    rp.add_argument('-w', help='how to use the like_weight_ratio of the placements (see rename_tree_leaves.py)',
+                    choices=placement_modes, default='all')
+    rp.add_argument('--threshold', help='like_weight_ratio threshold for -w threshold (default 0.5)', type=float,
+                    default=0.5)
+    rp.add_argument('--multiplicity', help='multiply the weights by the multiplicity of each read',
+                    action='store_true')
+    rp.add_argument('-t', help='number of processes to read the fastq files with. Default is one per cpu', type=int)
+    rp.add_argument('-r', help='only keep the reads from the fastq files that are placed on the tree',
+                    action='store_true')
+    rp.add_argument('-i', help='index file of the fastq ids (see fastq2ids.py)')
+    rp.add_argument('-k', help='keep the intermediate files (placements.tsv and leaves.labels) in the output directory',
+                    action='store_true')
+    rp.add_argument('--cache', help='directory for the stage cache. Default is $PBJ_PLACER_STAGE_CACHE or ' +
+                                    '~/.cache/pbj_placer/stages')
+    rp.add_argument('--cache-size', help='the largest the stage cache can be, in MB. Default is 2048', type=int)
+    rp.add_argument('--no-cache', help="don't use the stage cache", action='store_true')
+    rp.add_argument('-v', help='verbose output', action='store_true')
+    add_profile_arguments(rp)
+
+    for command, (script, description) in scripts.items():
+        subparsers.add_parser(command, help="{} (the options are the same as {})".format(description, script),
+                              add_help=False)
+
+    # the scripts parse their own arguments, so we hand them everything after the subcommand
+    if len(sys.argv) > 1 and sys.argv[1] in scripts:
+        run_script(sys.argv[1], sys.argv[2:])
+        sys.exit(0)
+
+    args = parser.parse_args()
+
+    if args.command != 'run':
+        parser.print_help()
+        sys.exit(-1)
+
+    fqfiles = fastq_files(args.f, args.q)
+    if len(fqfiles) == 0:
+        sys.stderr.write("You must supply some fastq files with either -q (directory) or -f (files)\n")
+        sys.exit(-1)
+
+    ranks = []
+    for x in dict.fromkeys(args.x):
+        taxa = x if x.startswith('r_') else "r_{}".format(x)
+        if taxa not in allowed_taxa:
+            sys.stderr.write("Sorry: {} is not an allowed taxa. Your choices are\n{}\n".format(taxa, " ".join(allowed_taxa)))
+            sys.exit(-1)
+        ranks.append(taxa)
+
+    colors = default_colors
+    if args.color:
+        colors = args.color + colors
+
+    start_profile(args)
+    run(args.j, fqfiles, args.c, args.o, list(dict.fromkeys(args.n)), ranks, args.p, colors, args.maxval, args.l,
+        args.s, args.w, args.threshold, args.multiplicity, args.t, args.r, args.i, args.k,
+        "" if args.no_cache else args.cache, args.cache_size << 20 if args.cache_size is not None else None, args.v)
+    write_profile(args)
@@ -0,0 +1,120 @@
+"""
+Keep the placements from a jplace file as a sparse edges x reads matrix of weights.
+
+pplacer and PhyloSift give every read several candidate edges, each with a like_weight_ratio. If we add every
+read to every candidate edge, a read placed on three edges is counted three times downstream. Here we keep
+the weights, and choose how to use them:
+
+    all         every candidate edge, with weight 1 (what get_placements does)
+    best        only the edge with the highest like_weight_ratio, with weight 1
+    weighted    every candidate edge, weighted by its like_weight_ratio
+    threshold   the edges with a like_weight_ratio of at least the threshold, with weight 1
+
+and optionally multiply the weights by the multiplicity of each read (from the nm entries).
+
+The matrix is stored as three NumPy arrays (edge number, read number, and weight) in coordinate format.
+"""
+
+from array import array
+import numpy as np
+from jplace import placement_names, placement_modes
+from profiling import profiler
+
+
+class PlacementMatrix:
+    """
+    A sparse matrix of edges x reads. Entry i places read reads[i] on edge edges[i] with weight weights[i].
+    """
+
+    def __init__(self, edges, reads, weights, read_names):
+        """
+        :param edges: NumPy array of the jplace edge numbers
+        :param reads: NumPy array of the read numbers (indices into read_names)
+        :param weights: NumPy array of the weights
+        :param read_names: the list of read names
+        """
+
+        self.edges = edges
+        self.reads = reads
+        self.weights = weights
+        self.read_names = read_names
+
+    def __len__(self):
+        return len(self.edges)
+
+    def edge_totals(self):
+        """
+        Add up the weights on each edge
+        :return: a NumPy array of the edge numbers and a NumPy array of the total weight on each edge
+        """
+
+        uniq, inverse = np.unique(self.edges, return_inverse=True)
+        return uniq, np.bincount(inverse, weights=self.weights, minlength=len(uniq))
+
+    def read_totals(self):
+        """
+        Add up the weights of each read
+        :return: a NumPy array with the total weight of each read
+        """
+
+        return np.bincount(self.reads, weights=self.weights, minlength=len(self.read_names))
+
+
+def read_placement_matrix(data, mode='all', threshold=0.5, multiplicity=False):
+    """
+    Read the placements from a jplace file (one record at a time) into a PlacementMatrix
+    :param data: the parsed jplacer tree
+    :param mode: one of placement_modes
+    :param threshold: the smallest like_weight_ratio to keep in threshold mode
+    :param multiplicity: multiply the weights by the multiplicity of each read
+    :return: the PlacementMatrix
+    """
+
+    if mode not in placement_modes:
+        raise ValueError("Placement mode must be one of {} not {}".format(", ".join(placement_modes), mode))
+
+    fields = data['fields']
+    eposn = fields.index('edge_num')
+    lposn = None
+    if mode != 'all':
+        if 'like_weight_ratio' not in fields:
+            raise ValueError("The jplace file does not have a like_weight_ratio, so we can not use {} mode".format(mode))
+        lposn = fields.index('like_weight_ratio')
+
+    edges = array('q')
+    reads = array('q')
+    weights = array('d')
+    codes = {}
+    read_names = []
+
+    parsed = 0
+    for pl in data['placements']:
+        parsed += 1
+        rows = pl['p']
+        if mode == 'all':
+            chosen = [(e, 1.0) for e in dict.fromkeys(p[eposn] for p in rows)]
+        elif mode == 'best':
+            best = max(rows, key=lambda p: p[lposn])
+            chosen = [(best[eposn], 1.0)]
+        elif mode == 'weighted':
+            chosen = [(p[eposn], p[lposn]) for p in rows]
+        else:
+            chosen = [(p[eposn], 1.0) for p in rows if p[lposn] >= threshold]
+        if not chosen:
+            continue
+
+        for name, mult in placement_names(pl):
+            code = codes.get(name)
+            if code is None:
+                code = len(read_names)
+                codes[name] = code
+                read_names.append(name)
+            scale = mult if multiplicity else 1
+            for e, w in chosen:
+                edges.append(e)
+                reads.append(code)
+                weights.append(w * scale)
+    profiler.count('placements parsed', parsed)
+
+    return PlacementMatrix(np.frombuffer(edges, dtype=np.int64), np.frombuffer(reads, dtype=np.int64),
+                           np.frombuffer(weights, dtype=np.float64), read_names)
@@ -1,22 +1,43 @@
 """
 Just print the children for a node. This is to help explore the tree.
+
+The nodes are kept in an index next to the tree (see node_index.py), so after the first time we don't need to parse
+the tree again. Use -q to ask lots of questions at once, either from a file or (with -q -) typed in one at a time:
+
+    children Bacteria r_superkingdom b_10
+    ancestors re:Leaf x100033
+    subtree tok:b_10
+    leaves tok:r_phylum
+    find re:^class
+
+A name on its own must match exactly, re: is a regular expression, and tok: is a word in the name (e.g. r_phylum or b_10).
 """
 
 import os
 import sys
 import argparse
-from ete3 import Tree
-from ete3.parser.newick import NewickError
 import re
+import sqlite3
+from arraytree import read_tree as read_array_tree
+from node_index import tree_index
+from profiling import profiler, add_profile_arguments, start_profile, write_profile
+
+# the questions we can answer with -q, and the heading for each of them
+query_headings = {
+    'children': "Children for {}:",
+    'ancestors': "Ancestors of {}:",
+    'subtree': "Subtree below {}:",
+    'leaves': "Leaves below {}:",
+}
 
 def read_tree(treefile):
     """
     Read the tree file and return the tree
     :param treefile: The tree file to read
-    :return: The ete3 tree object
+    :return: The tree object
     """
 
-    return Tree(treefile, quoted_node_names=True, format=1)
+    return read_array_tree(treefile)
 
 def print_children(tree, node):
     """
@@ -45,19 +66,113 @@ def regexp_children(tree, node):
             print("Children for {}:\n\t{}".format(n.name, "\n\t".join([x.name for x in children])))
 
 
+def find_nodes(index, pattern):
+    """
+    Find the nodes that match a pattern from a query
+    :param index: the NodeIndex
+    :param pattern: an exact name, re: and a regular expression, or tok: and a word in the name
+    :return: a list of the node ids
+    """
+
+    if pattern.startswith('re:'):
+        return index.find(regexp=pattern[3:])
+    if pattern.startswith('tok:'):
+        return index.find(token=pattern[4:])
+    return index.find(name=pattern)
+
+
+def answer(index, command, pattern, out=sys.stdout):
+    """
+    Answer one question about the tree
+    :param index: the NodeIndex
+    :param command: find, or one of query_headings
+    :param pattern: the nodes to ask about (see find_nodes)
+    :param out: where to write the answer
+    :return: the number of nodes that matched
+    """
+
+    nodes = find_nodes(index, pattern)
+    if not nodes:
+        sys.stderr.write("No nodes match {}\n".format(pattern))
+    for n in nodes:
+        if command == 'find':
+            out.write("{}\n".format(index.name(n)))
+            continue
+        if command == 'children':
+            names = index.children(n)
+        elif command == 'ancestors':
+            names = index.ancestors(n)
+        else:
+            names = index.subtree(n, command == 'leaves')
+        out.write(query_headings[command].format(index.name(n)) + "\n\t" + "\n\t".join(names) + "\n")
+    profiler.count('nodes matched', len(nodes))
+    return len(nodes)
+
+
+def run_queries(index, queries, out=sys.stdout, interactive=False):
+    """
+    Answer a lot of questions, one per line (see the top of this file)
+    :param index: the NodeIndex
+    :param queries: the lines with the questions (e.g. a file or sys.stdin)
+    :param out: where to write the answers
+    :param interactive: prompt for each question
+    """
+
+    commands = ['find'] + list(query_headings)
+    while True:
+        if interactive:
+            sys.stderr.write("> ")
+            sys.stderr.flush()
+        line = queries.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        command, _, pattern = line.partition(' ')
+        if command in ('quit', 'exit'):
+            break
+        if command not in commands or not pattern:
+            sys.stderr.write("Sorry, questions look like: {} pattern\n".format("|".join(commands)))
+            continue
+        try:
+            answer(index, command, pattern, out)
+        except (re.error, sqlite3.Error) as e:
+            sys.stderr.write("Sorry, can't answer {}: {}\n".format(line, e))
+        out.flush()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Print the children of a tree")
     parser.add_argument('-t', help='tree file', required=True)
     parser.add_argument('-n', help='full name of the node')
     parser.add_argument('-r', help='partial name of the node to be matched with regexp')
+    parser.add_argument('-k', help='a word in the name of the node (e.g. r_phylum or b_10)')
+    parser.add_argument('-q', help='file of questions to answer, one per line. Use - to type them in')
+    parser.add_argument('-i', help='node index file. Default is the tree file with .idx added')
     parser.add_argument('-v', help='verbose output', action="store_true")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile(args)
 
-    tree = read_tree(args.t)
-    if args.n:
-        print_children(tree, args.n)
-    elif args.r:
-        regexp_children(tree, args.r)
-    else:
-        sys.stderr.write("Sorry, one of -r or -n must be specified\n")
+    if not (args.n or args.r or args.k or args.q):
+        sys.stderr.write("Sorry, one of -r, -n, -k, or -q must be specified\n")
         sys.exit(-1)
+
+    with profiler.stage('index'):
+        index = tree_index(args.t, args.i, args.v)
+    with profiler.stage('find'):
+        if args.n:
+            answer(index, 'children', args.n)
+        elif args.r:
+            answer(index, 'children', "re:" + args.r)
+        elif args.k:
+            answer(index, 'children', "tok:" + args.k)
+        elif args.q == '-':
+            run_queries(index, sys.stdin, interactive=sys.stdin.isatty())
+        else:
+            with open(args.q, 'r') as f:
+                run_queries(index, f)
+    index.close()
+
+    write_profile(args)
@@ -0,0 +1,240 @@
+"""
+Measure where the time and memory go when we run the scripts.
+
+Every script takes --profile FILE. With that, each stage (reading the jplace file, renaming the tree, reading the
+fastq files, counting the placements, ...) is timed, and we write a JSON file with the wall time and peak memory
+of each stage and counters of how much work was done (taxonomy queries, reads indexed, placements parsed, nodes
+visited). Add --cprofile to also run cProfile over the whole script (the stats are written to FILE.prof, and the
+slowest functions are added to the JSON file), and --tracemalloc to also measure the memory Python allocates in
+each stage. Without --profile this all costs next to nothing.
+
+    python3 rename_tree_leaves.py -j sharks.jplace -o sharks.nwk -m sharks.placements --profile rename.json
+"""
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not on windows
+    resource = None
+
+
+def peak_rss():
+    """
+    The peak resident set size of this process
+    :return: the size in bytes, or None if we can't tell
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Profiler:
+    """
+    The timings and counters of one run. The scripts share the module level profiler.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.cprofile = None
+        self.stages = []
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    def reset(self):
+        """
+        Forget the stages and counters we have recorded so far
+        """
+
+        self.stages = []
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    def enable(self, cprofile=False, trace_memory=False):
+        """
+        Start recording
+        :param cprofile: also run cProfile
+        :param trace_memory: also measure the memory allocated in each stage with tracemalloc
+        """
+
+        self.enabled = True
+        self.started = time.perf_counter()
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+            self.trace_memory = True
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the script. Use it as a context manager:
+
+            with profiler.stage('rename'):
+                tree = rename_nodes_ncbi(tree)
+
+        :param name: the name of the stage
+        """
+
+        if not self.enabled:
+            yield
+            return
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'stage': name, 'seconds': time.perf_counter() - start, 'peak_rss': peak_rss()}
+            if self.trace_memory:
+                import tracemalloc
+                record['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(record)
+
+    def count(self, name, n=1):
+        """
+        Add to a counter
+        :param name: what we are counting
+        :param n: how many to add
+        """
+
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """
+        Everything we measured
+        :return: a dict that can be written as JSON
+        """
+
+        return {
+            'command': sys.argv,
+            'seconds': time.perf_counter() - self.started,
+            'peak_rss': peak_rss(),
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+
+    def write(self, outputf, top=25):
+        """
+        Stop recording and write the JSON file. If we ran cProfile its stats are written to outputf.prof
+        :param outputf: the file to write
+        :param top: how many of the slowest functions from cProfile to include
+        """
+
+        rep = self.report()
+        if self.cprofile is not None:
+            import pstats
+            self.cprofile.disable()
+            self.cprofile.dump_stats(outputf + ".prof")
+            stats = pstats.Stats(self.cprofile)
+            functions = []
+            for (fname, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+                functions.append({'function': "{}:{}({})".format(os.path.basename(fname), line, func),
+                                  'calls': nc, 'tottime': tt, 'cumtime': ct})
+            functions.sort(key=lambda x: x['cumtime'], reverse=True)
+            rep['functions'] = functions[:top]
+            rep['cprofile'] = outputf + ".prof"
+            self.cprofile = None
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.stop()
+            self.trace_memory = False
+        with open(outputf, 'w') as out:
+            json.dump(rep, out, indent=1)
+        self.enabled = False
+
+
+profiler = Profiler()
+
+
+class Progress:
+    """
+    Progress for verbose output that is written at most every few seconds, rather than once per item.
+    """
+
+    def __init__(self, what, verbose=True, interval=5.0):
+        """
+        :param what: what we are doing (e.g. Renamed nodes)
+        :param verbose: whether to write anything at all
+        :param interval: the minimum number of seconds between messages
+        """
+
+        self.what = what
+        self.verbose = verbose
+        self.interval = interval
+        self.n = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update(self, n=1):
+        """
+        Count some more items, and write the progress if it has been long enough since we last did
+        :param n: the number of items
+        """
+
+        self.n += n
+        if not self.verbose:
+            return
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            sys.stderr.write("{}: {} ({:.0f} per second)\n".format(self.what, self.n, self.n / (now - self.start)))
+
+    def done(self, extra=""):
+        """
+        Write the total
+        :param extra: anything else to add to the message
+        """
+
+        if self.verbose:
+            sys.stderr.write("{}: {} in {:.1f} seconds{}\n".format(self.what, self.n, time.perf_counter() - self.start,
+                                                                   extra))
+
+
+def add_profile_arguments(parser):
+    """
+    Add --profile, --cprofile, and --tracemalloc to a script's arguments
+    :param parser: the argparse parser
+    """
+
+    parser.add_argument('--profile', help='write the time and memory used by each stage to this JSON file')
+    parser.add_argument('--cprofile', help='with --profile, also run cProfile and write its stats to the ' +
+                                           'profile file with .prof added', action='store_true')
+    parser.add_argument('--tracemalloc', help='with --profile, also measure the memory allocated in each stage ' +
+                                              '(this makes everything slower)', action='store_true')
+
+
+def start_profile(args):
+    """
+    Start the profiler if --profile was given
+    :param args: the parsed arguments
+    """
+
+    if args.profile:
+        profiler.enable(args.cprofile, args.tracemalloc)
+
+
+def write_profile(args):
+    """
+    Write the profile if --profile was given
+    :param args: the parsed arguments
+    """
+
+    if args.profile:
+        profiler.write(args.profile)
+        if getattr(args, 'v', False):
+            sys.stderr.write("Wrote the profile to {}\n".format(args.profile))
@@ -6,42 +6,45 @@ Rewrite the leaves in a jplacer file with taxonomic level (One of 'superkingdom'
 import os
 import sys
 import argparse
-import json
 import re
-from ete3 import Tree
-from ete3.parser.newick import NewickError
-
-
-from taxon import get_taxonomy_db, get_taxonomy
+import shutil
+import itertools
+import tempfile
+from taxon import get_taxonomy_db
+from lineage_cache import LineageCache
+from jplace import load_jplace, read_jplace_tree, placement_names, placement_modes
+from newick_ids import leaf_taxid
+from arraytree import parse_newick, newick_name
+from profiling import profiler, Progress, add_profile_arguments, start_profile, write_profile
 
 
 def load_jplacer(jpf):
     """
-    load the jplacer file and return the tree
+    load the jplacer file and return the tree. The placements are not read into
+    memory, but are read from the file each time you iterate over data['placements']
     :param jpf: The jplacer file
     :return: the data structure of the tree
     """
 
-    with open(jpf, 'r') as f:
-        data = json.load(f)
-
-    return data
+    return load_jplace(jpf)
 
 def parse_jplacer_tree(data):
     """
-    Extract the tree from the jplacer data structure and make it into an ete3 object
+    Extract the tree from the jplacer data structure and make it into an ArrayTree. The
+    edge numbers ({n}) are kept in the tree's edge_num array whether they are before or after the branch lengths.
     :param data: the jplacer data structure
     :return:
     """
 
-    try:
-        tree = Tree(data['tree'], quoted_node_names=True, format=1)
-    except NewickError as n:
-        tt = re.sub(r'(\:[\d\.]+){\d+}', r'\1', data['tree'])
-        tt = re.sub(r'{\d+};$', ';', tt)
-        tree = Tree(tt, quoted_node_names=True, format=1)
+    return parse_newick(data['tree'])
 
-    return tree
+# more than one taxonomy below a node at this level
+_conflict = object()
+_branch_re = re.compile(r'\s+b_\d+')
+_rank_re = re.compile(r'r_\w+\s+')
+_edge_re = re.compile(r'{(\d+)}')
+# the superkingdoms we reroot between, as bits
+superkingdom_bits = {'Bacteria': 1, 'Archaea': 2, 'Eukaryota': 4}
 
 def rename_nodes_ncbi(tree, verbose=False):
     """
@@ -55,185 +58,404 @@ def rename_nodes_ncbi(tree, verbose=False):
 
     # connect to the SQL dataabase
     c = get_taxonomy_db()
+    lineages = LineageCache(c, verbose=verbose)
 
     wanted_levels = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'subspecies']
     wanted_levels.reverse()  # too lazy to write in reverse :)
     taxonomy = {}
-    # first get all the leaves and their parents. This is just to speed things up ... maybe
+    # first get all the leaves and their taxids, and then look up all the taxids at once
+    leaftids = {}
+    notaxid = 0
     for l in tree.get_leaves():
-        m = re.search('\[(\d+)\]', l.name)
-        if not m:
-            if verbose:
-                sys.stderr.write("No taxid in {}\n".format(l.name))
+        tid = leaf_taxid(l.name)
+        if tid is None:
+            notaxid += 1
             continue
-        tid = m.groups()[0]
-        taxonomy[l.name] = {}
-        t, n = get_taxonomy(tid, c)
-        if not t:
+        leaftids[l.name] = tid
+    if verbose and notaxid:
+        sys.stderr.write("{} leaves do not have a taxid\n".format(notaxid))
+
+    table = lineages.resolve(leaftids.values())
+    lineages.close()
+    for lname, tid in leaftids.items():
+        taxonomy[lname] = {}
+        if not table[tid]:
             continue
-        while t.parent != 1 and t.taxid != 1:
-            if t.rank in wanted_levels:
-                taxonomy[l.name][t.rank] = n.scientific_name
-            t, n = get_taxonomy(t.parent, c)
+        for rank, name in table[tid].ranks:
+            if rank in wanted_levels:
+                taxonomy[lname][rank] = name
 
     # now traverse every node that is not a leaf and see if we can some up with a
     # unique name for the node!
+    #
+    # For every node we keep a summary of the leaves below it: for each wanted level that is
+    # None if none of the leaves have that level, the name if they all agree, or _conflict if
+    # they do not. The summary of a node is merged from the summaries of its children, so we never
+    # need to look at all the leaves below a node.
     if verbose:
         sys.stderr.write("Traversing the tree to rename the nodes\n")
+    #
+    # We also keep the superkingdom that each node is named for (e.g. Bacteria r_superkingdom b_10), as
+    # one of the superkingdom_bits, so that reroot_tree doesn't need to look at the names again. Only the
+    # nodes named for the superkingdom rank count, and a node that loses its rank to its parent loses it.
+    summaries = {}
+    superkingdoms = {}
     branchnum = 0
+    inherited = 0
+    renamed = 0
+    progress = Progress("Renamed nodes", verbose)
     for n in tree.traverse("postorder"):
         if n.is_leaf():
+            if n.name in taxonomy:
+                summaries[n] = [taxonomy[n.name].get(w) for w in wanted_levels]
+            else:
+                summaries[n] = [None] * len(wanted_levels)
+            superkingdoms[n] = 0
             continue
+
+        children = n.get_children()
+        taxs = [None] * len(wanted_levels)
+        for c in children:
+            for i, v in enumerate(summaries.pop(c)):
+                if v is None or taxs[i] is _conflict:
+                    continue
+                if taxs[i] is None:
+                    taxs[i] = v
+                elif taxs[i] != v:
+                    taxs[i] = _conflict
+        summaries[n] = taxs
+
         ## if both our children have the same name, we acquire that name and reset their names
         ## otherwise we figure out what our name should be based on the last common ancestor
         ## of the leaves.
-
-        children = n.get_children()
-        names = set([re.sub('\s+b_\d+', '', x.name) for x in children])
+        names = set([_branch_re.sub('', x.name) for x in children])
         if len(names) == 1:
             n.name = "{} b_{}".format(names.pop(), branchnum)
-            if verbose:
-                sys.stderr.write("Reset name to {} because both children are the same\n".format(n.name))
+            # we have the same name as our children, so we are named for the same superkingdom
+            superkingdoms[n] = superkingdoms[children[0]]
+            inherited += 1
             for c in children:
-                oldname = c.name
-                c.name = re.sub('r_\w+\s+', '', c.name)
-                if verbose:
-                    sys.stderr.write("\tAs both children the same set {} to {}\n".format(oldname, c.name))
+                c.name = _rank_re.sub('', c.name)
+                superkingdoms[c] = 0
         else:
-            ## We have to figure out what our unique name should be
-            taxs = {w: set() for w in wanted_levels}
-            for l in n.get_leaves():
-                if l.name not in taxonomy:
-                    continue
-                for w in wanted_levels:
-                    if w in taxonomy[l.name]:
-                        taxs[w].add(taxonomy[l.name][w])
+            superkingdoms[n] = 0
             # which is the LOWEST level with a single taxonomy
-            for w in wanted_levels:
-                if len(taxs[w]) == 1:
-                    newname = "{} r_{} b_{}".format(taxs[w].pop(), w, branchnum)
-                    if verbose:
-                        sys.stderr.write("Changing name from: {} to {}\n".format(n.name, newname))
+            for i, w in enumerate(wanted_levels):
+                if taxs[i] is not None and taxs[i] is not _conflict:
+                    newname = "{} r_{} b_{}".format(taxs[i], w, branchnum)
                     n.name = newname
+                    renamed += 1
+                    if w == 'superkingdom':
+                        superkingdoms[n] = superkingdom_bits.get(taxs[i], 0)
                     break
         branchnum += 1
+        progress.update()
+
+    progress.done(" ({} named for the taxonomy below them, {} named for their children)".format(renamed, inherited))
+    profiler.count('nodes visited', len(superkingdoms))
+    tree.superkingdoms = superkingdoms
     return tree
 
 def reroot_tree(tree, verbose=False):
     """
     Reroot the tree between bacteria and archaea.
 
-    This will only work after renaming the leaves on the tree.
+    This will only work after renaming the leaves on the tree. We use the superkingdoms that rename_nodes_ncbi
+    found for each node, and go through the tree once: we reroot at the first node whose two children are
+    Archaea and Eukaryota, or at the Bacteria child of the first node whose two children are Bacteria and Archaea.
+    If there isn't one, we reroot at the first Bacteria node.
 
     :param tree: the tree
     """
 
-    didreroot = False
+    bacteria = superkingdom_bits['Bacteria']
+    archaea = superkingdom_bits['Archaea']
+    eukaryota = superkingdom_bits['Eukaryota']
+
+    superkingdoms = getattr(tree, 'superkingdoms', None)
+    if superkingdoms is None:
+        raise ValueError("The tree has to be renamed with rename_nodes_ncbi before it can be rerooted")
 
     if verbose:
         sys.stderr.write("rerooting the tree\n")
+
+    outgroup = None
+    firstbacteria = None
+    visited = 0
     for n in tree.traverse("preorder"):
+        visited += 1
+        if firstbacteria is None and superkingdoms.get(n, 0) & bacteria:
+            firstbacteria = n
         childs = n.get_children()
+        if len(childs) != 2:
+            continue
+        m0 = superkingdoms.get(childs[0], 0)
+        m1 = superkingdoms.get(childs[1], 0)
+        if (m0 & archaea and m1 & eukaryota) or (m1 & archaea and m0 & eukaryota):
+            outgroup = n
+            break
+        if m0 & bacteria and m1 & archaea:
+            outgroup = childs[0]
+            break
+        if m1 & bacteria and m0 & archaea:
+            outgroup = childs[1]
+            break
+
+    profiler.count('nodes visited', visited)
+    if verbose:
+        sys.stderr.write("Checked {} nodes to find the root\n".format(visited))
+
+    if outgroup is not None:
+        tree.set_outgroup(outgroup)
+        if verbose:
+            sys.stderr.write("Rerooted on {}\n".format(outgroup.name))
+    elif firstbacteria is not None:
+        tree.set_outgroup(firstbacteria)
         if verbose:
-            cname = ""
-            for c in childs:
-                cname += "| {} |".format(c.name)
-            sys.stderr.write("{}\t{}\t{}\n".format(len(childs), n.name, cname))
-        if len(childs) == 2:
-            if ("Archaea r_superkingdom" in childs[0].name and "Eukaryota r_superkingdom" in childs[1].name) or (
-                    "Archaea r_superkingdom" in childs[1].name and "Eukaryota r_superkingdom" in childs[0].name):
-                tree.set_outgroup(n)
-                if verbose:
-                    sys.stderr.write("Rerooted on {}\n".format(n.name))
-                didreroot = True
-                break
-            if "Bacteria r_superkingdom" in childs[0].name and "Archaea r_superkingdom" in childs[1].name:
-                tree.set_outgroup(childs[0])
-                if verbose:
-                    sys.stderr.write("Rerooted on {}\n".format(childs[0].name))
-                didreroot = True
-                break
-            if "Bacteria r_superkingdom" in childs[1].name and "Archaea r_superkingdom" in childs[0].name:
-                tree.set_outgroup(childs[1])
-                if verbose:
-                    sys.stderr.write("Rerooted on {}\n".format(childs[1].name))
-                didreroot = True
-                break
-
-    if not didreroot:
-        for n in tree.traverse("preorder"):
-            if "Bacteria r_superkingdom" in n.name:
-                tree.set_outgroup(n)
-                if verbose:
-                    sys.stderr.write("Rerooted on {} because it is bacteria\n".format(n.name))
-                break
+            sys.stderr.write("Rerooted on {} because it is bacteria\n".format(firstbacteria.name))
 
     return tree
 
-def clean_newick_id(name):
-    """
-    Return a version of name suitable for placement in a newick file
-    :param name: The name to clean up
-    :return: a name with no colons, spaces, etc
-    """
-    name = name.replace(' ', '_')
-    name = name.replace(':', '_')
-    name = name.replace('[', '_')
-    name = name.replace(']', '_')
-
-    return name
-
 def get_placements(data):
     """
-    Get the placements and return a dict with the keys being the edge numbers where to do
-    the insertions and the values being a set of nodes to insert at that point.
+    Get the placements one record at a time. For every edge that a record is placed on we yield the edge
+    number where to do the insertion and the set of nodes to insert at that point. Because this is a
+    generator, the placements are never all in memory at once.
 
-    TODO: we have not implemented the approach for a single insertion as we don't have an example of that (yet!)
+    The reads can be named with either n or nm (see jplace.placement_names).
 
     :param data: the parsed jplacer tree
-    :return: a dict of placement edge_numbers and sets of ids to add
+    :return: a generator of placement edge_numbers and sets of ids to add
     """
 
     # first make sure the tree fields are in the correct order!
     posn = data['fields'].index('edge_num')
-    placements = {}
 
-    for pl in data['placements']:
-        addhere = set()
-        if 'n' in pl:
-            sys.stderr.write("Crap, not sure what to do because I've never seen an example. You should be able to figure out from what I did with nm\n")
-            sys.exit(-1)
-        if 'nm' in pl:
-            for i in pl['nm']:
-                addhere.add(clean_newick_id(i[0]))
-        for p in pl['p']:
-            edge_num = p[posn]
-            if edge_num not in placements:
-                placements[edge_num] = set()
-            placements[edge_num].update(addhere)
-
-    return placements
-
-def write_placement_tuples(pl, tree, tpoutfile, verbose=False):
+    parsed = 0
+    try:
+        for pl in data['placements']:
+            parsed += 1
+            addhere = set(n for n, m in placement_names(pl))
+            for edge_num in dict.fromkeys(p[posn] for p in pl['p']):
+                yield edge_num, addhere
+    finally:
+        profiler.count('placements parsed', parsed)
+
+def edge_names(tree):
+    """
+    Find the node for each jplace edge number, and name it the way it is read back from the newick file
+    that we write, so the placements match the nodes of that tree. We do this once for the whole tree
+    rather than once for every placement. The placements on nodes without a name are left out, as there
+    is no way to tell those nodes apart.
+    :param tree: The tree (either with or without rewriting)
+    :return: a dict of edge number -> the name of the node at that edge in the newick file
+    """
+
+    if hasattr(tree, 'edge_nodes'):
+        edges = {e: newick_name(tree.names[i]).strip() for e, i in tree.edge_nodes.items()}
+        return {e: n for e, n in edges.items() if n}
+
+    # not an ArrayTree, so we have to find the edge numbers in the names
+    edges = {}
+    for t in tree.traverse("postorder"):
+        m = _edge_re.search(t.name)
+        if m and t.name[:m.start()].strip():
+            edges[int(m.groups()[0])] = newick_name(t.name).strip()
+    return edges
+
+def mapping_rows(data, names, mode='all', threshold=0.5, multiplicity=False):
+    """
+    The rows of the mapping file, without writing them
+    :param data: the parsed jplacer tree
+    :param names: a dict of edge number -> the name to use for the node at that edge (e.g. from edge_names)
+    :param mode: how to use the like_weight_ratio (one of placement_modes)
+    :param threshold: the like_weight_ratio threshold for threshold mode
+    :param multiplicity: multiply the weights by the multiplicity of each read
+    :return: a generator of [node name, read id], or [node name, read id, weight] unless we are using every placement
+    """
+
+    if mode == 'all' and not multiplicity:
+        for e, ids in get_placements(data):
+            if e in names:
+                for r in ids:
+                    yield [names[e], r]
+    else:
+        # this needs numpy, so it is only imported when we use the weights
+        from placement_matrix import read_placement_matrix
+        matrix = read_placement_matrix(data, mode, threshold, multiplicity)
+        read_names = matrix.read_names
+        for e, r, w in zip(matrix.edges.tolist(), matrix.reads.tolist(), matrix.weights.tolist()):
+            if e in names:
+                yield [names[e], read_names[r], w]
+
+def write_placement_tuples(pl, tree, tpoutfile, verbose=False, names=None):
     """
     Write a file with the tuples of new edge node (from metagenome) and existing node where it would be inserted
-    :param pl: The placements from get_placements
+    :param pl: The placements from get_placements (or a dict of edge numbers and sets of ids)
+    :param tree: The tree (either with or without rewriting)
+    :param tpoutfile: The file to write the tuples to
+    :param verbose: more information
+    :param names: the edge_names of the tree, if we already have them
+    :return:
+    """
+
+    if names is None:
+        names = edge_names(tree)
+    prefixes = {e: "{}\t".format(n) for e, n in names.items()}
+
+    if isinstance(pl, dict):
+        pl = pl.items()
+
+    written = 0
+    with open(tpoutfile, 'w') as out:
+        lines = []
+        for thisid, ids in pl:
+            prefix = prefixes.get(thisid)
+            if prefix is None:
+                continue
+            lines.extend(prefix + p + "\n" for p in ids)
+            if len(lines) > 100000:
+                out.writelines(lines)
+                written += len(lines)
+                lines = []
+        out.writelines(lines)
+        written += len(lines)
+
+    if verbose:
+        sys.stderr.write("Wrote {} placements to {}\n".format(written, tpoutfile))
+
+def write_placement_weights(matrix, tree, tpoutfile, verbose=False, names=None):
+    """
+    Write a file with the tuples of new edge node (from metagenome), existing node where it would be inserted,
+    and the weight of that placement
+    :param matrix: The PlacementMatrix from read_placement_matrix
     :param tree: The tree (either with or without rewriting)
     :param tpoutfile: The file to write the tuples to
     :param verbose: more information
+    :param names: the edge_names of the tree, if we already have them
     :return:
     """
 
+    if names is None:
+        names = edge_names(tree)
+    read_names = matrix.read_names
+
+    written = 0
     with open(tpoutfile, 'w') as out:
-        for t in tree.traverse("postorder"):
-            m = re.search('{(\d+)}', t.name)
-            if not m:
+        lines = []
+        for e, r, w in zip(matrix.edges.tolist(), matrix.reads.tolist(), matrix.weights.tolist()):
+            if e not in names:
                 continue
-            thisid = int(m.groups()[0])
+            lines.append("{}\t{}\t{:0.6g}\n".format(names[e], read_names[r], w))
+            if len(lines) > 100000:
+                out.writelines(lines)
+                written += len(lines)
+                lines = []
+        out.writelines(lines)
+        written += len(lines)
+
+    if verbose:
+        sys.stderr.write("Wrote {} weighted placements to {}\n".format(written, tpoutfile))
+
+def write_placements(data, tree, tpoutfile, mode='all', threshold=0.5, multiplicity=False, verbose=False, names=None):
+    """
+    Write the placements file, with the weights unless we are using every placement
+    :param data: the parsed jplacer tree
+    :param tree: The tree (either with or without rewriting)
+    :param tpoutfile: The file to write the placements to
+    :param mode: how to use the like_weight_ratio (one of placement_modes)
+    :param threshold: the like_weight_ratio threshold for threshold mode
+    :param multiplicity: multiply the weights by the multiplicity of each read
+    :param verbose: more information
+    :param names: the edge_names of the tree, if we already have them
+    :return:
+    """
 
-            if thisid in pl:
-                for p in pl[thisid]:
-                    out.write("{}\t{}\n".format(clean_newick_id(t.name), p))
+    if mode == 'all' and not multiplicity:
+        write_placement_tuples(get_placements(data), tree, tpoutfile, verbose, names)
+    else:
+        # this needs numpy, so it is only imported when we use the weights
+        from placement_matrix import read_placement_matrix
+        matrix = read_placement_matrix(data, mode, threshold, multiplicity)
+        write_placement_weights(matrix, tree, tpoutfile, verbose, names)
+
+# the edge names of the shared tree in each process of the pool
+_shared_names = None
+
+def _set_shared_names(names):
+    global _shared_names
+    _shared_names = names
+
+def _write_placements_worker(job):
+    jpf, tpoutfile, mode, threshold, multiplicity, verbose = job
+    write_placements(load_jplacer(jpf), None, tpoutfile, mode, threshold, multiplicity, verbose, _shared_names)
+    return tpoutfile
+
+def same_tree(jpfs, verbose=False):
+    """
+    Check that all the jplace files have the same reference tree
+    :param jpfs: the jplace files
+    :param verbose: more output
+    :return: the jplace data of the first file, or None if the trees are not the same
+    """
+
+    data = load_jplacer(jpfs[0])
+    for j in jpfs[1:]:
+        if read_jplace_tree(j) != data['tree']:
+            sys.stderr.write("ERROR: {} does not have the same tree as {}\n".format(j, jpfs[0]))
+            return None
+    if verbose:
+        sys.stderr.write("All {} jplace files have the same tree\n".format(len(jpfs)))
+    return data
+
+def write_batch_placements(jpfs, tree, tpoutfile, mode='all', threshold=0.5, multiplicity=False, threads=None,
+                           verbose=False):
+    """
+    Write the placements from several jplace files that share the same tree into one placements file. Each jplace
+    file is read by a separate process, and the files they write are joined in the same order as jpfs.
+    :param jpfs: the jplace files
+    :param tree: The tree (either with or without rewriting)
+    :param tpoutfile: The file to write the placements to
+    :param mode: how to use the like_weight_ratio (one of placement_modes)
+    :param threshold: the like_weight_ratio threshold for threshold mode
+    :param multiplicity: multiply the weights by the multiplicity of each read
+    :param threads: the number of processes to use. Default is one per cpu
+    :param verbose: more information
+    :return:
+    """
+
+    names = edge_names(tree)
+    if threads is None:
+        threads = os.cpu_count() or 1
+    threads = max(1, min(threads, len(jpfs)))
+
+    outdir = os.path.dirname(os.path.abspath(tpoutfile))
+    jobs = []
+    for j in jpfs:
+        fd, part = tempfile.mkstemp(dir=outdir, prefix=os.path.basename(tpoutfile) + ".", suffix=".part")
+        os.close(fd)
+        jobs.append((j, part, mode, threshold, multiplicity, verbose))
+
+    try:
+        if threads > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=threads, initializer=_set_shared_names, initargs=(names,)) as executor:
+                parts = list(executor.map(_write_placements_worker, jobs))
+        else:
+            _set_shared_names(names)
+            parts = [_write_placements_worker(j) for j in jobs]
+        with open(tpoutfile, 'w') as out:
+            for part in parts:
+                with open(part, 'r') as f:
+                    shutil.copyfileobj(f, out)
+    finally:
+        _set_shared_names(None)
+        for j in jobs:
+            if os.path.exists(j[1]):
+                os.remove(j[1])
+
+    if verbose:
+        sys.stderr.write("Joined the placements from {} jplace files into {}\n".format(len(jpfs), tpoutfile))
 
 def write_tree(tree, outputf):
     """
@@ -248,21 +470,51 @@ def write_tree(tree, outputf):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Parse a jplacer file and rewrite the leaves with the taxonomy')
-    parser.add_argument('-j', help='jplacer file', required=True)
+    parser.add_argument('-j', help='jplacer file. You can use more than one -j if they all have the same tree, and the ' +
+                                   'placements from all of them are written to the mapping file', required=True, action='append')
     parser.add_argument('-o', help='output file to write the tree to', required=True)
     parser.add_argument('-m', help='write a mapping file from the mapped nodes to nodes on the tree.' +
                                    ' Essentially converts the jplacer placements into tsv for later processing')
+    parser.add_argument('-w', help='how to use the like_weight_ratio of the placements: all (every candidate edge, the default), ' +
+                                   'best (only the best edge), weighted (every edge, weighted by like_weight_ratio), ' +
+                                   'or threshold (the edges with a like_weight_ratio of at least -t). ' +
+                                   'Except for all, the weights are written in a third column of the mapping file',
+                        choices=placement_modes, default='all')
+    parser.add_argument('-t', help='like_weight_ratio threshold for -w threshold (default 0.5)', type=float, default=0.5)
+    parser.add_argument('-n', help='multiply the weights by the multiplicity of each read (from nm)', action='store_true')
+    parser.add_argument('-p', help='number of processes to read the placements with when there is more than one -j. ' +
+                                   'Default is one per cpu', type=int)
+    parser.add_argument('-b', help='write the mapping as a directory of NumPy arrays rather than a tsv file ' +
+                                   '(see columnar.py). This is much smaller and quicker to read', action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile(args)
 
-    data = load_jplacer(args.j)
-    tree = parse_jplacer_tree(data)
-    tree = rename_nodes_ncbi(tree, args.v)
-    tree = reroot_tree(tree, args.v)
-    write_tree(tree, args.o)
+    with profiler.stage('load_jplacer'):
+        data = same_tree(args.j, args.v)
+        if data is None:
+            sys.exit(-1)
+        tree = parse_jplacer_tree(data)
+    with profiler.stage('rename_nodes_ncbi'):
+        tree = rename_nodes_ncbi(tree, args.v)
+    with profiler.stage('reroot_tree'):
+        tree = reroot_tree(tree, args.v)
+    with profiler.stage('write_tree'):
+        write_tree(tree, args.o)
 
     if args.m:
-        pl = get_placements(data)
-        write_placement_tuples(pl, tree, args.m, args.v)
-
-
+        with profiler.stage('write_placements'):
+            if args.b:
+                from columnar import write_placement_columns
+                names = edge_names(tree)
+                rows = itertools.chain.from_iterable(
+                    mapping_rows(load_jplacer(j) if j != args.j[0] else data, names, args.w, args.t, args.n)
+                    for j in args.j)
+                write_placement_columns(args.m, rows, args.v)
+            elif len(args.j) == 1:
+                write_placements(data, tree, args.m, args.w, args.t, args.n, args.v)
+            else:
+                write_batch_placements(args.j, tree, args.m, args.w, args.t, args.n, args.p, args.v)
+
+    write_profile(args)
@@ -0,0 +1,188 @@
+"""
+A cache of the results of each step of the pipeline, so that we don't repeat the slow steps when only a later
+parameter (e.g. the colors or the taxonomic level) has changed.
+
+Each result is stored under a key that is a hash of the name of the step, the files it reads (their path, size,
+and modification time), and its parameters. The keys of the earlier steps are passed on as parameters of the later
+ones, so changing an input or a parameter only repeats the steps that depend on it. The results are pickled (which
+keeps NumPy arrays as raw binary) into one file per key, and the least recently used files are removed when the
+cache gets bigger than its maximum size.
+"""
+
+import os
+import sys
+import json
+import pickle
+import hashlib
+import tempfile
+
+# change this whenever the results of a step change, so we don't use the old ones
+cache_version = 2
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "pbj_placer", "stages")
+# the default maximum size of the cache, in bytes
+default_max_size = 2 << 30
+
+_missing = object()
+
+
+def fingerprint(path):
+    """
+    Identify a file by its path, size, and modification time, which is much faster than hashing its contents
+    :param path: the file
+    :return: a list of the absolute path, size, and modification time (size and time are None if there is no file)
+    """
+
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return [str(path), None, None]
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+class StageCache:
+    """
+    A directory of pickled results, keyed by a hash of how they were made.
+    """
+
+    def __init__(self, cachedir=None, maxsize=None, verbose=False):
+        """
+        Open the cache
+        :param cachedir: the cache directory. Defaults to $PBJ_PLACER_STAGE_CACHE or ~/.cache/pbj_placer/stages.
+            An empty string turns the cache off, and then every step is always run
+        :param maxsize: the largest the cache can be, in bytes. Default is 2 GB
+        :param verbose: more output
+        """
+
+        if cachedir is None:
+            cachedir = os.environ.get('PBJ_PLACER_STAGE_CACHE', default_cache_dir)
+        self.cachedir = cachedir or None
+        self.maxsize = default_max_size if maxsize is None else maxsize
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+
+        if self.cachedir:
+            try:
+                os.makedirs(self.cachedir, exist_ok=True)
+            except OSError as e:
+                sys.stderr.write("WARNING: Not using the stage cache {}: {}\n".format(self.cachedir, e))
+                self.cachedir = None
+        # in case the maximum size is smaller than last time
+        self.evict()
+
+    def key(self, stage, inputs=(), params=None):
+        """
+        Make the key for a step
+        :param stage: the name of the step
+        :param inputs: the files the step reads
+        :param params: the parameters of the step, and the keys of the steps it depends on. This must be something we
+            can write as JSON
+        :return: the key (a hex string)
+        """
+
+        desc = {
+            'version': cache_version,
+            'stage': stage,
+            'inputs': [fingerprint(f) for f in inputs],
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(desc, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key + ".pickle")
+
+    def get(self, key, default=None):
+        """
+        Get a result from the cache
+        :param key: the key from key()
+        :param default: what to return if the result is not in the cache
+        :return: the result
+        """
+
+        if not self.cachedir:
+            return default
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return default
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            sys.stderr.write("WARNING: Ignoring the broken cache file {}: {}\n".format(path, e))
+            return default
+        # mark it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """
+        Add a result to the cache, and then make sure the cache is not too big
+        :param key: the key from key()
+        :param value: the result
+        """
+
+        if not self.cachedir:
+            return
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cachedir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except (OSError, pickle.PicklingError) as e:
+            sys.stderr.write("WARNING: Could not add {} to the stage cache: {}\n".format(key, e))
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+
+    def cached(self, key, compute):
+        """
+        Get a result from the cache, or make it and add it to the cache
+        :param key: the key from key()
+        :param compute: a function that makes the result
+        :return: the result
+        """
+
+        value = self.get(key, _missing)
+        if value is not _missing:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache is no bigger than maxsize
+        """
+
+        if not self.cachedir:
+            return
+        entries = []
+        total = 0
+        for e in os.scandir(self.cachedir):
+            if not e.name.endswith(".pickle"):
+                continue
+            st = e.stat()
+            entries.append((st.st_mtime_ns, st.st_size, e.path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                if self.verbose:
+                    sys.stderr.write("Removed {} from the stage cache\n".format(path))
+            except OSError:
+                pass
+
+    def report(self):
+        sys.stderr.write("Stage cache: {} hits, {} misses\n".format(self.hits, self.misses))
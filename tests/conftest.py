@@ -0,0 +1,100 @@
+"""
+Shared fixtures for the tests.
+
+The scripts import taxon (from https://github.com/linsalrob/EdwardsLab/tree/master/taxon) when they are loaded. If it
+is not installed we put a stand in for it in sys.modules that fails if it is used, and the tests that need a taxonomy
+use a small one of their own through benchmarks.taxonomy.synthetic_taxonomy.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import types
+import sqlite3
+
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repo not in sys.path:
+    sys.path.insert(0, repo)
+
+try:
+    import taxon
+except ImportError:
+    def _no_taxonomy(*args, **kwargs):
+        raise RuntimeError("The taxonomy database is not installed. Use benchmarks.taxonomy.synthetic_taxonomy")
+    taxon = types.ModuleType('taxon')
+    taxon.get_taxonomy_db = taxon.get_taxonomy = _no_taxonomy
+    sys.modules['taxon'] = taxon
+
+from benchmarks.taxonomy import synthetic_taxonomy
+
+
+def write_taxonomy(dbfile, nodes):
+    """
+    Write a taxonomy database with the same nodes and names tables as the NCBI taxonomy SQLite database. The root (1)
+    and cellular organisms (131567) are added for you.
+    :param dbfile: the database file to write
+    :param nodes: a list of (taxid, parent, rank, name)
+    :return: the database file
+    """
+
+    con = sqlite3.connect(dbfile)
+    con.execute("CREATE TABLE nodes (tax_id INTEGER PRIMARY KEY, parent INTEGER, rank TEXT)")
+    con.execute("CREATE TABLE names (tax_id INTEGER, name TEXT, unique_name TEXT, name_class TEXT)")
+    nodes = [(1, 1, 'no rank', 'root'), (131567, 1, 'no rank', 'cellular organisms')] + list(nodes)
+    con.executemany("INSERT INTO nodes VALUES (?, ?, ?)", [(t, p, r) for t, p, r, n in nodes])
+    con.executemany("INSERT INTO names VALUES (?, ?, '', 'scientific name')", [(t, n) for t, p, r, n in nodes])
+    con.commit()
+    con.close()
+    return dbfile
+
+
+# a small taxonomy with all three superkingdoms. Some of the species skip a rank, so the nodes above them
+# have to be named for a rank further up
+fixture_taxonomy = [
+    (2, 131567, 'superkingdom', 'Bacteria'),
+    (1224, 2, 'phylum', 'Proteobacteria'),
+    (1236, 1224, 'class', 'Gammaproteobacteria'),
+    (561, 1236, 'genus', 'Escherichia'),
+    (562, 561, 'species', 'Escherichia coli'),
+    (564, 561, 'species', 'Escherichia fergusonii'),
+    (590, 1236, 'genus', 'Salmonella'),
+    (28901, 590, 'species', 'Salmonella enterica'),
+    (1239, 2, 'phylum', 'Firmicutes'),
+    (1386, 1239, 'genus', 'Bacillus'),
+    (1423, 1386, 'species', 'Bacillus subtilis'),
+    (1396, 1386, 'species', 'Bacillus cereus'),
+    (201174, 2, 'phylum', 'Actinobacteria'),
+    (1773, 201174, 'species', 'Mycobacterium tuberculosis'),
+    (976, 2, 'phylum', 'Bacteroidetes'),
+    (817, 976, 'species', 'Bacteroides fragilis'),
+    (2157, 131567, 'superkingdom', 'Archaea'),
+    (28890, 2157, 'phylum', 'Euryarchaeota'),
+    (2190, 28890, 'species', 'Methanocaldococcus jannaschii'),
+    (2287, 28890, 'species', 'Saccharolobus solfataricus'),
+    (28889, 2157, 'phylum', 'Crenarchaeota'),
+    (2285, 28889, 'species', 'Sulfolobus acidocaldarius'),
+    (2759, 131567, 'superkingdom', 'Eukaryota'),
+    (7711, 2759, 'phylum', 'Chordata'),
+    (7777, 7711, 'class', 'Chondrichthyes'),
+    (7778, 7777, 'genus', 'Carcharodon'),
+    (7779, 7778, 'species', 'Carcharodon carcharias'),
+    (7780, 7778, 'species', 'Carcharodon hubbelli'),
+    (9606, 7711, 'species', 'Homo sapiens'),
+    (4751, 2759, 'phylum', 'Fungi'),
+    (4932, 4751, 'species', 'Saccharomyces cerevisiae'),
+]
+
+
+@pytest.fixture
+def taxonomy(tmp_path):
+    """
+    Use the fixture taxonomy for the taxonomy lookups in the scripts
+    :return: the taxonomy database file
+    """
+
+    dbfile = write_taxonomy(str(tmp_path / "taxonomy.sqlite"), fixture_taxonomy)
+    with synthetic_taxonomy(dbfile):
+        yield dbfile
@@ -0,0 +1,108 @@
+"""
+Check that ArrayTree reads, writes, and reroots trees the same way as ete3 does.
+"""
+
+import random
+import pytest
+from ete3 import Tree
+from ete3.parser.newick import NewickError
+
+from arraytree import parse_newick, NewickParseError
+from benchmarks.generate import make_taxonomy, make_tree
+from test_rename_tree_leaves import old_parse_jplacer_tree
+
+newicks = {
+    'names and lengths': "((A:0.1,B:0.2)AB:0.3,(C:0.4,D:0.5)CD:0.6);",
+    'quoted names': "(('Leaf one [123]':0.1,'B, with comma':0.2):0.3,\"C d\":0.4);",
+    'quoted names and edges': "(('Leaf one [123]':0.1{0},'B, with: comma':0.2{1}):0.3{2},C:0.4{3}){4};",
+    'edges after lengths': "((A:0.1{0},B:0.2{1}):0.3{2},C:0.4{3}){4};",
+    'edges before lengths': "((A{0}:0.1,B{1}:0.2){2}:0.3,C{3}:0.4){4};",
+    'no lengths': "((A,B),C);",
+    'no internal names': "((A,B),(C,D));",
+    'some internal names': "((A,B)AB,(C,D));",
+    'names with spaces': "((Leaf x [12]:0.1,Leaf y [13]:0.2)Bacteria r_superkingdom b_1:0.3,Z:0.4);",
+    'exponents': "((A:1e-05,B:2.5E3):0,C:123456789);",
+    'multifurcation and named root': "(A:0.1,B:0.2,(C:0.3,D:0.4):0.5)root:0.0;",
+}
+
+
+def synthetic_newick(tmp_path, seed):
+    species, parents = make_taxonomy(str(tmp_path / "taxonomy.sqlite"), 50, seed)
+    return make_tree(species, parents, seed, shuffle=0.1)[0]
+
+
+def nodes(tree):
+    return [(n.name, n.dist) for n in tree.traverse("preorder")]
+
+
+@pytest.mark.parametrize('name', list(newicks))
+def test_parse_and_write(name):
+    newick = newicks[name]
+    ete = old_parse_jplacer_tree(newick)
+    tree = parse_newick(newick)
+    assert nodes(tree) == nodes(ete)
+    assert tree.write(format=1) == ete.write(format=1)
+    # and what we write reads back the same
+    again = parse_newick(tree.write(format=1))
+    assert again.write(format=1) == tree.write(format=1)
+    assert nodes(Tree(tree.write(format=1), format=1)) == nodes(again)
+
+
+def test_synthetic_trees(tmp_path):
+    for seed in range(1, 4):
+        newick = synthetic_newick(tmp_path, seed)
+        ete = old_parse_jplacer_tree(newick)
+        tree = parse_newick(newick)
+        assert nodes(tree) == nodes(ete)
+        assert tree.write(format=1) == ete.write(format=1)
+
+
+@pytest.mark.parametrize('newick', [newicks['edges after lengths'], newicks['edges before lengths'],
+                                    newicks['quoted names and edges']])
+def test_edge_numbers(newick):
+    tree = parse_newick(newick)
+    # the edges are numbered in postorder
+    assert [n.edge_num for n in tree.traverse("postorder")] == [0, 1, 2, 3, 4]
+    assert {e: tree.names[i] for e, i in tree.edge_nodes.items()}[3] in ("C", "C{3}")
+
+
+def test_missing_leaf_names():
+    # ete3 won't read these, so we just check that we can read what we write
+    for newick in ["((,B),C);", "((:0.1,B:0.2):0.3,C:0.4);"]:
+        with pytest.raises(NewickError):
+            Tree(newick, format=1)
+        tree = parse_newick(newick)
+        assert [n.name for n in tree.traverse("preorder")] == ["", "", "", "B", "C"]
+        assert parse_newick(tree.write(format=1)).write(format=1) == tree.write(format=1)
+    assert parse_newick("((:0.1,B:0.2):0.3,C:0.4);").write(format=1) == "((:0.1,B:0.2):0.3,C:0.4);"
+
+
+@pytest.mark.parametrize('newick', ["((A,B),C", "((A,B)),C);", "((A:x,B),C);"])
+def test_bad_newick(newick):
+    with pytest.raises(NewickParseError):
+        parse_newick(newick)
+
+
+@pytest.mark.parametrize('name', list(newicks))
+def test_set_outgroup(name):
+    newick = newicks[name]
+    count = len(list(parse_newick(newick).traverse()))
+    for k in range(1, count):
+        ete = old_parse_jplacer_tree(newick)
+        tree = parse_newick(newick)
+        ete.set_outgroup(list(ete.traverse("preorder"))[k])
+        tree.set_outgroup(list(tree.traverse("preorder"))[k])
+        assert tree.write(format=1) == ete.write(format=1)
+
+
+def test_set_outgroup_synthetic(tmp_path):
+    newick = synthetic_newick(tmp_path, 1)
+    rand = random.Random(1)
+    ete = old_parse_jplacer_tree(newick)
+    tree = parse_newick(newick)
+    # reroot the same trees several times in a row
+    for i in range(20):
+        k = rand.randrange(1, len(tree))
+        ete.set_outgroup(list(ete.traverse("preorder"))[k])
+        tree.set_outgroup(list(tree.traverse("preorder"))[k])
+        assert tree.write(format=1) == ete.write(format=1)
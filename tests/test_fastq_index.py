@@ -0,0 +1,89 @@
+"""
+Check that the fastq index finds the same files for the reads as reading the fastq files does, including when the
+same read ids are in more than one file and when we only ask for some of the files in the index.
+"""
+
+import os
+import pytest
+
+import fastq2ids
+from fastq_index import FastqIndex
+
+
+def write_fastq(path, ids):
+    with open(path, 'w') as out:
+        for i in ids:
+            out.write("@{}\nACGT\n+\nIIII\n".format(i))
+    return str(path)
+
+
+@pytest.fixture
+def paired(tmp_path):
+    """
+    R1 and R2 files that share their read ids, and another file with some of the same ids and some of its own
+    """
+
+    ids = ["read{}".format(i) for i in range(1000)]
+    r1 = write_fastq(tmp_path / "sample_R1.fastq", ids)
+    r2 = write_fastq(tmp_path / "sample_R2.fastq", ids)
+    other = write_fastq(tmp_path / "other.fastq", ids[:100] + ["other{}".format(i) for i in range(100)])
+    return ids, r1, r2, other
+
+
+def lookup(fqids, ids):
+    return {i: fqids.get(i) for i in ids}
+
+
+def test_shared_ids(tmp_path, paired):
+    ids, r1, r2, other = paired
+    indexfile = str(tmp_path / "fastq.idx")
+    everything = ids + ["other{}".format(i) for i in range(100)]
+
+    for fnames in ([r1, r2, other], [r2, r1, other], [other, r1, r2]):
+        expected = lookup(fastq2ids.fq_ids(fnames, threads=1), everything)
+        assert lookup(fastq2ids.fq_ids(fnames, threads=1, indexfile=indexfile), everything) == expected
+    # a read belongs to the first file it is in
+    assert expected["read1"] == "other.fastq"
+    assert expected["read500"] == "sample_R1.fastq"
+
+
+def test_subset_of_the_index(tmp_path, paired):
+    ids, r1, r2, other = paired
+    indexfile = str(tmp_path / "fastq.idx")
+    fastq2ids.fq_ids([r1, r2, other], threads=1, indexfile=indexfile)
+
+    for fnames in ([r1], [r2], [other], [r2, other]):
+        expected = lookup(fastq2ids.fq_ids(fnames, threads=1), ids)
+        found = fastq2ids.fq_ids(fnames, threads=1, indexfile=indexfile)
+        assert lookup(found, ids) == expected
+        assert sum(1 for i in ids if i in found) == sum(1 for v in expected.values() if v)
+    # the reads are all still in R1 after R2 was indexed
+    found = fastq2ids.fq_ids([r1], threads=1, indexfile=indexfile)
+    assert all(found.get(i) == "sample_R1.fastq" for i in ids)
+
+
+def test_changed_file(tmp_path, paired):
+    ids, r1, r2, other = paired
+    indexfile = str(tmp_path / "fastq.idx")
+    fastq2ids.fq_ids([r1, r2], threads=1, indexfile=indexfile)
+
+    # R1 loses half its reads, so they are only in R2 now
+    write_fastq(r1, ids[:500])
+    os.utime(r1, ns=(0, 0))
+    found = fastq2ids.fq_ids([r1, r2], threads=1, indexfile=indexfile)
+    assert found["read1"] == "sample_R1.fastq"
+    assert found["read999"] == "sample_R2.fastq"
+    found = fastq2ids.fq_ids([r1], threads=1, indexfile=indexfile)
+    assert "read999" not in found
+
+
+def test_old_index(tmp_path, paired):
+    ids, r1, r2, other = paired
+    indexfile = str(tmp_path / "fastq.idx")
+    # an index from before a read could be in more than one file is thrown away and made again
+    index = FastqIndex(indexfile)
+    index.conn.execute("PRAGMA user_version = 1")
+    index.conn.commit()
+    index.close()
+    found = fastq2ids.fq_ids([r1, r2], threads=1, indexfile=indexfile)
+    assert found["read1"] == "sample_R1.fastq"
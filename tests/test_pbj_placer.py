@@ -0,0 +1,78 @@
+"""
+Check that pbj_placer.py run makes the same multibars as running create_multibar.py on the intermediate files that
+it writes with -k.
+"""
+
+import os
+import filecmp
+import pytest
+
+import taxon
+import pbj_placer
+import fastq2ids
+import create_multibar
+from arraytree import read_tree
+from benchmarks.generate import make_dataset
+from benchmarks.taxonomy import connect, synthetic_taxonomy
+
+cols = [4, 5]
+ranks = ['r_order', 'r_family', 'r_genus']
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    return make_dataset(str(tmp_path_factory.mktemp("dataset")), 100, 1000, 3)
+
+
+@pytest.fixture
+def run_output(tmp_path, dataset, monkeypatch):
+    monkeypatch.setattr(taxon, 'get_taxonomy_db', lambda: connect(dataset['taxonomy']))
+    outputdir = str(tmp_path / "run")
+    with synthetic_taxonomy(dataset['taxonomy']):
+        pbj_placer.run(dataset['jplace'], dataset['fastq_files'], dataset['classification'], outputdir, cols, ranks,
+                       threads=1, intermediates=True, cachedir="")
+    return outputdir
+
+
+def test_placement_names(run_output):
+    names = set(read_tree(os.path.join(run_output, "tree.nwk")).names)
+    with open(os.path.join(run_output, "placements.tsv")) as f:
+        placed = {l.split("\t")[0] for l in f}
+    assert placed and placed <= names
+    # the leaves have taxids in [], which are not allowed in the newick file
+    assert any("_" in n and " " in n for n in placed)
+
+
+def test_create_multibar(tmp_path, run_output):
+    labels = create_multibar.read_label_columns(os.path.join(run_output, "leaves.labels"), cols)
+    mapping = create_multibar.read_mapping(os.path.join(run_output, "placements.tsv"))
+    matrices = create_multibar.label_matrices(mapping, labels)
+    mbcounts = create_multibar.multibar_batch(os.path.join(run_output, "tree.nwk"), matrices, ranks, False)
+
+    for (col, taxa), counts in mbcounts.items():
+        assert counts.values.sum() > 0
+        name = "col{}.{}".format(col, taxa.replace('r_', '', 1))
+        create_multibar.write_directory(counts, str(tmp_path / name), pbj_placer.default_colors, False)
+        create_multibar.write_tsv(counts, taxa, str(tmp_path / (name + ".tsv")))
+        assert filecmp.cmp(str(tmp_path / (name + ".tsv")), os.path.join(run_output, name + ".tsv"), shallow=False)
+        files = sorted(os.listdir(str(tmp_path / name)))
+        assert files == sorted(os.listdir(os.path.join(run_output, name)))
+        match, mismatch, errors = filecmp.cmpfiles(str(tmp_path / name), os.path.join(run_output, name), files,
+                                                   shallow=False)
+        assert not mismatch and not errors
+
+
+def test_labels_made_once(tmp_path, dataset, monkeypatch):
+    calls = []
+    classify_leaves = fastq2ids.classify_leaves
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return classify_leaves(*args, **kwargs)
+
+    monkeypatch.setattr(taxon, 'get_taxonomy_db', lambda: connect(dataset['taxonomy']))
+    monkeypatch.setattr(fastq2ids, 'classify_leaves', counted)
+    with synthetic_taxonomy(dataset['taxonomy']):
+        pbj_placer.run(dataset['jplace'], dataset['fastq_files'], dataset['classification'], str(tmp_path / "run"),
+                       cols, ranks, threads=1, intermediates=True, cachedir="")
+    assert len(calls) == 1
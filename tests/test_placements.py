@@ -0,0 +1,66 @@
+"""
+Check that the placements file that rename_tree_leaves.py writes can be read by the next steps, including when the
+reads are placed on nodes that do not have names.
+"""
+
+import pytest
+
+import fastq2ids
+import rename_tree_leaves
+from arraytree import newick_name
+from benchmarks.generate import make_dataset
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    return make_dataset(str(tmp_path_factory.mktemp("dataset")), 50, 500, 2)
+
+
+def placed_reads(data, tree):
+    """
+    The reads that are placed on a node with a name
+    """
+
+    names = {e: i for e, i in tree.edge_nodes.items() if tree.names[i]}
+    reads = set()
+    for e, ids in rename_tree_leaves.get_placements(data):
+        if e in names:
+            reads.update(ids)
+    return reads
+
+
+@pytest.mark.parametrize('mode', ['all', 'weighted'])
+def test_unnamed_nodes(tmp_path, dataset, mode):
+    data = rename_tree_leaves.load_jplacer(dataset['jplace'])
+    # the tree is not renamed, so only the leaves have names
+    tree = rename_tree_leaves.parse_jplacer_tree(data)
+    assert any(not tree.names[i] for i in tree.edge_nodes.values())
+    placements = str(tmp_path / "placements.tsv")
+    rename_tree_leaves.write_placements(data, tree, placements, mode)
+
+    with open(placements) as f:
+        rows = [l.rstrip("\n").split("\t") for l in f]
+    assert rows and all(r[0] for r in rows)
+    leaves = {newick_name(n) for n in tree.get_leaf_names()}
+    assert all(r[0] in leaves for r in rows)
+    assert fastq2ids.read_leaves(placements, True) == placed_reads(data, tree)
+
+
+def test_read_leaves(tmp_path):
+    placements = tmp_path / "placements.tsv"
+    placements.write_text("Leaf_1 [12]\tread1\n\tread2\nLeaf_2 [13]\tread3\t0.5\n\n")
+    assert fastq2ids.read_leaves(str(placements), True) == {"read1", "read2", "read3"}
+
+
+def test_same_tree(tmp_path, dataset):
+    # a copy of the jplace file that stops part way through the placements, so it can only be read up to the tree
+    with open(dataset['jplace']) as f:
+        text = f.read()
+    truncated = tmp_path / "truncated.jplace"
+    truncated.write_text(text[:text.index('"placements"') + 1000])
+    different = tmp_path / "different.jplace"
+    different.write_text(text.replace("Leaf_0 ", "Leaf_zero ", 1))
+
+    data = rename_tree_leaves.same_tree([dataset['jplace'], str(truncated), dataset['jplace']])
+    assert data['tree'] == rename_tree_leaves.load_jplacer(dataset['jplace'])['tree']
+    assert rename_tree_leaves.same_tree([dataset['jplace'], str(truncated), str(different)]) is None
@@ -0,0 +1,215 @@
+"""
+Check that rename_tree_leaves.py names the nodes the same way as the original version, which looked at every leaf
+below every node with ete3, and asked the taxonomy database about every leaf.
+"""
+
+import re
+import pytest
+from ete3 import Tree
+from ete3.parser.newick import NewickError
+
+import rename_tree_leaves
+from arraytree import parse_newick
+from benchmarks.generate import make_taxonomy, make_tree
+from benchmarks.taxonomy import connect, get_taxonomy, synthetic_taxonomy
+
+
+def old_parse_jplacer_tree(newick):
+    try:
+        tree = Tree(newick, quoted_node_names=True, format=1)
+    except NewickError:
+        tt = re.sub(r'(\:[\d\.]+){\d+}', r'\1', newick)
+        tt = re.sub(r'{\d+};$', ';', tt)
+        tree = Tree(tt, quoted_node_names=True, format=1)
+    return tree
+
+
+def old_rename_nodes_ncbi(tree, c):
+    """
+    rename_nodes_ncbi as it was before the summaries were merged up the tree
+    """
+
+    wanted_levels = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'subspecies']
+    wanted_levels.reverse()
+    taxonomy = {}
+    for l in tree.get_leaves():
+        m = re.search(r'\[(\d+)\]', l.name)
+        if not m:
+            continue
+        tid = m.groups()[0]
+        taxonomy[l.name] = {}
+        t, n = get_taxonomy(tid, c)
+        if not t:
+            continue
+        while t.parent != 1 and t.taxid != 1:
+            if t.rank in wanted_levels:
+                taxonomy[l.name][t.rank] = n.scientific_name
+            t, n = get_taxonomy(t.parent, c)
+
+    branchnum = 0
+    for n in tree.traverse("postorder"):
+        if n.is_leaf():
+            continue
+        children = n.get_children()
+        names = set([re.sub(r'\s+b_\d+', '', x.name) for x in children])
+        if len(names) == 1:
+            n.name = "{} b_{}".format(names.pop(), branchnum)
+            for c in children:
+                c.name = re.sub(r'r_\w+\s+', '', c.name)
+        else:
+            taxs = {w: set() for w in wanted_levels}
+            for l in n.get_leaves():
+                if l.name not in taxonomy:
+                    continue
+                for w in wanted_levels:
+                    if w in taxonomy[l.name]:
+                        taxs[w].add(taxonomy[l.name][w])
+            for w in wanted_levels:
+                if len(taxs[w]) == 1:
+                    n.name = "{} r_{} b_{}".format(taxs[w].pop(), w, branchnum)
+                    break
+        branchnum += 1
+    return tree
+
+
+def old_reroot_tree(tree):
+    """
+    reroot_tree as it was before it used the superkingdoms from rename_nodes_ncbi
+    """
+
+    for n in tree.traverse("preorder"):
+        childs = n.get_children()
+        if len(childs) == 2:
+            if ("Archaea r_superkingdom" in childs[0].name and "Eukaryota r_superkingdom" in childs[1].name) or (
+                    "Archaea r_superkingdom" in childs[1].name and "Eukaryota r_superkingdom" in childs[0].name):
+                tree.set_outgroup(n)
+                return tree
+            if "Bacteria r_superkingdom" in childs[0].name and "Archaea r_superkingdom" in childs[1].name:
+                tree.set_outgroup(childs[0])
+                return tree
+            if "Bacteria r_superkingdom" in childs[1].name and "Archaea r_superkingdom" in childs[0].name:
+                tree.set_outgroup(childs[1])
+                return tree
+
+    for n in tree.traverse("preorder"):
+        if "Bacteria r_superkingdom" in n.name:
+            tree.set_outgroup(n)
+            break
+    return tree
+
+
+def preorder_names(tree):
+    return [n.name for n in tree.traverse("preorder")]
+
+
+def check_names(newick, dbfile):
+    old = old_rename_nodes_ncbi(old_parse_jplacer_tree(newick), connect(dbfile))
+    new = rename_tree_leaves.rename_nodes_ncbi(parse_newick(newick))
+    assert preorder_names(new) == preorder_names(old)
+    return new
+
+
+def check_root(newick, dbfile):
+    old = old_reroot_tree(old_rename_nodes_ncbi(old_parse_jplacer_tree(newick), connect(dbfile)))
+    new = rename_tree_leaves.reroot_tree(rename_tree_leaves.rename_nodes_ncbi(parse_newick(newick)))
+    assert new.write(format=1) == old.write(format=1)
+    return new
+
+
+# the leaves have to be named for their taxids (in []) or have no taxid at all
+fixture_trees = {
+    # siblings that disagree at every rank, a multifurcation, a leaf without a taxid, a taxid that is not in the
+    # taxonomy, and a clade with Bacteria and Eukaryota in it
+    'conflicts': "((((Ecoli [562]:0.1,Efer [564]:0.1):0.1,Sent [28901]:0.2):0.1,(Bsub [1423]:0.1,Bcer [1396]:0.1):0.1)"
+                 ":0.1,((Mjan [2190]:0.1,Ssol [2287]:0.1):0.1,((Ccar [7779]:0.1,Chub [7780]:0.1):0.1,"
+                 "(Scer [4932]:0.1,unknown leaf:0.1,(missing [999999]:0.1,Ecoli2 [562]:0.1):0.1):0.1):0.1):0.1);",
+    # two clades with the same name, so their parent takes the name and they lose their rank, and two leaves with
+    # the same name
+    'inherited': "(((Ecoli [562]:0.1,Efer [564]:0.1):0.1,(Ecoli [562]:0.1,Efer [564]:0.1):0.1):0.1,"
+                 "((Bsub [1423]:0.1,Bsub [1423]:0.1):0.1,(Ccar [7779]:0.1,Chub [7780]:0.1):0.1):0.1,"
+                 "(((Ccar [7779]:0.1,Chub [7780]:0.1):0.1,(Ccar [7779]:0.1,Chub [7780]:0.1):0.1):0.1,"
+                 "Mjan [2190]:0.1):0.1);",
+    # nothing below the root has a taxid
+    'no taxids': "((a:0.1,b:0.1):0.1,(c:0.1,d:0.1):0.1);",
+}
+
+
+# trees for each of the ways reroot_tree finds the root
+root_trees = {
+    # Archaea and Eukaryota are siblings, so we reroot at their parent
+    'archaea and eukaryota': "((Mtub [1773]:0.1,Bfra [817]:0.2):0.3,((Mjan [2190]:0.1,Sacid [2285]:0.2):0.1,"
+                             "(Hsap [9606]:0.1,Scer [4932]:0.2):0.2):0.1);",
+    # Bacteria and Archaea are siblings, so we reroot at the Bacteria
+    'bacteria and archaea': "(((Mtub [1773]:0.1,Bfra [817]:0.2):0.3,(Mjan [2190]:0.1,Sacid [2285]:0.2):0.1):0.1,"
+                            "(Hsap [9606]:0.1,Scer [4932]:0.2):0.2);",
+    # there are no siblings to reroot between, so we reroot at the first Bacteria
+    'first bacteria': "((Hsap [9606]:0.1,Scer [4932]:0.2):0.2,(Mjan [2190]:0.1,Efer [564]:0.4):0.1,"
+                      "((Mtub [1773]:0.1,Bfra [817]:0.2):0.3,(Bcer [1396]:0.1,Sent [28901]:0.2):0.1):0.2);",
+    # the Bacteria clades below the Bacteria node lose their rank to it, so it is the one we reroot at
+    'inherited bacteria': "((((Mtub [1773]:0.1,Bfra [817]:0.2):0.1,(Mtub [1773]:0.1,Bfra [817]:0.2):0.1):0.3,"
+                          "(Mjan [2190]:0.1,Sacid [2285]:0.2):0.1):0.1,Scer [4932]:0.2);",
+}
+
+
+@pytest.mark.parametrize('name', list(fixture_trees))
+def test_fixture_trees(taxonomy, name):
+    check_names(fixture_trees[name], taxonomy)
+    check_root(fixture_trees[name], taxonomy)
+
+
+@pytest.mark.parametrize('name', list(root_trees))
+def test_reroot(taxonomy, name):
+    tree = check_root(root_trees[name], taxonomy)
+    # the tree was rerooted
+    assert tree.write(format=1) != rename_tree_leaves.rename_nodes_ncbi(parse_newick(root_trees[name])).write(format=1)
+
+
+def test_reroot_needs_rename():
+    with pytest.raises(ValueError):
+        rename_tree_leaves.reroot_tree(parse_newick(root_trees['first bacteria']))
+
+
+def test_names(taxonomy):
+    tree = check_names(fixture_trees['conflicts'], taxonomy)
+    names = preorder_names(tree)
+    assert "Escherichia r_genus b_0" in names
+    assert "Gammaproteobacteria r_class b_1" in names
+    # Bacillus doesn't have a class, so all the Bacteria are named for the one class that is below them
+    assert "Gammaproteobacteria r_class b_3" in names
+    assert "Euryarchaeota r_phylum b_4" in names
+    # the leaf that is not in the taxonomy is ignored, and so is the leaf without a taxid
+    assert "Escherichia coli r_species b_6" in names
+    assert "Escherichia r_genus b_7" in names
+    # the clades with more than one superkingdom are not named
+    assert names[0] == "" and names.count("") == 3
+
+
+def test_deep_unbalanced_tree(taxonomy):
+    # a caterpillar tree with a new leaf at every level, so the nodes go from agreeing at species to conflicting
+    # at superkingdom as we go up
+    taxids = [562, 564, 28901, 1423, 1396, 7779, 7780, 4932, 2190, 2287] * 20
+    newick = "Leaf_0 [{}]:0.1".format(taxids[0])
+    for i, t in enumerate(taxids[1:], 1):
+        newick = "({},Leaf_{} [{}]:0.1):0.1".format(newick, i, t)
+    newick = newick[:newick.rindex(':')] + ";"
+    check_names(newick, taxonomy)
+    check_root(newick, taxonomy)
+
+    # and the same the other way around, with the deep side on the right
+    newick = "Leaf_0 [{}]:0.1".format(taxids[0])
+    for i, t in enumerate(taxids[1:], 1):
+        newick = "(Leaf_{} [{}]:0.1,{}):0.1".format(i, t, newick)
+    newick = newick[:newick.rindex(':')] + ";"
+    check_names(newick, taxonomy)
+    check_root(newick, taxonomy)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_synthetic_trees(tmp_path, seed):
+    dbfile = str(tmp_path / "taxonomy.sqlite")
+    species, parents = make_taxonomy(dbfile, 200, seed)
+    # swap more leaves than the benchmarks do, so more of the clades conflict
+    newick, nedges = make_tree(species, parents, seed, shuffle=0.1)
+    with synthetic_taxonomy(dbfile):
+        check_names(newick, dbfile)
+        check_root(newick, dbfile)
@@ -0,0 +1,49 @@
+"""
+Check that the modules can be imported without using the taxonomy database, and that the pbj_placer.py subcommands
+start quickly (see benchmarks/startup.py). The budget is generous, so this only fails if something slow is imported
+or run when a script starts.
+"""
+
+import os
+import pytest
+
+from benchmarks.startup import modules, check_import, startup_time, commands
+
+# the startup time budget for each subcommand, in seconds
+budget = 2.0
+
+# the scripts that don't need numpy until they do some work
+without_numpy = ['pbj_placer', 'rename_tree_leaves', 'fastq2ids', 'trim_tree', 'print_tree_children']
+
+_stub_taxon = """
+def get_taxonomy_db(*args, **kwargs):
+    raise RuntimeError('the taxonomy database was used when the script started')
+
+get_taxonomy = get_taxonomy_db
+"""
+
+
+@pytest.mark.parametrize('module', modules())
+def test_import(module):
+    result = check_import(module)
+    assert result['ok'], result.get('error')
+    if module in without_numpy:
+        assert not result['numpy']
+
+
+@pytest.fixture
+def stub_taxon(tmp_path, monkeypatch):
+    """
+    Put a taxon module that fails if it is used first on the path of the scripts we run
+    """
+
+    (tmp_path / "taxon.py").write_text(_stub_taxon)
+    path = [str(tmp_path)] + [p for p in [os.environ.get('PYTHONPATH')] if p]
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(path))
+
+
+@pytest.mark.parametrize('command', commands)
+def test_startup_time(stub_taxon, command):
+    seconds = startup_time(command, repeat=3)
+    assert seconds is not None, "pbj_placer.py {} -h failed".format(command)
+    assert seconds < budget
@@ -0,0 +1,96 @@
+"""
+Check that trim_tree.py trims the tree the same way as the original version, which wrote the tree with ete3's
+is_leaf_fn and read it back, whether we trim at one level or at several levels at once.
+"""
+
+import pytest
+from ete3 import Tree
+from ete3.parser.newick import NewickError
+
+import rename_tree_leaves
+import trim_tree
+from arraytree import parse_newick, newick_name
+from benchmarks.generate import make_taxonomy, make_tree
+from benchmarks.taxonomy import synthetic_taxonomy
+
+ranks = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+
+def old_trim(newick, rank, keep_leaves=False):
+    """
+    trim_tree.py as it was: the tree and the leaves it wrote. That could not read back its own tree if any leaf was
+    not below a node at this level (ete3 writes those leaves as empty internal nodes), so with keep_leaves those
+    leaves stay leaves, which is what trim_tree.py does now.
+    """
+
+    tag = "r_{}".format(rank)
+    tree = Tree(newick, quoted_node_names=True, format=1)
+    if keep_leaves:
+        trimmed = Tree(tree.write(is_leaf_fn=lambda n: tag in n.name or n.is_leaf()))
+    else:
+        trimmed = Tree(tree.write(is_leaf_fn=lambda n: tag in n.name))
+    return trimmed.write(format=1), [n.name for n in trimmed.get_leaves()]
+
+
+def new_trim(tree):
+    return tree.write(format=1), [newick_name(n.name) for n in tree.get_leaves()]
+
+
+@pytest.fixture(scope='module', params=[1, 2])
+def renamed(request, tmp_path_factory):
+    """
+    A synthetic tree that has been renamed and rerooted by rename_tree_leaves.py
+    """
+
+    dbfile = str(tmp_path_factory.mktemp("taxonomy") / "taxonomy.sqlite")
+    species, parents = make_taxonomy(dbfile, 300, request.param)
+    newick = make_tree(species, parents, request.param, shuffle=0.05)[0]
+    with synthetic_taxonomy(dbfile):
+        tree = rename_tree_leaves.rename_nodes_ncbi(parse_newick(newick))
+        tree = rename_tree_leaves.reroot_tree(tree)
+    return tree.write(format=1)
+
+
+# every leaf is below a node at each of these levels, so the old trim_tree.py could trim it. phylum is below class on
+# one side of the tree, as the names don't have to follow the taxonomy
+covered = ("(((A [1]:0.1,B:0.2)X r_class b_0:0.3,(C:0.1,D:0.1)Y r_class b_1:0.2)Z r_phylum b_2:0.1,"
+           "((E:0.1,F:0.1)W r_phylum b_3:0.1,(G:0.5,H:0.25)U r_phylum b_4:0.5)V r_class b_5:0.2)Root b_6;")
+
+
+@pytest.mark.parametrize('rank', ['phylum', 'class'])
+def test_trim_tree(rank):
+    assert new_trim(trim_tree.trim_tree(parse_newick(covered), rank)) == old_trim(covered, rank)
+
+
+def test_trim_ranks():
+    trimmed = trim_tree.trim_ranks(parse_newick(covered), ['phylum', 'class'])
+    assert list(trimmed) == ['phylum', 'class']
+    for rank, tree in trimmed.items():
+        assert new_trim(tree) == old_trim(covered, rank)
+    assert new_trim(trimmed['phylum']) == ("(Z r_phylum b_2:0.1,(W r_phylum b_3:0.1,U r_phylum b_4:0.5):0.2);",
+                                           ["Z r_phylum b_2", "W r_phylum b_3", "U r_phylum b_4"])
+
+
+def test_uncovered_leaves():
+    # the old trim_tree.py fails on these, and now the leaves stay as they are
+    for rank in ['order', 'genus']:
+        with pytest.raises(NewickError):
+            old_trim(covered, rank)
+    trimmed = trim_tree.trim_ranks(parse_newick(covered), ['order', 'genus'])
+    for rank, tree in trimmed.items():
+        assert new_trim(tree) == old_trim(covered, rank, keep_leaves=True)
+        assert tree.write(format=1) == ("(((A _1_:0.1,B:0.2):0.3,(C:0.1,D:0.1):0.2):0.1,"
+                                        "((E:0.1,F:0.1):0.1,(G:0.5,H:0.25):0.5):0.2);")
+
+
+@pytest.mark.parametrize('rank', ranks)
+def test_trim_tree_synthetic(renamed, rank):
+    expected = old_trim(renamed, rank, keep_leaves=True)
+    assert new_trim(trim_tree.trim_tree(parse_newick(renamed), rank)) == expected
+
+
+def test_trim_ranks_synthetic(renamed):
+    trimmed = trim_tree.trim_ranks(parse_newick(renamed), ranks)
+    assert list(trimmed) == ranks
+    for rank in ranks:
+        assert new_trim(trimmed[rank]) == old_trim(renamed, rank, keep_leaves=True)
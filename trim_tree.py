@@ -1,38 +1,102 @@
 """
-Trim a tree at a given phylogenetic leaf e.g. phylum and write a new leaf list
+Trim a tree at one or more phylogenetic levels (e.g. phylum) and write a new tree and leaf list for each of them
 """
 
 import os
 import sys
 import argparse
-from ete3 import Tree
+from jplace import read_jplace_header
+from arraytree import parse_newick, read_tree, newick_name
+from profiling import profiler, add_profile_arguments, start_profile, write_profile
 
-global tag 
 
 def load_jplacer(jpf):
     """
-    lo   ad the jplacer file and return the tree
+    load the jplacer file and return the tree. We skip over the placements without reading them.
     :param jpf: The jplacer file
     :return: the data structure of the tree
     """
 
-    with open(jpf, 'r') as f:
-        data = json.load(f)
-    tree = Tree(data['tree'], quoted_node_names=True, format=1)
+    data = read_jplace_header(jpf)
+    tree = parse_newick(data['tree'])
 
     return tree
 
-def is_leaf_node(node):
-    global tag
-    if tag in node.name:
-        return True
-    else:
-        return False
+
+def rank_tag(rank):
+    """
+    The tag that rename_tree_leaves.py puts in the names of the nodes at this level
+    :param rank: the phylogenetic level, e.g. phylum or r_phylum
+    :return: the tag, e.g. r_phylum
+    """
+
+    return rank if rank.startswith('r_') else "r_{}".format(rank)
+
+
+def clear_internal_names(tree):
+    """
+    Remove the names of the nodes that are not leaves. The trimmed tree used to be written without them (ete3 writes
+    the support values of internal nodes rather than their names), and we keep the output the same.
+    :param tree: the ArrayTree
+    :return: the tree
+    """
+
+    for i in range(len(tree)):
+        if tree.child_ids(i):
+            tree.names[i] = ""
+    return tree
+
+
+def trim_tree(tree, rank):
+    """
+    Trim the tree in place, so that the nodes at this level become leaves. Leaves that are not below a node at this
+    level stay as they are.
+    :param tree: the ArrayTree
+    :param rank: the phylogenetic level
+    :return: the tree
+    """
+
+    tag = rank_tag(rank)
+    tree.collapse(lambda n: tag in n.name)
+    profiler.count('nodes visited', len(tree))
+    return clear_internal_names(tree)
+
+
+def trim_ranks(tree, ranks):
+    """
+    Trim the tree at several levels, going through the tree once. As we go down the tree we keep track of the levels
+    that have already been cut off above us, so each node knows which of the trimmed trees it belongs in.
+    :param tree: the ArrayTree
+    :param ranks: the phylogenetic levels
+    :return: a dict of rank -> the trimmed ArrayTree
+    """
+
+    tags = [rank_tag(r) for r in ranks]
+    allcut = (1 << len(tags)) - 1
+    keep = [[] for t in tags]
+    visited = 0
+    # the levels that have been cut off above each node, as bits
+    stack = [(tree.root, 0)]
+    while stack:
+        i, cut = stack.pop()
+        visited += 1
+        name = tree.names[i]
+        below = cut
+        for k, t in enumerate(tags):
+            if not cut & (1 << k):
+                keep[k].append(i)
+                if t in name:
+                    below |= 1 << k
+        if below != allcut:
+            stack.extend((c, below) for c in reversed(tree.child_ids(i)))
+    profiler.count('nodes visited', visited)
+
+    return {r: clear_internal_names(tree.keep_nodes(k)) for r, k in zip(ranks, keep)}
 
 
 def write_leaves(tree, outputf):
     """
-    Write a list of all the leaves, one line per leaf.
+    Write a list of all the leaves, one line per leaf, with their names as they are in the newick file.
     :param tree: the tree
     :param outputf: the file to write
     :return:
@@ -40,7 +104,7 @@ def write_leaves(tree, outputf):
 
     with open(outputf, 'w') as out:
         for n in tree.get_leaves():
-            out.write("{}\n".format(n.name))
+            out.write("{}\n".format(newick_name(n.name)))
 
 
 def write_tree(tree, outputf):
@@ -56,24 +120,40 @@ def write_tree(tree, outputf):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="trim tree")
     parser.add_argument('-t', help='tree file to trim', required=True)
-    parser.add_argument('-p', help='phylogenetic level to trim at', required=True)
+    parser.add_argument('-p', help='phylogenetic level to trim at. You can use more than one -p to trim at several ' +
+                                   'levels at once, and then the level is added to the names of the output files ' +
+                                   '(e.g. trimmed.phylum.nwk)', required=True, action='append')
     parser.add_argument('-o', help='output tree to write')
     parser.add_argument('-l', help='list of leaves to write')
     parser.add_argument('-j', help='tree is a jplacer file. Default is to assume tree will be a newick file', action='store_true', default=False)
     parser.add_argument('-v', help='verbose output', action="store_true")
+    add_profile_arguments(parser)
     args = parser.parse_args()
-
-    if args.j:
-        tree = load_jplacer(args.t)
-    else:
-        tree = Tree(args.t, quoted_node_names=True, format=1)
-
-    tag = "r_{}".format(args.p)
-
-    trimmed = Tree( tree.write(is_leaf_fn=is_leaf_node) )
-
-
-    if args.o:
-        write_tree(trimmed, args.o)
-    if args.l:
-        write_leaves(trimmed, args.l)
+    start_profile(args)
+
+    with profiler.stage('read_tree'):
+        if args.j:
+            tree = load_jplacer(args.t)
+        else:
+            tree = read_tree(args.t)
+
+    ranks = list(dict.fromkeys(args.p))
+    with profiler.stage('trim'):
+        if len(ranks) == 1:
+            trimmed = {ranks[0]: trim_tree(tree, ranks[0])}
+        else:
+            trimmed = trim_ranks(tree, ranks)
+
+    with profiler.stage('write'):
+        for rank, t in trimmed.items():
+            if args.v:
+                sys.stderr.write("Trimmed the tree at {} to {} leaves\n".format(rank, len(t.get_leaves())))
+            for outputf, writer in ((args.o, write_tree), (args.l, write_leaves)):
+                if not outputf:
+                    continue
+                if len(ranks) > 1:
+                    root, ext = os.path.splitext(outputf)
+                    outputf = "{}.{}{}".format(root, rank_tag(rank).replace('r_', '', 1), ext)
+                writer(t, outputf)
+
+    write_profile(args)